@@ -2,8 +2,25 @@
 Core module cho hệ thống phát hiện và phân loại trái cây
 """
 
-from .detection_model import DetectionModel
+from .detection_model import DetectionModel, DetectionClient
 from .classification import FruitClassifier
+from .backends import (
+    InferenceBackend,
+    UltralyticsBackend,
+    OnnxRuntimeBackend,
+    create_backend
+)
+from .scheduler import BatchScheduler
+from .quality_model import QualityModel
+from .log import configure_logging, get_logger
+from .rules import RuleError, RuleSet, RuleWatcher, load_ruleset, export_rules
+from .quantization import quantize_model, evaluate_quantization
+from .fruit_head import (
+    build_pseudo_label_dataset,
+    make_synthetic_dataset,
+    train_fruit_head,
+    evaluate_fruit_head
+)
 from .config import (
     QUALITY_COLORS,
     QUALITY_COLORS_BGR,
@@ -20,7 +37,27 @@ __author__ = "Hệ Thống Phân Loại Nông Sản"
 
 __all__ = [
     'DetectionModel',
+    'DetectionClient',
     'FruitClassifier',
+    'InferenceBackend',
+    'UltralyticsBackend',
+    'OnnxRuntimeBackend',
+    'create_backend',
+    'BatchScheduler',
+    'QualityModel',
+    'configure_logging',
+    'get_logger',
+    'RuleError',
+    'RuleSet',
+    'RuleWatcher',
+    'load_ruleset',
+    'export_rules',
+    'quantize_model',
+    'evaluate_quantization',
+    'build_pseudo_label_dataset',
+    'make_synthetic_dataset',
+    'train_fruit_head',
+    'evaluate_fruit_head',
     'QUALITY_COLORS',
     'QUALITY_COLORS_BGR',
     'SIZE_CATEGORIES',
@@ -0,0 +1,446 @@
+"""
+Các backend suy luận cho DetectionModel
+"""
+import ast
+import copy
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .config import MODELS_DIR
+from .log import get_logger
+from .model_cache import disable_network
+
+logger = get_logger('core.backends')
+
+
+# ============================================================================
+# KẾT QUẢ DẠNG NUMPY (tương thích giao diện Results/Boxes của ultralytics)
+# ============================================================================
+
+class NumpyBoxes:
+    """Danh sách bounding box dạng NumPy: mỗi hàng là x1, y1, x2, y2, conf, cls"""
+
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5]
+
+    def cpu(self):
+        """Dữ liệu đã nằm trên host"""
+        return self
+
+    def numpy(self):
+        """Dữ liệu đã là NumPy"""
+        return self
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return NumpyBoxes(self.data[index])
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield NumpyBoxes(self.data[i:i + 1])
+
+
+class DetectionResult:
+    """Kết quả phát hiện của một ảnh (boxes, names, orig_shape)"""
+
+    def __init__(self, boxes, names, orig_shape):
+        self.boxes = boxes
+        self.names = names
+        self.orig_shape = orig_shape
+
+
+def result_to_arrays(result):
+    """Lấy (xyxy, conf, cls) dạng NumPy từ một kết quả, chỉ chuyển về host một lần"""
+    if result is None or len(result.boxes) == 0:
+        return (np.empty((0, 4), dtype=np.float32),
+                np.empty(0, dtype=np.float32),
+                np.empty(0, dtype=np.int64))
+
+    boxes = result.boxes.cpu().numpy()
+    return (np.asarray(boxes.xyxy, dtype=np.float32),
+            np.asarray(boxes.conf, dtype=np.float32),
+            np.asarray(boxes.cls).astype(np.int64))
+
+
+# ============================================================================
+# HÀM TIỆN ÍCH: LETTERBOX VÀ NMS BẰNG NUMPY
+# ============================================================================
+
+def letterbox(image, new_shape=(640, 640), color=(114, 114, 114), out=None):
+    """Resize giữ tỷ lệ và thêm viền cho vừa new_shape (h, w)
+
+    Trả về (ảnh, gain, (pad_x, pad_y)). Nếu truyền out thì ghi thẳng vào buffer đó.
+    """
+    h0, w0 = image.shape[:2]
+    new_h, new_w = new_shape
+
+    gain = min(new_h / h0, new_w / w0)
+    resized_w, resized_h = int(round(w0 * gain)), int(round(h0 * gain))
+    pad_x = int(round((new_w - resized_w) / 2 - 0.1))
+    pad_y = int(round((new_h - resized_h) / 2 - 0.1))
+
+    if out is None:
+        out = np.empty((new_h, new_w, 3), dtype=np.uint8)
+    out[...] = color
+
+    if (resized_w, resized_h) != (w0, h0):
+        interpolation = cv2.INTER_AREA if gain < 1.0 else cv2.INTER_LINEAR
+        image = cv2.resize(image, (resized_w, resized_h), interpolation=interpolation)
+    out[pad_y:pad_y + resized_h, pad_x:pad_x + resized_w] = image
+
+    return out, gain, (pad_x, pad_y)
+
+
+def to_input_tensor(image, input_shape, out, canvas=None):
+    """Letterbox ảnh BGR và ghi vào tensor RGB CHW float32 [0, 1] (out)"""
+    canvas, gain, pad = letterbox(image, input_shape, out=canvas)
+    np.multiply(canvas[..., ::-1].transpose(2, 0, 1), 1 / 255.0, out=out, casting='unsafe')
+    return gain, pad
+
+
+def scale_boxes(xyxy, gain, pad, orig_shape):
+    """Chuyển tọa độ box từ ảnh letterbox về ảnh gốc"""
+    boxes = np.array(xyxy, dtype=np.float32).reshape(-1, 4)
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= gain
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+    return boxes
+
+
+def nms(boxes, scores, iou_threshold=0.7):
+    """Non-maximum suppression tham lam, trả về chỉ số các box được giữ"""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        inter_w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        inter_h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+
+        order = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold=0.7):
+    """NMS theo từng lớp (dịch box theo chỉ số lớp để các lớp không chồng nhau)"""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = class_ids.astype(np.float32)[:, None] * 7680.0
+    return nms(boxes + offsets, scores, iou_threshold)
+
+
+# ============================================================================
+# BACKEND
+# ============================================================================
+
+class InferenceBackend:
+    """Giao diện chung của một backend suy luận"""
+
+    name = 'base'
+
+    def __init__(self):
+        self.names = {}
+        self.model_name = None
+        self.imgsz = 640
+
+    def load(self, model_path):
+        """Tải mô hình từ đường dẫn"""
+        raise NotImplementedError
+
+    def predict(self, images, confidence=0.5, classes=None, imgsz=None):
+        """Dự đoán trên danh sách ảnh BGR, trả về một kết quả cho mỗi ảnh
+
+        classes: danh sách chỉ số lớp cần giữ (lọc trước NMS), None = tất cả.
+        imgsz: cạnh đầu vào cho lần gọi này, None = kích thước của mô hình.
+        """
+        raise NotImplementedError
+
+    def is_loaded(self):
+        """Kiểm tra backend đã có mô hình chưa"""
+        return False
+
+
+class UltralyticsBackend(InferenceBackend):
+    """Backend mặc định: ultralytics YOLO trên PyTorch
+
+    An toàn khi dùng chung giữa nhiều luồng: mỗi luồng có một bản sao nông của
+    YOLO với predictor riêng (tham số, nguồn ảnh, kết quả), còn trọng số nn.Module
+    là một bản dùng chung. Chỉ bước khởi tạo predictor (gộp Conv+BN, chuyển thiết bị
+    trên trọng số chung) cần khóa; các lượt forward chạy song song vì PyTorch nhả GIL.
+    """
+
+    name = 'ultralytics'
+
+    def __init__(self):
+        super().__init__()
+        self.model = None
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+
+    def load(self, model_path):
+        """Tải mô hình YOLO (.pt) bằng ultralytics, chỉ từ file cục bộ"""
+        if not Path(model_path).exists():
+            # YOLO('ten.pt') với file không tồn tại sẽ tải từ internet
+            raise FileNotFoundError(f"Không tìm thấy mô hình: {model_path}")
+
+        disable_network()
+        from ultralytics import YOLO
+
+        self.model = YOLO(str(model_path))
+        self._local = threading.local()
+        self.model_name = os.path.basename(str(model_path))
+        self.names = self.model.names
+
+        imgsz = self.model.overrides.get('imgsz', 640)
+        self.imgsz = imgsz[0] if isinstance(imgsz, (list, tuple)) else int(imgsz)
+        return True
+
+    def _thread_model(self):
+        """Bản YOLO của luồng hiện tại (dùng chung trọng số với self.model)"""
+        model = getattr(self._local, 'model', None)
+        if model is None:
+            with self._setup_lock:
+                model = copy.copy(self.model)
+                model.predictor = None
+                model.overrides = dict(self.model.overrides)
+            self._local.model = model
+        return model
+
+    def predict(self, images, confidence=0.5, classes=None, imgsz=None):
+        """Dự đoán bằng YOLO, trả về danh sách Results của ultralytics"""
+        model = self._thread_model()
+        options = {'imgsz': imgsz} if imgsz else {}
+
+        if model.predictor is None:
+            # Lần đầu của luồng: predictor được tạo và thiết lập trên trọng số chung
+            with self._setup_lock:
+                results = model(list(images), conf=confidence, classes=classes,
+                                verbose=False, **options)
+        else:
+            results = model(list(images), conf=confidence, classes=classes,
+                            verbose=False, **options)
+        return list(results) if results else []
+
+    def is_loaded(self):
+        return self.model is not None
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """Backend ONNX Runtime trên CPU: letterbox và NMS bằng NumPy, không cần PyTorch"""
+
+    name = 'onnxruntime'
+
+    def __init__(self, num_threads=None, iou_threshold=0.7, max_det=300):
+        super().__init__()
+        self.session = None
+        self.input_name = None
+        self.input_shape = (640, 640)
+        self.fixed_batch = None
+        self.dynamic_shape = False
+        self.num_threads = num_threads
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+
+        # Buffer cấp phát sẵn, dùng lại giữa các lần gọi (riêng cho mỗi luồng;
+        # InferenceSession.run an toàn luồng và nhả GIL nên các luồng chạy song song)
+        self._local = threading.local()
+
+    @staticmethod
+    def export(weights_path, imgsz=640, output_dir=MODELS_DIR):
+        """Xuất mô hình YOLO .pt sang ONNX (batch động) vào output_dir
+
+        ultralytics ghi <stem>.onnx cạnh file trọng số, nên xuất từ bản sao trong
+        thư mục tạm: file .onnx sẵn có cạnh trọng số gốc không bị ghi đè hay xóa.
+        """
+        weights_path = Path(weights_path)
+        onnx_path = Path(output_dir) / f"{weights_path.stem}.onnx"
+        if onnx_path.exists():
+            return onnx_path
+
+        if not weights_path.exists():
+            raise FileNotFoundError(f"Không tìm thấy mô hình: {weights_path}")
+
+        disable_network()
+        from ultralytics import YOLO
+
+        logger.info("Đang xuất %s sang ONNX...", weights_path.name)
+        onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=onnx_path.parent) as temp_dir:
+            source = Path(temp_dir) / weights_path.name
+            shutil.copy2(weights_path, source)
+            exported = YOLO(str(source)).export(format='onnx', imgsz=imgsz, dynamic=True)
+            shutil.move(str(exported), str(onnx_path))
+
+        logger.info("Đã xuất mô hình ONNX: %s", onnx_path)
+        return onnx_path
+
+    def load(self, model_path):
+        """Tải mô hình ONNX (tự xuất từ .pt nếu cần)"""
+        import onnxruntime as ort
+
+        model_path = Path(model_path)
+        if model_path.suffix == '.pt':
+            model_path = self.export(model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.model_name = model_path.name
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        self.fixed_batch = batch if isinstance(batch, int) else None
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.dynamic_shape = not isinstance(height, int) or not isinstance(width, int)
+        if self.dynamic_shape:
+            height, width = ast.literal_eval(metadata.get('imgsz', '[640, 640]'))
+        self.input_shape = (int(height), int(width))
+        self.imgsz = max(self.input_shape)
+
+        if 'names' in metadata:
+            self.names = ast.literal_eval(metadata['names'])
+        else:
+            num_classes = self.session.get_outputs()[0].shape[1] - 4
+            self.names = {i: str(i) for i in range(num_classes)}
+
+        self._local = threading.local()
+        return True
+
+    def _input_shape_for(self, imgsz=None):
+        """Kích thước (h, w) đầu vào: chỉ đổi được khi mô hình xuất với kích thước động"""
+        if not imgsz or not self.dynamic_shape:
+            return self.input_shape
+        side = max(32, int(np.ceil(imgsz / 32)) * 32)
+        return (side, side)
+
+    def _input_buffer(self, batch_size, input_shape):
+        """Lấy (tensor đầu vào, ảnh letterbox) cấp phát sẵn của luồng hiện tại
+
+        Chỉ cấp phát lại khi lô lớn hơn hoặc đổi kích thước đầu vào.
+        """
+        local = self._local
+        tensor = getattr(local, 'input', None)
+        if tensor is None or tensor.shape[0] < batch_size or tensor.shape[2:] != input_shape:
+            local.input = tensor = np.empty((batch_size, 3, *input_shape), dtype=np.float32)
+        canvas = getattr(local, 'canvas', None)
+        if canvas is None or canvas.shape[:2] != input_shape:
+            local.canvas = canvas = np.empty((*input_shape, 3), dtype=np.uint8)
+        return tensor[:batch_size], canvas
+
+    def predict(self, images, confidence=0.5, classes=None, imgsz=None):
+        """Dự đoán bằng ONNX Runtime, trả về danh sách DetectionResult"""
+        images = list(images)
+        input_shape = self._input_shape_for(imgsz)
+        step = self.fixed_batch or max(1, len(images))
+        results = []
+
+        for start in range(0, len(images), step):
+            chunk = images[start:start + step]
+            tensor, canvas = self._input_buffer(self.fixed_batch or len(chunk), input_shape)
+            transforms = []
+
+            for i, image in enumerate(chunk):
+                gain, pad = to_input_tensor(image, input_shape, tensor[i], canvas)
+                transforms.append((gain, pad, image.shape[:2]))
+
+            outputs = self.session.run(None, {self.input_name: tensor})[0]
+
+            for i, (gain, pad, orig_shape) in enumerate(transforms):
+                results.append(self._postprocess(outputs[i], confidence, gain, pad,
+                                                 orig_shape, classes))
+
+        return results
+
+    def _postprocess(self, prediction, confidence, gain, pad, orig_shape, classes=None):
+        """Giải mã đầu ra YOLOv8 (4 + nc, anchors) thành DetectionResult"""
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+
+        if classes is not None:
+            # Chỉ chấm điểm các lớp được chọn, lớp khác không vào NMS
+            class_index = np.asarray(classes, dtype=np.int64)
+            if class_index.size == 0:
+                return DetectionResult(NumpyBoxes(np.empty((0, 6))), self.names, orig_shape)
+            if np.array_equal(class_index, np.arange(scores.shape[1])):
+                # Giữ mọi lớp (vd. mô hình chỉ có lớp trái cây): không cần chép cột điểm
+                classes = None
+            else:
+                scores = scores[:, class_index]
+
+        class_ids = scores.argmax(axis=1)
+        conf = scores[np.arange(len(scores)), class_ids]
+        if classes is not None:
+            class_ids = class_index[class_ids]
+        mask = conf > confidence
+
+        boxes_xywh = prediction[mask, :4]
+        conf = conf[mask]
+        class_ids = class_ids[mask]
+
+        boxes = np.empty_like(boxes_xywh)
+        boxes[:, 0] = boxes_xywh[:, 0] - boxes_xywh[:, 2] / 2
+        boxes[:, 1] = boxes_xywh[:, 1] - boxes_xywh[:, 3] / 2
+        boxes[:, 2] = boxes_xywh[:, 0] + boxes_xywh[:, 2] / 2
+        boxes[:, 3] = boxes_xywh[:, 1] + boxes_xywh[:, 3] / 2
+
+        keep = batched_nms(boxes, conf, class_ids, self.iou_threshold)[:self.max_det]
+        boxes = scale_boxes(boxes[keep], gain, pad, orig_shape)
+
+        data = np.column_stack([boxes, conf[keep], class_ids[keep]])
+        return DetectionResult(NumpyBoxes(data), self.names, orig_shape)
+
+    def is_loaded(self):
+        return self.session is not None
+
+
+BACKENDS = {
+    UltralyticsBackend.name: UltralyticsBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+
+def create_backend(name, **options):
+    """Tạo backend suy luận theo tên"""
+    if name not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {name}. Hỗ trợ: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
@@ -1,117 +1,268 @@
 """
 Logic phân loại sản phẩm - PHIÊN BẢN SỬA LỖI
 """
+import logging
 import cv2
 import numpy as np
-from collections import defaultdict
 from .config import (
     CLASSIFICATION_RULES,
     SIZE_CATEGORIES,
     QUALITY_COLORS_BGR,
     QUALITY_NAMES_VI,
     DEFAULT_SETTINGS,
-    DEBUG_COLORS
+    QUALITY_MODEL_PATH
 )
+from .log import get_logger
+from .rules import RuleSet, RuleWatcher, load_ruleset
+from .features import (
+    CropFeatures,
+    FrameFeatures,
+    convert_region,
+    hoeffding_bound,
+    hoeffding_sample_size,
+    should_use_frame_features
+)
+
+logger = get_logger('core.classification')
 
 
 class FruitClassifier:
     """Lớp phân loại trái cây với phân loại màu HSV cải tiến"""
 
     def __init__(self):
-        self.rules = CLASSIFICATION_RULES
+        # Quy tắc màu biên dịch một lần thành bảng tra HSV; quy tắc và bảng tra
+        # nằm chung một RuleSet để thay thế nguyên khối khi nạp lại
+        self.ruleset = RuleSet(CLASSIFICATION_RULES)
         self.size_categories = SIZE_CATEGORIES
-        self.color_threshold = DEFAULT_SETTINGS['color_classification_threshold']
+        # Phân loại trên mẫu pixel (ảnh cắt lớn): sai số tỷ lệ và độ tin cậy mục tiêu
+        self.sampling = DEFAULT_SETTINGS['quality_sampling']
+        self.sampling_tolerance = DEFAULT_SETTINGS['sampling_tolerance']
+        self.sampling_confidence = DEFAULT_SETTINGS['sampling_confidence']
+        # Phân loại thô -> tinh: lượt thô trên ảnh thu nhỏ, chỉ quét đủ khi chưa rõ ràng
+        self.coarse_to_fine = DEFAULT_SETTINGS['coarse_to_fine']
+        self.coarse_size = DEFAULT_SETTINGS['coarse_size']
+        self.coarse_margin = DEFAULT_SETTINGS['coarse_margin']
+        # Mô hình CNN chất lượng (tùy chọn); quy tắc HSV là dự phòng khi chưa tải
+        # hoặc khi mô hình không đủ tin cậy
+        self.quality_model = None
+        self.quality_model_min_confidence = DEFAULT_SETTINGS['quality_model_min_confidence']
+
+    @property
+    def rules(self):
+        return self.ruleset.rules
+
+    @property
+    def rule_tables(self):
+        return self.ruleset.tables
+
+    @property
+    def color_threshold(self):
+        """Ngưỡng phân loại màu, nằm trong RuleSet để thay cùng quy tắc"""
+        return self.ruleset.threshold
+
+    @color_threshold.setter
+    def color_threshold(self, value):
+        self.ruleset = self.ruleset.with_threshold(value)
+
+    def apply_ruleset(self, ruleset):
+        """Thay quy tắc đang dùng bằng RuleSet đã biên dịch (một phép gán, an toàn giữa các luồng)
+
+        Ngưỡng nằm trong RuleSet (file không ghi ngưỡng thì là color_classification_threshold
+        trong cấu hình), nên luồng phân loại không thấy ngưỡng mới với bảng tra cũ.
+        """
+        self.ruleset = ruleset
+
+    def load_rules(self, path):
+        """Nạp quy tắc màu từ file JSON (xem core.rules)"""
+        ruleset = load_ruleset(path)
+        self.apply_ruleset(ruleset)
+        return ruleset
+
+    def watch_rules(self, path, interval=None):
+        """Nạp quy tắc từ file và tự nạp lại khi file thay đổi, trả về RuleWatcher đang chạy"""
+        return RuleWatcher(self, path, interval).start()
+
+    def load_quality_model(self, model_path=QUALITY_MODEL_PATH, runtime=None, **options):
+        """Tải mô hình CNN chất lượng (ONNX) để dùng trong classify_objects"""
+        from .quality_model import QualityModel
+
+        model = QualityModel(runtime or DEFAULT_SETTINGS['quality_model_runtime'], **options)
+        model.load(model_path)
+        self.quality_model = model
+        return model
+
+    def crop_features(self, obj_img, hsv=None, gray=None):
+        """Bộ đặc trưng dùng chung (HSV, xám, mask, trung bình) cho một ảnh cắt"""
+        return CropFeatures(obj_img, self.rule_tables, hsv, gray)
 
     def classify_quality(self, obj_img, class_name):
-        """Phân loại chất lượng dựa trên màu sắc HSV - PHIÊN BẢN SỬA LỖI"""
+        """Phân loại chất lượng dựa trên màu sắc HSV - PHIÊN BẢN SỬA LỖI
+
+        obj_img: ảnh cắt BGR hoặc CropFeatures đã tạo sẵn.
+        """
         if class_name not in self.rules:
-            if DEBUG_COLORS:
-                print(f"⚠️  Class '{class_name}' không có trong rules")
+            logger.debug("Class '%s' không có trong rules", class_name)
             return 'unknown'
 
+        features = obj_img if isinstance(obj_img, CropFeatures) else self.crop_features(obj_img)
+
         try:
             # Kiểm tra ảnh đầu vào
-            if obj_img is None or obj_img.size == 0:
-                if DEBUG_COLORS:
-                    print(f"⚠️  Ảnh rỗng cho class '{class_name}'")
+            if features.size == 0:
+                logger.debug("Ảnh rỗng cho class '%s'", class_name)
                 return 'unknown'
 
-            # Chuyển đổi sang HSV
-            hsv = cv2.cvtColor(obj_img, cv2.COLOR_BGR2HSV)
-
-            # DEBUG: Tính giá trị HSV trung bình
-            if DEBUG_COLORS:
-                h_mean = np.mean(hsv[:, :, 0])
-                s_mean = np.mean(hsv[:, :, 1])
-                v_mean = np.mean(hsv[:, :, 2])
-                print(f"\n🔍 DEBUG - {class_name}:")
-                print(f"   Kích thước ảnh: {obj_img.shape}")
-                print(f"   HSV trung bình: H={h_mean:.1f}, S={s_mean:.1f}, V={v_mean:.1f}")
-                print(f"   H range: {hsv[:, :, 0].min():.1f}-{hsv[:, :, 0].max():.1f}")
-                print(f"   S range: {hsv[:, :, 1].min():.1f}-{hsv[:, :, 1].max():.1f}")
-                print(f"   V range: {hsv[:, :, 2].min():.1f}-{hsv[:, :, 2].max():.1f}")
-
-            # Lấy quy tắc cho loại trái cây
-            rules = self.rules[class_name]
-            color_ranges = rules['color_ranges']
-
-            # Tìm màu chiếm ưu thế
-            max_ratio = 0
-            best_quality = 'unknown'
-            quality_ratios = {}
-
-            for quality, ranges_list in color_ranges.items():
-                # ranges_list là list các cặp (lower, upper)
-                total_ratio = 0
-
-                for ranges in ranges_list:
-                    # ranges là một cặp (lower, upper)
-                    lower, upper = ranges
-                    lower_bound = np.array(lower, dtype=np.uint8)
-                    upper_bound = np.array(upper, dtype=np.uint8)
-
-                    # Tạo mask cho khoảng màu này
-                    mask = cv2.inRange(hsv, lower_bound, upper_bound)
-
-                    # Tính tỷ lệ pixel khớp
-                    total_pixels = obj_img.shape[0] * obj_img.shape[1]
-                    if total_pixels > 0:
-                        matching_pixels = np.sum(mask > 0)
-                        ratio = matching_pixels / total_pixels
-                        total_ratio += ratio
-
-                quality_ratios[quality] = total_ratio
-
-                if total_ratio > max_ratio:
-                    max_ratio = total_ratio
-                    best_quality = quality
-
-            # DEBUG: Hiển thị tỷ lệ các màu
-            if DEBUG_COLORS:
-                print(f"   Tỷ lệ các chất lượng:")
-                for quality, ratio in sorted(quality_ratios.items(), key=lambda x: x[1], reverse=True):
-                    if ratio > 0:
-                        print(f"     {quality}: {ratio:.3f}")
-
-            # Kiểm tra ngưỡng
-            if max_ratio > self.color_threshold:
-                if DEBUG_COLORS:
-                    print(f"   ✅ Kết quả: {best_quality} (tỷ lệ: {max_ratio:.3f})")
-                return best_quality
-            else:
-                if DEBUG_COLORS:
-                    print(f"   ⚠️  Không đạt ngưỡng: {max_ratio:.3f} < {self.color_threshold}")
+            # Thống kê HSV chỉ tính khi bật DEBUG cho module này
+            if logger.isEnabledFor(logging.DEBUG):
+                hsv = features.hsv.reshape(-1, 3)
+                means = hsv.mean(axis=0)
+                lows, highs = hsv.min(axis=0), hsv.max(axis=0)
+                logger.debug(
+                    "%s: ảnh %s, HSV trung bình H=%.1f S=%.1f V=%.1f, "
+                    "H %d-%d, S %d-%d, V %d-%d",
+                    class_name, features.hsv.shape, *means,
+                    lows[0], highs[0], lows[1], highs[1], lows[2], highs[2],
+                    extra={'data': {'class': class_name, 'hsv_mean': means.round(1).tolist(),
+                                    'hsv_min': lows.tolist(), 'hsv_max': highs.tolist()}}
+                )
+
+            if self.coarse_to_fine:
+                return self.classify_quality_coarse(features, class_name)[0]
+            if self.sampling:
+                return self.classify_quality_sampled(features, class_name)[0]
+
+            # Tỷ lệ pixel khớp của từng chất lượng: một lần tra bảng + bincount
+            # (khoảng màu chồng lấn được cộng như khi dùng cv2.inRange từng khoảng)
+            quality_ratios = features.quality_ratios(class_name)
+
+            return self._decide_quality(
+                quality_ratios,
+                lambda: self.quality_from_hue(features.fallback_hue_mean, class_name)
+            )
+
+        except Exception:
+            logger.exception("Lỗi khi phân loại chất lượng (%s)", class_name)
+            return 'unknown'
 
-                # Fallback: Phân loại dựa trên Hue trung bình
-                return self.classify_by_hue_average(hsv, class_name)
+    def classify_quality_features(self, features, class_name):
+        """Phân loại chất lượng từ đặc trưng đã tính sẵn (CropFeatures hoặc BoxFeatures)"""
+        if class_name not in self.rules or features.size == 0:
+            return 'unknown'
 
+        try:
+            quality_ratios = features.quality_ratios(class_name)
+            return self._decide_quality(
+                quality_ratios,
+                lambda: self.quality_from_hue(features.fallback_hue_mean, class_name)
+            )
         except Exception as e:
-            if DEBUG_COLORS:
-                print(f"❌ Lỗi khi phân loại chất lượng: {e}")
-                import traceback
-                traceback.print_exc()
+            logger.error("Lỗi khi phân loại chất lượng (%s): %s", class_name, e)
             return 'unknown'
 
+    def classify_quality_sampled(self, features, class_name):
+        """Phân loại chất lượng trên mẫu pixel phân tầng, có chặn sai số
+
+        Số mẫu tính theo bất đẳng thức Hoeffding từ sampling_tolerance và
+        sampling_confidence (chặn hợp trên các chất lượng; tỷ lệ của một chất
+        lượng có thể > 1 khi các khoảng chồng lấn nên miền giá trị là số khoảng
+        khớp tối đa). Nếu quyết định có thể khác khi quét đủ (tỷ lệ lớn nhất gần
+        ngưỡng, hoặc hai tỷ lệ đầu sát nhau) thì quét toàn bộ ảnh cắt.
+
+        Trả về (quality, info) với info gồm 'sampled_pixels', 'total_pixels',
+        'error_bound' (sai số tối đa của tỷ lệ, 0 khi quét đủ) và 'full_scan'.
+        """
+        table = self.rule_tables[class_name]
+        value_ranges = table.quality_multiplicity.max(axis=0).astype(np.float64)
+        hypotheses = len(table.qualities)
+
+        def fallback():
+            return self.quality_from_hue(features.fallback_hue_mean, class_name)
+
+        target = hoeffding_sample_size(self.sampling_tolerance, self.sampling_confidence,
+                                       hypotheses, max(value_ranges.max(initial=0.0), 1.0))
+        sample = features.sample_hsv(target)
+
+        if sample is not None:
+            samples = sample.shape[0] * sample.shape[1]
+            ratios = table.quality_ratios(sample)
+            bounds = {quality: hoeffding_bound(samples, self.sampling_confidence, hypotheses, value_range)
+                      for quality, value_range in zip(table.qualities, value_ranges)}
+
+            best = max(ratios, key=ratios.get)
+            lower_best = ratios[best] - bounds[best]
+            upper_others = max((ratios[q] + bounds[q] for q in ratios if q != best), default=0.0)
+            # Chắc chắn vượt ngưỡng và hơn mọi chất lượng khác, hoặc chắc chắn mọi tỷ lệ dưới ngưỡng
+            threshold = self.ruleset.threshold
+            above = lower_best > threshold and lower_best > upper_others
+            below = all(ratios[q] + bounds[q] < threshold for q in ratios)
+
+            if above or below:
+                info = {'sampled_pixels': samples, 'total_pixels': features.size,
+                        'error_bound': max(bounds.values(), default=0.0), 'full_scan': False}
+                return self._decide_quality(ratios, fallback), info
+
+        info = {'sampled_pixels': features.size, 'total_pixels': features.size,
+                'error_bound': 0.0, 'full_scan': True}
+        return self._decide_quality(features.quality_ratios(class_name), fallback), info
+
+    def classify_quality_coarse(self, features, class_name, margin=None):
+        """Phân loại thô -> tinh: lượt thô trên ảnh thu nhỏ (cạnh <= coarse_size)
+
+        Ảnh cắt được quét lại ở độ phân giải đầy đủ chỉ khi quyết định thô chưa rõ
+        ràng: tỷ lệ lớn nhất cách ngưỡng color_classification_threshold dưới margin,
+        hoặc vượt ngưỡng nhưng chênh với tỷ lệ thứ hai dưới margin. Khi mọi tỷ lệ
+        chắc chắn dưới ngưỡng, fallback Hue trung bình vẫn tính trên ảnh cắt đầy đủ
+        như classify_quality, nên hai cách chỉ khác nhau ở ước lượng tỷ lệ.
+        Trả về (quality, escalated).
+        """
+        if margin is None:
+            margin = self.coarse_margin
+
+        def fallback():
+            return self.quality_from_hue(features.fallback_hue_mean, class_name)
+
+        small = features.coarse_hsv(self.coarse_size)
+        if small is not None:
+            ratios = self.rule_tables[class_name].quality_ratios(small)
+            top = sorted(ratios.values(), reverse=True) + [0.0, 0.0]
+            # Thứ tự hai tỷ lệ đầu chỉ quan trọng khi tỷ lệ lớn nhất vượt ngưỡng
+            threshold = self.ruleset.threshold
+            ambiguous = (abs(top[0] - threshold) < margin
+                         or (top[0] > threshold and top[0] - top[1] < margin))
+            if not ambiguous:
+                return self._decide_quality(ratios, fallback), False
+
+        return self._decide_quality(features.quality_ratios(class_name), fallback), small is not None
+
+    def _decide_quality(self, quality_ratios, fallback):
+        """Chọn chất lượng có tỷ lệ lớn nhất nếu vượt ngưỡng, ngược lại gọi fallback()"""
+        # Tìm màu chiếm ưu thế
+        max_ratio = 0
+        best_quality = 'unknown'
+
+        for quality, total_ratio in quality_ratios.items():
+            if total_ratio > max_ratio:
+                max_ratio = total_ratio
+                best_quality = quality
+
+        if logger.isEnabledFor(logging.DEBUG):
+            ranked = sorted(((q, r) for q, r in quality_ratios.items() if r > 0),
+                            key=lambda x: x[1], reverse=True)
+            logger.debug("Tỷ lệ các chất lượng: %s",
+                         ", ".join(f"{quality}={ratio:.3f}" for quality, ratio in ranked),
+                         extra={'data': {'ratios': dict(ranked)}})
+
+        # Kiểm tra ngưỡng
+        threshold = self.ruleset.threshold
+        if max_ratio > threshold:
+            logger.debug("Kết quả: %s (tỷ lệ: %.3f)", best_quality, max_ratio)
+            return best_quality
+
+        logger.debug("Không đạt ngưỡng: %.3f < %s", max_ratio, threshold)
+
+        # Fallback: Phân loại dựa trên Hue trung bình
+        return fallback()
+
     def classify_by_hue_average(self, hsv, class_name):
         """Phân loại dựa trên Hue trung bình (fallback)"""
         try:
@@ -122,8 +273,16 @@ class FruitClassifier:
             else:
                 hue_mean = np.mean(hsv[:, :, 0])
 
-            if DEBUG_COLORS:
-                print(f"   🎨 Fallback - Hue trung bình: {hue_mean:.1f}")
+            return self.quality_from_hue(hue_mean, class_name)
+
+        except Exception as e:
+            logger.error("Lỗi fallback (%s): %s", class_name, e)
+            return 'unknown'
+
+    def quality_from_hue(self, hue_mean, class_name):
+        """Chất lượng theo Hue trung bình của các pixel hợp lệ"""
+        try:
+            logger.debug("Fallback - Hue trung bình: %.1f", hue_mean)
 
             # Phân loại dựa trên Hue
             if class_name == 'tomato':
@@ -169,8 +328,7 @@ class FruitClassifier:
             return 'unknown'
 
         except Exception as e:
-            if DEBUG_COLORS:
-                print(f"❌ Lỗi fallback: {e}")
+            logger.error("Lỗi fallback (%s): %s", class_name, e)
             return 'unknown'
 
     def classify_size(self, size_px):
@@ -181,16 +339,28 @@ class FruitClassifier:
         return 'Không xác định'
 
     def calculate_quality_score(self, obj_img):
-        """Tính điểm chất lượng tổng thể"""
+        """Tính điểm chất lượng tổng thể (obj_img: ảnh cắt BGR hoặc CropFeatures)"""
+        features = obj_img if isinstance(obj_img, CropFeatures) else self.crop_features(obj_img)
+        return self.calculate_quality_score_features(features)
+
+    def calculate_quality_score_features(self, features):
+        """Điểm chất lượng từ đặc trưng đã tính sẵn (độ lệch chuẩn, trung bình xám, S, H)"""
         try:
-            if obj_img.size == 0:
+            if features.size == 0:
                 return 0.5
+            return self.score_from_stats(features.gray_std, features.gray_mean,
+                                         features.saturation_mean, features.hue_mean)
+
+        except Exception as e:
+            logger.error("Lỗi tính điểm chất lượng: %s", e)
+            return 0.5
 
+    def score_from_stats(self, contrast, brightness, saturation, hue_mean):
+        """Điểm chất lượng tổng thể từ độ tương phản, độ sáng, độ bão hòa và Hue trung bình"""
+        try:
             score = 0.5  # Điểm cơ bản
 
             # 1. Đánh giá độ tương phản
-            gray = cv2.cvtColor(obj_img, cv2.COLOR_BGR2GRAY)
-            contrast = gray.std()
             if contrast > 60:
                 score += 0.2
             elif contrast > 40:
@@ -199,7 +369,6 @@ class FruitClassifier:
                 score -= 0.1
 
             # 2. Đánh giá độ sáng
-            brightness = gray.mean()
             if 120 < brightness < 180:
                 score += 0.2
             elif 80 < brightness < 220:
@@ -208,15 +377,12 @@ class FruitClassifier:
                 score -= 0.1
 
             # 3. Đánh giá độ bão hòa màu
-            hsv = cv2.cvtColor(obj_img, cv2.COLOR_BGR2HSV)
-            saturation = hsv[:, :, 1].mean()
             if saturation > 100:
                 score += 0.1
             elif saturation < 30:
                 score -= 0.1
 
             # 4. Đánh giá màu sắc trung bình
-            hue_mean = np.mean(hsv[:, :, 0])
             # Màu "tươi" (đỏ, cam, vàng) có điểm cao hơn
             if (hue_mean < 25 or hue_mean > 160):  # Đỏ
                 score += 0.1
@@ -227,8 +393,7 @@ class FruitClassifier:
             return max(0.0, min(1.0, score))
 
         except Exception as e:
-            if DEBUG_COLORS:
-                print(f"Lỗi tính điểm chất lượng: {e}")
+            logger.error("Lỗi tính điểm chất lượng: %s", e)
             return 0.5
 
     def get_quality_color_bgr(self, quality):
@@ -241,17 +406,179 @@ class FruitClassifier:
 
     def analyze_object(self, obj_img, class_name, bbox, enable_quality=True, enable_size=True):
         """Phân tích chi tiết một đối tượng"""
-        x1, y1, x2, y2 = bbox
+        # Một bộ đặc trưng cho cả phân loại và điểm chất lượng (HSV/xám chỉ tính một lần)
+        features = self.crop_features(obj_img)
+        quality = self.classify_quality(features, class_name) if enable_quality else 'unknown'
+        quality_score = self.calculate_quality_score_features(features)
+
+        return self.object_result(class_name, bbox, quality, quality_score, enable_size)
+
+    def analyze_features(self, features, class_name, bbox, enable_quality=True, enable_size=True):
+        """Như analyze_object nhưng dùng đặc trưng đã tính sẵn thay cho ảnh cắt"""
+        quality = self.classify_quality_features(features, class_name) if enable_quality else 'unknown'
+        quality_score = self.calculate_quality_score_features(features)
+
+        return self.object_result(class_name, bbox, quality, quality_score, enable_size)
+
+    @staticmethod
+    def _prepare_boxes(frame, boxes, class_ids, names=None):
+        """Box nguyên cắt theo khung hình và tên lớp của từng box"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4).astype(np.int64)
+        h, w = frame.shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+        class_ids = list(class_ids.tolist() if isinstance(class_ids, np.ndarray) else class_ids)
+        class_names = [names[c] for c in class_ids] if names is not None else class_ids
+        return boxes, class_names
+
+    def model_qualities(self, frames, boxes_list, class_names_list):
+        """Chất lượng từ mô hình CNN cho mọi box của nhiều khung hình trong một lượt
+
+        Ảnh cắt của tất cả khung hình được đưa vào chung các lô của mô hình. Trả về
+        danh sách mảng (mỗi khung hình một mảng), None ở box không có quy tắc màu
+        hoặc có độ tin cậy dưới quality_model_min_confidence (dùng quy tắc HSV).
+        """
+        crops, owners = [], []
+        for f, (frame, boxes, class_names) in enumerate(zip(frames, boxes_list, class_names_list)):
+            for i, ((x1, y1, x2, y2), class_name) in enumerate(zip(boxes.tolist(), class_names)):
+                if class_name in self.rules and x2 > x1 and y2 > y1:
+                    crops.append(frame[y1:y2, x1:x2])
+                    owners.append((f, i))
+
+        qualities = [np.full(len(boxes), None, dtype=object) for boxes in boxes_list]
+        if crops:
+            labels, confidence = self.quality_model.classify(crops)
+            for (f, i), label, score in zip(owners, labels, confidence):
+                if score >= self.quality_model_min_confidence:
+                    qualities[f][i] = label
+        return qualities
+
+    def classify_objects_batch(self, frames, boxes_list, class_ids_list, names=None, **options):
+        """classify_objects cho nhiều khung hình; mô hình CNN chạy chung lô cho tất cả"""
+        prepared = [self._prepare_boxes(frame, boxes, class_ids, names)
+                    for frame, boxes, class_ids in zip(frames, boxes_list, class_ids_list)]
+
+        use_model = options.pop('use_quality_model', None)
+        if use_model is None:
+            use_model = DEFAULT_SETTINGS['use_quality_model']
+        if use_model and self.quality_model is not None and options.get('enable_quality', True):
+            precomputed = self.model_qualities(frames, [b for b, _ in prepared], [n for _, n in prepared])
+        else:
+            precomputed = [None] * len(prepared)
+
+        return [self.classify_objects(frame, boxes, class_names, None, use_quality_model=False,
+                                      model_quality=model_quality, **options)
+                for frame, (boxes, class_names), model_quality in zip(frames, prepared, precomputed)]
+
+    def classify_objects(self, frame, boxes, class_ids, names=None, enable_quality=True,
+                         frame_features='auto', color_conversion='union', sampling=None,
+                         coarse_to_fine=None, use_quality_model=None, model_quality=None):
+        """Phân loại chất lượng mọi phát hiện của một khung hình trong một lần gọi
+
+        boxes: mảng (N, 4) x1, y1, x2, y2 theo pixel của frame (được làm tròn xuống
+        và cắt theo khung hình). class_ids: chỉ số lớp, đổi sang tên qua names
+        ({id: tên}); nếu names là None thì class_ids chính là tên lớp.
+        frame_features: True/False/'auto' - dùng bảng tích lũy của cả khung hình
+        (FrameFeatures) thay vì đặc trưng từng ảnh cắt.
+        color_conversion: 'union'/'frame' - chuyển HSV/xám một lần cho vùng bao các
+        box (hoặc cả khung hình), mỗi ảnh cắt là view vào đó; 'crop' - mỗi ảnh cắt
+        tự chuyển. Kết quả như nhau vì chuyển màu tính theo từng pixel.
+        sampling: phân loại ảnh cắt trên mẫu pixel (None = self.sampling).
+        coarse_to_fine: lượt thô trên ảnh thu nhỏ trước (None = self.coarse_to_fine),
+        được ưu tiên hơn sampling. Cả hai cần đặc trưng từng ảnh cắt: khi bật,
+        frame_features='auto' chọn ảnh cắt; với frame_features=True thì chúng bị bỏ
+        qua (có cảnh báo) vì bảng tích lũy đã cho tỷ lệ chính xác.
+        use_quality_model: dùng mô hình CNN chất lượng nếu đã tải (None = cài đặt
+        'use_quality_model'); mọi ảnh cắt của khung hình chạy chung một lô, box
+        mô hình không chắc chắn dùng quy tắc HSV. model_quality: kết quả mô hình
+        tính sẵn (classify_objects_batch).
+
+        Trả về dict mảng cùng thứ tự với boxes: 'class' (tên lớp), 'quality',
+        'quality_score', 'ratio_error' (chặn sai số tỷ lệ màu, 0 khi quét đủ),
+        'escalated' (ảnh cắt phải quét lại ở độ phân giải đầy đủ) và
+        'from_model' (chất lượng lấy từ mô hình CNN).
+        """
+        if sampling is None:
+            sampling = self.sampling
+        if coarse_to_fine is None:
+            coarse_to_fine = self.coarse_to_fine
+        if use_quality_model is None:
+            use_quality_model = DEFAULT_SETTINGS['use_quality_model']
+
+        boxes, class_names = self._prepare_boxes(frame, boxes, class_ids, names)
+        count = len(boxes)
+
+        if (model_quality is None and use_quality_model and enable_quality
+                and self.quality_model is not None):
+            model_quality = self.model_qualities([frame], [boxes], [class_names])[0]
+
+        converted = convert_region(frame, boxes, color_conversion)
+        if converted is not None:
+            hsv, gray, (x0, y0) = converted
+            local = boxes - np.array([x0, y0, x0, y0], dtype=np.int64)
+        else:
+            hsv = gray = None
+            local = boxes
+
+        sampling = bool(sampling and enable_quality)
+        coarse_to_fine = bool(coarse_to_fine and enable_quality)
+        if (sampling or coarse_to_fine) and frame_features == 'auto':
+            # Lấy mẫu và lượt thô cần pixel của từng ảnh cắt
+            frame_features = False
+        use_frame_features = should_use_frame_features(frame_features, frame.shape, boxes)
+        if use_frame_features and (sampling or coarse_to_fine):
+            logger.warning("frame_features=True: bỏ qua quality_sampling/coarse_to_fine "
+                           "(bảng tích lũy đã cho tỷ lệ màu chính xác)")
+            sampling = coarse_to_fine = False
+
+        if use_frame_features:
+            region = frame[y0:y0 + hsv.shape[0], x0:x0 + hsv.shape[1]] if hsv is not None else frame
+            features = FrameFeatures(region, self.rule_tables, hsv, gray).boxes(local, class_names)
+        elif hsv is not None:
+            features = [self.crop_features(frame[y1:y2, x1:x2], hsv[ly1:ly2, lx1:lx2], gray[ly1:ly2, lx1:lx2])
+                        for (x1, y1, x2, y2), (lx1, ly1, lx2, ly2) in zip(boxes.tolist(), local.tolist())]
+        else:
+            features = [self.crop_features(frame[y1:y2, x1:x2])
+                        for x1, y1, x2, y2 in boxes.tolist()]
+
+        quality = np.full(count, 'unknown', dtype=object)
+        quality_score = np.empty(count, dtype=np.float64)
+        ratio_error = np.zeros(count, dtype=np.float64)
+        escalated = np.zeros(count, dtype=bool)
+        from_model = np.zeros(count, dtype=bool)
+        for i, (class_name, feature) in enumerate(zip(class_names, features)):
+            if enable_quality:
+                reduced = (not use_frame_features and class_name in self.rules
+                           and feature.size > 0)
+                if model_quality is not None and model_quality[i] is not None:
+                    quality[i] = model_quality[i]
+                    from_model[i] = True
+                elif coarse_to_fine and reduced:
+                    quality[i], escalated[i] = self.classify_quality_coarse(feature, class_name)
+                elif sampling and reduced:
+                    quality[i], info = self.classify_quality_sampled(feature, class_name)
+                    ratio_error[i] = info['error_bound']
+                else:
+                    quality[i] = self.classify_quality_features(feature, class_name)
+            quality_score[i] = self.calculate_quality_score_features(feature)
 
-        # Tính kích thước
+        return {
+            'class': np.array(class_names, dtype=object),
+            'quality': quality,
+            'quality_score': quality_score,
+            'ratio_error': ratio_error,
+            'escalated': escalated,
+            'from_model': from_model
+        }
+
+    def object_result(self, class_name, bbox, quality, quality_score, enable_size):
+        """Dict kết quả phân tích một đối tượng"""
+        x1, y1, x2, y2 = bbox
         width = x2 - x1
         height = y2 - y1
         size_px = max(width, height)
-
-        # Phân loại
         size_category = self.classify_size(size_px) if enable_size else 'Không xác định'
-        quality = self.classify_quality(obj_img, class_name) if enable_quality else 'unknown'
-        quality_score = self.calculate_quality_score(obj_img)
 
         return {
             'class': class_name,
@@ -16,6 +16,13 @@ OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
 # Model settings
 MODEL_NAME = 'yolov8n.pt'
 MODEL_PATH = MODELS_DIR / MODEL_NAME
+ONNX_MODEL_PATH = MODEL_PATH.with_suffix('.onnx')
+QUANTIZED_MODEL_PATH = MODELS_DIR / f"{MODEL_PATH.stem}_int8.onnx"
+MODEL_CACHE_DIR = MODELS_DIR / 'cache'  # Mô hình đã gộp lớp, sẵn sàng suy luận
+FRUIT_HEAD_PATH = MODELS_DIR / f"{MODEL_PATH.stem}_fruit.pt"  # Mô hình chỉ gồm lớp trái cây
+RULES_PATH = BASE_DIR / 'data' / 'classification_rules.json'  # Quy tắc màu ngoài (tự nạp lại khi đổi)
+QUALITY_MODEL_PATH = MODELS_DIR / 'quality_cls.onnx'  # Mô hình CNN phân loại chất lượng (tùy chọn)
+DENOISE_PROFILE_PATH = MODELS_DIR / 'denoise_profile.json'  # Kết quả đo các mức khử nhiễu (denoise_tier='auto')
 
 # Màu sắc phân loại (HEX)
 QUALITY_COLORS = {
@@ -150,7 +157,48 @@ DEFAULT_SETTINGS = {
     'enable_quality_analysis': True,
     'enable_size_analysis': True,
     'selected_product': 'tomato',
-    'auto_download_model': True,
+    'use_model_cache': True,  # Dùng bản đã gộp lớp trong MODEL_CACHE_DIR (không tải qua mạng)
+    'batch_size': 8,  # Số ảnh mỗi lượt forward khi xử lý hàng loạt
+    'scheduler_max_wait_ms': 5.0,  # Thời gian tối đa gom lô khi có tải (BatchScheduler)
+    'inference_backend': 'ultralytics',  # 'ultralytics' hoặc 'onnxruntime'
+    'prefer_fruit_head': False,  # Dùng mô hình 4 lớp trái cây (FRUIT_HEAD_PATH) nếu có; chỉ bật sau khi evaluate_fruit_head đạt yêu cầu
+    'prefer_quantized_model': True,  # Dùng mô hình INT8 trong MODELS_DIR nếu có (backend ONNX)
+    'resize_mode': 'fixed',  # 'fixed' (800x600 rồi mô hình letterbox) hoặc 'model' (một lần letterbox)
+    'multi_resolution': False,  # Phát hiện trên ảnh nhỏ, phân loại màu trên ảnh gốc
+    'detection_resolution': (640, 480),  # Kích thước tối đa (w, h) của ảnh phát hiện
+    'classification_resolution': None,   # Kích thước tối đa ảnh phân loại, None = gốc
+    'tiled_inference': False,  # Chia ô ảnh độ phân giải cao thay vì thu nhỏ cả ảnh
+    'tile_size': None,         # Cạnh ô (pixel), None = kích thước đầu vào của mô hình
+    'tile_overlap': 0.2,       # Tỷ lệ chồng lấn giữa các ô
+    'max_tiles': 16,           # Số ô tối đa mỗi ảnh (vượt quá thì tăng kích thước ô)
+    'cascade': False,               # Suy luận hai tầng: chỉ chạy lại vùng chưa chắc chắn
+    'cascade_first_imgsz': 320,     # Cạnh đầu vào của tầng thứ nhất (nhanh, độ phân giải thấp)
+    'cascade_band': (0.25, 0.6),    # Khoảng độ tin cậy coi là chưa chắc chắn
+    'cascade_model': None,          # Mô hình tầng 2 (vd. yolov8s.pt), None = mô hình chính
+    'cascade_second_imgsz': None,   # Cạnh đầu vào tầng 2, None = kích thước của mô hình
+    'cascade_color_regions': True,  # Chạy lại cả vùng có màu trái cây chưa có box
+    'cascade_margin': 0.3,          # Nới rộng vùng cắt (tỷ lệ cạnh box) để có ngữ cảnh
+    'cascade_max_regions': 6,       # Số vùng tối đa chạy lại mỗi ảnh
+    'frame_features': 'auto',  # Thống kê màu theo bảng tích lũy cả khung hình: True/False/'auto'
+    'color_conversion': 'union',  # Chuyển HSV/xám một lần: 'union' (vùng bao box), 'frame' hoặc 'crop'
+    'quality_sampling': False,    # Ước lượng tỷ lệ màu trên mẫu pixel (ảnh cắt lớn)
+    'sampling_tolerance': 0.01,   # Sai số tỷ lệ cho phép khi lấy mẫu
+    'sampling_confidence': 0.95,  # Xác suất sai số nằm trong sampling_tolerance
+    'coarse_to_fine': False,  # Phân loại trên ảnh thu nhỏ, chỉ quét đủ ảnh cắt chưa rõ ràng
+    'coarse_size': 32,        # Cạnh dài nhất (pixel) của ảnh thu nhỏ ở lượt thô
+    'coarse_margin': 0.1,     # Hai tỷ lệ đầu (hoặc tỷ lệ lớn nhất và ngưỡng) sát hơn mức này thì quét lại
+    'rules_reload_interval': 1.0,  # Chu kỳ (giây) kiểm tra file quy tắc màu RULES_PATH
+    'run_cache_size': 32,  # Số ảnh gần nhất giữ cả khung hình để phân loại lại không cần chạy YOLO
+    'run_cache_box_entries': 10000,  # Số ảnh giữ box (ảnh cũ hơn run_cache_size được đọc lại khi phân loại lại)
+    'use_quality_model': True,          # Dùng mô hình CNN chất lượng nếu đã tải (QUALITY_MODEL_PATH)
+    'quality_model_runtime': 'onnxruntime',  # 'onnxruntime' hoặc 'opencv' (cv2.dnn)
+    'quality_model_batch': 32,          # Số ảnh cắt mỗi lô của mô hình chất lượng
+    'quality_model_input': 96,          # Cạnh đầu vào khi file mô hình không ghi kích thước
+    'quality_model_min_confidence': 0.5,  # Dưới ngưỡng này dùng quy tắc HSV
+    'preprocessing_pipeline': ['resize', 'enhance_contrast', 'denoise', 'normalize'],  # Bước tiền xử lý (processing.pipeline)
+    'pipeline_strip_rows': 64,  # Số hàng mỗi dải khi chạy gộp các bước theo pixel
+    'denoise_tier': 'auto',     # 'none', 'median', 'bilateral', 'nlm_downsampled', 'nlm' hoặc 'auto'
+    'denoise_tolerance': 0.02,  # Mức giảm trùng khớp tối đa so với NLM đầy đủ khi chọn mức 'auto'
     'color_classification_threshold': 0.15  # Ngưỡng phân loại màu (15%)
 }
 
@@ -203,25 +251,15 @@ def get_hsv_description(h, s, v):
     return " ".join(descriptions)
 
 # ============================================================================
-# CẤU HÌNH DEBUG VÀ HIỂN THỊ
+# CẤU HÌNH LOG (xem core/log.py)
 # ============================================================================
 
-DEBUG_COLORS = True  # Bật/tắt debug màu sắc
-
-if DEBUG_COLORS:
-    print("\n" + "="*60)
-    print("CẤU HÌNH PHÂN LOẠI MÀU HSV - ĐÃ SỬA LỖI")
-    print("="*60)
-
-    for product, rules in CLASSIFICATION_RULES.items():
-        print(f"\n📦 {PRODUCT_NAMES_VI.get(product, product).upper()}:")
-        for quality, ranges in rules['color_ranges'].items():
-            print(f"   {QUALITY_NAMES_VI.get(quality, quality)}:")
-            for lower, upper in ranges:
-                print(f"      {lower} -> {upper}")
-
-    print("\n📊 MÀU SẮC PHÂN LOẠI:")
-    for quality, color in QUALITY_COLORS.items():
-        print(f"   {QUALITY_NAMES_VI.get(quality, quality):12s}: {color}")
-
-    print("="*60 + "\n")
\ No newline at end of file
+LOG_SETTINGS = {
+    'level': 'INFO',         # Mức log chung của logger 'fruit' (debug đường nóng ở mức DEBUG)
+    'levels': {},            # Mức riêng từng module, vd. {'core.classification': 'DEBUG'}
+    'console': True,         # In log ra console
+    'json_path': None,       # File JSON Lines (vd. OUTPUTS_DIR / 'run_log.jsonl'), None = không ghi
+    'rate_limit': 20.0,      # Số bản ghi/giây tối đa cho mỗi vị trí gọi (0 = không giới hạn)
+    'burst': 50,             # Số bản ghi liền nhau tối đa trước khi bị giới hạn
+    'sample_every': 1        # Chỉ giữ 1/N bản ghi của mỗi vị trí gọi (1 = giữ tất cả)
+}
@@ -2,89 +2,323 @@
 Quản lý mô hình YOLO
 """
 import os
+import threading
 import tkinter.messagebox as messagebox
-from ultralytics import YOLO
-from .config import MODEL_PATH, DEFAULT_SETTINGS
+from pathlib import Path
+import numpy as np
+from .backends import create_backend
+from .log import get_logger
+from .model_cache import ModelCache
+from .config import (
+    MODELS_DIR,
+    MODEL_PATH,
+    ONNX_MODEL_PATH,
+    QUANTIZED_MODEL_PATH,
+    FRUIT_HEAD_PATH,
+    AGRICULTURAL_PRODUCTS,
+    DEFAULT_SETTINGS
+)
+
+logger = get_logger('core.detection_model')
 
 
 class DetectionModel:
-    """Lớp quản lý mô hình phát hiện YOLO"""
+    """Lớp quản lý mô hình phát hiện YOLO
+
+    Một instance đã tải có thể dùng chung cho nhiều luồng/dây chuyền: predict()
+    không giữ trạng thái giữa các lần gọi (độ tin cậy, lớp sản phẩm truyền theo
+    từng lần gọi hoặc qua DetectionClient), backend tự tách trạng thái theo luồng.
+    """
 
-    def __init__(self):
-        self.model = None
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, backend=None):
+        self.backend_name = backend or DEFAULT_SETTINGS['inference_backend']
+        self.backend = None
         self.model_name = None
         self.class_names = {}
+        self._class_masks = {}
+        self.model_path = None
+        self._cascade_model = None
+        self._lock = threading.RLock()
+
+        # Trạng thái tải: 'idle', 'loading', 'warming_up', 'ready' hoặc 'error'
+        self.state = 'idle'
+        self.load_error = None
+
+    @classmethod
+    def shared(cls, model_path=None, backend=None):
+        """Lấy mô hình dùng chung theo (backend, đường dẫn), chỉ tải trọng số một lần
+
+        Bộ nhớ tăng theo số mô hình chứ không theo số dây chuyền sử dụng.
+        """
+        model = cls(backend)
+        model_path = str(model_path or model._default_model_path())
+        key = (model.backend_name, os.path.abspath(model_path) if os.path.exists(model_path) else model_path)
+
+        with cls._shared_lock:
+            if key not in cls._shared:
+                model._load_backend(model_path)
+                logger.info("Mô hình dùng chung %s đã được tải (backend: %s)",
+                            model.model_name, model.backend_name)
+                cls._shared[key] = model
+            return cls._shared[key]
+
+    def client(self, confidence=0.5, product_type='auto'):
+        """Tạo DetectionClient với cài đặt riêng của một dây chuyền"""
+        return DetectionClient(self, confidence, product_type)
+
+    def _default_model_path(self):
+        """Đường dẫn mô hình mặc định theo backend"""
+        if DEFAULT_SETTINGS['prefer_fruit_head'] and FRUIT_HEAD_PATH.exists():
+            fruit_onnx = FRUIT_HEAD_PATH.with_suffix('.onnx')
+            if self.backend_name == 'onnxruntime' and fruit_onnx.exists():
+                return str(fruit_onnx)
+            return str(FRUIT_HEAD_PATH)
+        if self.backend_name == 'onnxruntime':
+            if DEFAULT_SETTINGS['prefer_quantized_model'] and QUANTIZED_MODEL_PATH.exists():
+                return str(QUANTIZED_MODEL_PATH)
+            if ONNX_MODEL_PATH.exists():
+                return str(ONNX_MODEL_PATH)
+        return str(MODEL_PATH)
+
+    def _resolve_cached(self, model_path):
+        """Đổi trọng số .pt sang bản đã gộp lớp trong bộ đệm mô hình (nếu bật)"""
+        if not DEFAULT_SETTINGS['use_model_cache'] or Path(model_path).suffix != '.pt':
+            return model_path
+
+        try:
+            return str(ModelCache().resolve(model_path, self.backend_name))
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            logger.warning("Không dùng được bộ đệm mô hình (%s), tải trực tiếp %s", e, model_path)
+            return model_path
 
-    def load(self, model_path=None):
+    def _load_backend(self, model_path):
+        """Tạo backend và tải mô hình (chỉ từ file cục bộ, không tải qua mạng)"""
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"Không tìm thấy mô hình {model_path}. Hãy chép file trọng số vào {MODELS_DIR}"
+            )
+
+        backend = create_backend(self.backend_name)
+        backend.load(self._resolve_cached(model_path))
+
+        # Đổi mô hình trọn vẹn: luồng khác không thấy backend mới với tên lớp cũ
+        with self._lock:
+            self.backend = backend
+            self.model_path = str(model_path)
+            self.model_name = os.path.basename(str(model_path))
+            self.class_names = backend.names
+            self._class_masks = {}
+
+    def load(self, model_path=None, backend=None):
         """Tải mô hình YOLO"""
+        if backend:
+            self.backend_name = backend
+
         try:
             if model_path and os.path.exists(model_path):
-                self.model = YOLO(model_path)
-                self.model_name = os.path.basename(model_path)
+                self._load_backend(model_path)
             else:
                 # Thử tải mô hình mặc định
-                try:
-                    self.model = YOLO('yolov8n.pt')
-                    self.model_name = 'yolov8n.pt'
-                except:
-                    # Tải từ ultralytics hub
-                    self.model = YOLO('yolov8n.pt')
-                    self.model_name = 'yolov8n.pt'
-
-            if self.model:
-                self.class_names = self.model.names
-                print(f"✅ Mô hình {self.model_name} đã được tải thành công!")
-                print(f"   Số lớp: {len(self.class_names)}")
+                self._load_backend(self._default_model_path())
+
+            if self.backend:
+                logger.info("Mô hình %s đã được tải thành công! (backend: %s, %d lớp%s)",
+                            self.model_name, self.backend_name, len(self.class_names),
+                            ", chỉ trái cây" if self.is_fruit_only() else "")
+                self.state = 'ready'
                 return True
             else:
+                self.state = 'error'
                 return False
 
         except Exception as e:
-            print(f"❌ Lỗi khi tải mô hình: {e}")
-
-            if DEFAULT_SETTINGS['auto_download_model']:
-                try:
-                    messagebox.showinfo("Thông báo",
-                        "Đang tải mô hình YOLO từ internet. Vui lòng chờ...")
-                    self.model = YOLO('yolov8n.pt')
-                    self.model_name = 'yolov8n.pt'
-                    self.class_names = self.model.names
-                    return True
-                except:
-                    messagebox.showerror("Lỗi",
-                        "Không thể tải mô hình. Vui lòng kiểm tra kết nối internet.")
-                    return False
+            logger.error("Lỗi khi tải mô hình: %s", e)
+            self.load_error = e
+            self.state = 'error'
+            messagebox.showerror("Lỗi",
+                f"Không thể tải mô hình. Vui lòng kiểm tra đường dẫn.\n"
+                f"Mô hình mặc định: {MODEL_PATH}")
+            return False
+
+    def load_async(self, model_path=None, backend=None, warmup=True):
+        """Tải mô hình trên luồng nền (không chặn giao diện), rồi chạy thử một lượt
+
+        Theo dõi tiến trình qua self.state; lỗi (nếu có) lưu ở self.load_error.
+        Không hiện hộp thoại vì Tk chỉ được gọi từ luồng chính.
+        """
+        if backend:
+            self.backend_name = backend
+
+        self.state = 'loading'
+        self.load_error = None
+        thread = threading.Thread(target=self._load_in_background, args=(model_path, warmup),
+                                  name='ModelLoader', daemon=True)
+        thread.start()
+        return thread
+
+    def _load_in_background(self, model_path, warmup):
+        """Thân của luồng tải mô hình"""
+        try:
+            if model_path and os.path.exists(model_path):
+                self._load_backend(model_path)
             else:
-                messagebox.showerror("Lỗi",
-                    "Không thể tải mô hình. Vui lòng kiểm tra đường dẫn.")
-                return False
+                self._load_backend(self._default_model_path())
+
+            logger.info("Mô hình %s đã được tải thành công! (backend: %s, %d lớp)",
+                        self.model_name, self.backend_name, len(self.class_names))
 
-    def predict(self, image, confidence=0.5):
-        """Dự đoán trên ảnh"""
-        if self.model is None:
+            if warmup:
+                self.state = 'warming_up'
+                self.warmup()
+            self.state = 'ready'
+
+        except Exception as e:
+            logger.error("Lỗi khi tải mô hình: %s", e)
+            self.load_error = e
+            self.state = 'error'
+
+    def warmup(self, imgsz=None, runs=1):
+        """Chạy thử trên ảnh giả ở kích thước đầu vào để khởi tạo trước (predictor,
+        bộ nhớ, kernel), lần phân tích thật đầu tiên không phải chịu chi phí này"""
+        size = int(imgsz or self.get_input_size())
+        dummy = np.zeros((size, size, 3), dtype=np.uint8)
+        for _ in range(max(1, runs)):
+            self.predict(dummy, DEFAULT_SETTINGS['confidence_threshold'])
+
+    def get_cascade_model(self, model_path=None):
+        """Mô hình cho tầng thứ hai của cascade (tải một lần và giữ lại)
+
+        model_path None hoặc không tải được thì dùng chính mô hình này
+        (tầng thứ hai khi đó chỉ tăng độ phân giải).
+        """
+        if not model_path:
+            return self
+
+        with self._lock:
+            if self._cascade_model is not None and self._cascade_model.model_path == str(model_path):
+                return self._cascade_model
+
+            try:
+                model = DetectionModel(self.backend_name)
+                model._load_backend(model_path)
+                logger.info("Mô hình tầng 2 %s đã được tải (cascade)", model.model_name)
+            except Exception as e:
+                logger.warning("Không tải được mô hình tầng 2 (%s), dùng mô hình chính", e)
+                return self
+
+            self._cascade_model = model
+            return model
+
+    def predict(self, image, confidence=0.5, classes=None, imgsz=None):
+        """Dự đoán trên ảnh (classes: chỉ số lớp cần giữ, lọc trước NMS; imgsz: cạnh đầu vào)"""
+        backend = self.backend
+        if backend is None:
             raise ValueError("Mô hình chưa được tải!")
 
         try:
-            results = self.model(image, conf=confidence, verbose=False)
+            results = backend.predict([image], confidence, classes, imgsz)
             return results[0] if results else None
         except Exception as e:
-            print(f"Lỗi khi dự đoán: {e}")
+            logger.error("Lỗi khi dự đoán: %s", e)
             return None
 
+    def predict_batch(self, images, confidence=0.5, batch_size=8, classes=None, imgsz=None):
+        """Dự đoán trên nhiều ảnh, mỗi lô ảnh chạy trong một lượt forward"""
+        backend = self.backend
+        if backend is None:
+            raise ValueError("Mô hình chưa được tải!")
+
+        images = list(images)
+        batch_size = max(1, int(batch_size))
+        results = []
+
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            try:
+                # Backend gom danh sách ảnh thành một tensor (N, 3, H, W)
+                chunk_results = backend.predict(chunk, confidence, classes, imgsz)
+            except Exception as e:
+                logger.error("Lỗi khi dự đoán theo lô: %s", e)
+                chunk_results = []
+
+            # Đảm bảo mỗi ảnh đầu vào có đúng một kết quả (None nếu lỗi)
+            if len(chunk_results) != len(chunk):
+                chunk_results = [None] * len(chunk)
+            results.extend(chunk_results)
+
+        return results
+
+    def get_input_size(self):
+        """Kích thước cạnh đầu vào của mô hình (pixel)"""
+        return self.backend.imgsz if self.backend is not None else 640
+
     def get_class_names(self):
         """Lấy tên các lớp"""
         return self.class_names
 
+    def get_class_ids(self, product_type='auto'):
+        """Chỉ số các lớp cần giữ: mọi sản phẩm nông nghiệp ('auto') hoặc một loại"""
+        products = AGRICULTURAL_PRODUCTS if product_type == 'auto' else [product_type]
+        return [int(i) for i, name in self.class_names.items() if name in products]
+
+    def get_class_mask(self, product_type='auto'):
+        """Mask bool theo chỉ số lớp (tính một lần cho mỗi loại sản phẩm)"""
+        masks = self._class_masks
+        mask = masks.get(product_type)
+        if mask is None:
+            size = max((int(i) for i in self.class_names), default=-1) + 1
+            mask = np.zeros(size, dtype=bool)
+            mask[self.get_class_ids(product_type)] = True
+            masks[product_type] = mask
+        return mask
+
+    def is_fruit_only(self):
+        """Mô hình chỉ có các lớp trái cây (đầu phát hiện rút gọn, không cần lọc 80 lớp COCO)"""
+        return bool(self.class_names) and all(
+            name in AGRICULTURAL_PRODUCTS for name in self.class_names.values())
+
     def is_agricultural_product(self, class_name):
         """Kiểm tra xem có phải sản phẩm nông nghiệp không"""
-        from .config import AGRICULTURAL_PRODUCTS
         return class_name in AGRICULTURAL_PRODUCTS
 
     def is_loaded(self):
         """Kiểm tra xem mô hình đã được tải chưa"""
-        return self.model is not None
+        return self.backend is not None and self.backend.is_loaded()
 
     def get_supported_products(self):
         """Lấy danh sách sản phẩm được hỗ trợ"""
-        from .config import AGRICULTURAL_PRODUCTS
-        return AGRICULTURAL_PRODUCTS
\ No newline at end of file
+        return AGRICULTURAL_PRODUCTS
+
+
+class DetectionClient:
+    """Một người dùng của DetectionModel dùng chung (ví dụ một dây chuyền sản phẩm)
+
+    Giữ cài đặt riêng (độ tin cậy, loại sản phẩm) nên các dây chuyền không ghi đè
+    cài đặt của nhau; mô hình bên dưới chỉ có một bản.
+    """
+
+    def __init__(self, model, confidence=0.5, product_type='auto'):
+        self.model = model
+        self.confidence = confidence
+        self.product_type = product_type
+
+    def settings(self, **overrides):
+        """Dict settings cho ImageProcessor với cài đặt của client này"""
+        settings = {'confidence': self.confidence, 'product_type': self.product_type}
+        settings.update(overrides)
+        return settings
+
+    def predict(self, image, imgsz=None):
+        """Dự đoán một ảnh với cài đặt của client"""
+        return self.model.predict(image, self.confidence,
+                                  self.model.get_class_ids(self.product_type), imgsz)
+
+    def predict_batch(self, images, batch_size=8, imgsz=None):
+        """Dự đoán nhiều ảnh với cài đặt của client"""
+        return self.model.predict_batch(images, self.confidence, batch_size,
+                                        self.model.get_class_ids(self.product_type), imgsz)
@@ -0,0 +1,220 @@
+"""
+So sánh kết quả phát hiện giữa hai mô hình/cấu hình
+"""
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .backends import result_to_arrays
+from .config import DEFAULT_SETTINGS, DENOISE_PROFILE_PATH
+from .log import emit_report, get_logger
+
+logger = get_logger('core.evaluation')
+
+
+def box_iou(boxes_a, boxes_b):
+    """Ma trận IoU giữa hai tập box xyxy"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]).clip(0) * (boxes_a[:, 3] - boxes_a[:, 1]).clip(0)
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]).clip(0) * (boxes_b[:, 3] - boxes_b[:, 1]).clip(0)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = (bottom_right - top_left).clip(0).prod(axis=2)
+
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_detections(ref_boxes, ref_cls, boxes, cls, iou_threshold=0.5):
+    """Ghép tham lam các box cùng lớp có IoU >= ngưỡng
+
+    Trả về danh sách cặp (chỉ số tham chiếu, chỉ số ứng viên, IoU).
+    """
+    if len(ref_boxes) == 0 or len(boxes) == 0:
+        return []
+
+    iou = box_iou(ref_boxes, boxes)
+    iou[np.asarray(ref_cls)[:, None] != np.asarray(cls)[None, :]] = 0.0
+
+    pairs = []
+    candidates = np.argwhere(iou >= iou_threshold)
+    order = np.argsort(-iou[candidates[:, 0], candidates[:, 1]])
+    used_ref, used_other = set(), set()
+
+    for i, j in candidates[order]:
+        if i in used_ref or j in used_other:
+            continue
+        used_ref.add(i)
+        used_other.add(j)
+        pairs.append((int(i), int(j), float(iou[i, j])))
+
+    return pairs
+
+
+def detection_agreement(reference_results, candidate_results, iou_threshold=0.5):
+    """Mức độ trùng khớp (F1) của kết quả ứng viên so với kết quả tham chiếu"""
+    matched = ref_total = cand_total = 0
+    ious = []
+
+    for reference, candidate in zip(reference_results, candidate_results):
+        ref_boxes, _, ref_cls = result_to_arrays(reference)
+        boxes, _, cls = result_to_arrays(candidate)
+
+        pairs = match_detections(ref_boxes, ref_cls, boxes, cls, iou_threshold)
+        matched += len(pairs)
+        ref_total += len(ref_boxes)
+        cand_total += len(boxes)
+        ious.extend(pair[2] for pair in pairs)
+
+    precision = matched / cand_total if cand_total else 1.0
+    recall = matched / ref_total if ref_total else 1.0
+    f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) else 0.0
+
+    return {
+        'reference_count': ref_total,
+        'candidate_count': cand_total,
+        'matched': matched,
+        'precision': precision,
+        'recall': recall,
+        'agreement': f1,
+        'mean_iou': float(np.mean(ious)) if ious else 0.0
+    }
+
+
+def coarse_to_fine_agreement(classifier, crops, class_names, margins=(0.05, 0.1, 0.15, 0.2),
+                             verbose=False):
+    """Đánh giá phân loại thô -> tinh so với phân loại đầy đủ cho từng margin
+
+    crops: danh sách ảnh cắt BGR, class_names: lớp tương ứng. Trả về danh sách
+    dict: margin, agreement (tỷ lệ quyết định trùng), escalated (tỷ lệ ảnh cắt
+    phải quét lại) và thời gian trung bình mỗi ảnh cắt (ms) của hai cách.
+    """
+    pairs = [(crop, name) for crop, name in zip(crops, class_names)
+             if name in classifier.rules and crop is not None and crop.size > 0]
+    if not pairs:
+        raise ValueError("Không có ảnh cắt hợp lệ để đánh giá")
+
+    start = time.perf_counter()
+    reference = [classifier.classify_quality_features(classifier.crop_features(crop), name)
+                 for crop, name in pairs]
+    full_ms = (time.perf_counter() - start) / len(pairs) * 1000
+
+    reports = []
+    for margin in margins:
+        start = time.perf_counter()
+        decisions = [classifier.classify_quality_coarse(classifier.crop_features(crop), name, margin)
+                     for crop, name in pairs]
+        coarse_ms = (time.perf_counter() - start) / len(pairs) * 1000
+
+        agreement = np.mean([quality == ref for (quality, _), ref in zip(decisions, reference)])
+        escalated = np.mean([flag for _, flag in decisions])
+        reports.append({
+            'margin': margin,
+            'agreement': float(agreement),
+            'escalated': float(escalated),
+            'coarse_ms': coarse_ms,
+            'full_ms': full_ms
+        })
+
+    lines = ["📊 PHÂN LOẠI THÔ -> TINH:"]
+    lines.extend(f"   margin {report['margin']:.2f}: trùng khớp {report['agreement']:.3f}, "
+                 f"quét lại {report['escalated']:.1%}, "
+                 f"{report['coarse_ms']:.2f} ms/ảnh (đầy đủ {report['full_ms']:.2f} ms)"
+                 for report in reports)
+    emit_report(logger, lines, verbose, {'margins': reports})
+    return reports
+
+
+def denoise_tier_benchmark(processor, image_paths, tiers=None, reference_tier='nlm', settings=None,
+                           tolerance=None, iou_threshold=0.5, save_path=DENOISE_PROFILE_PATH,
+                           verbose=False):
+    """Đo độ trễ từng mức khử nhiễu và mức trùng khớp kết quả so với reference_tier
+
+    processor: ImageProcessor (đã có mô hình). Với mỗi mức, mọi ảnh được phân tích
+    lại bằng processor.analyze(..., cache=False) (không ghi vào run_cache); so với mức tham chiếu (NLM đầy đủ) tính trùng khớp phát hiện (F1 theo
+    IoU, cùng lớp) và trùng khớp chất lượng trên các cặp đã ghép. Mức được chọn là
+    mức có thời gian khử nhiễu nhỏ nhất mà cả hai mức trùng khớp >= 1 - tolerance.
+    Kết quả được ghi vào save_path (None = không ghi) để denoise_tier='auto' dùng.
+    """
+    from processing.pipeline import DENOISE_TIERS
+
+    if tolerance is None:
+        tolerance = DEFAULT_SETTINGS['denoise_tolerance']
+    tiers = [reference_tier] + [tier for tier in (tiers or DENOISE_TIERS) if tier != reference_tier]
+    # Chỉ đo đường phân tích một lượt (không chia ô, không cascade)
+    settings = dict(settings or {}, enable_preprocessing=True, tiled_inference=False, cascade=False)
+
+    images = [(str(path), cv2.imread(str(path))) for path in image_paths]
+    images = [(path, image) for path, image in images if image is not None]
+    if not images:
+        raise ValueError("Không có ảnh hợp lệ để đánh giá")
+
+    previous = processor.pipeline
+    outputs = {}
+    reports = []
+    try:
+        for tier in tiers:
+            processor.set_denoise_tier(tier)
+            denoise_ms, analyze_ms, results = [], [], []
+            for path, image in images:
+                timings = {}
+                processor.preprocess_image(image, timings=timings)
+                denoise_ms.append(timings.get('denoise', 0.0))
+
+                start = time.perf_counter()
+                results.append(processor.analyze(path, image, settings, cache=False))
+                analyze_ms.append((time.perf_counter() - start) * 1000)
+            outputs[tier] = results
+
+            matched = ref_total = cand_total = same_quality = 0
+            for reference, candidate in zip(outputs[reference_tier], results):
+                pairs = match_detections(reference['boxes'], reference['class_ids'],
+                                         candidate['boxes'], candidate['class_ids'], iou_threshold)
+                matched += len(pairs)
+                ref_total += len(reference['boxes'])
+                cand_total += len(candidate['boxes'])
+                same_quality += sum(reference['detections'][i]['quality'] == candidate['detections'][j]['quality']
+                                    for i, j, _ in pairs)
+
+            precision = matched / cand_total if cand_total else 1.0
+            recall = matched / ref_total if ref_total else 1.0
+            reports.append({
+                'tier': tier,
+                'denoise_ms': float(np.mean(denoise_ms)),
+                'analyze_ms': float(np.mean(analyze_ms)),
+                'detection_agreement': (2 * precision * recall / (precision + recall)
+                                        if (precision + recall) else 0.0),
+                'quality_agreement': same_quality / matched if matched else 1.0
+            })
+    finally:
+        processor.set_pipeline(previous)
+
+    accepted = [report for report in reports
+                if report['detection_agreement'] >= 1 - tolerance
+                and report['quality_agreement'] >= 1 - tolerance]
+    selected = min(accepted, key=lambda report: report['denoise_ms'])['tier']
+
+    lines = [f"📊 CÁC MỨC KHỬ NHIỄU ({len(images)} ảnh, tham chiếu {reference_tier}):"]
+    for report in reports:
+        mark = '✅' if report['tier'] == selected else '  '
+        lines.append(f"   {mark} {report['tier']:16s}: {report['denoise_ms']:8.1f} ms khử nhiễu, "
+                     f"{report['analyze_ms']:8.1f} ms/ảnh, phát hiện {report['detection_agreement']:.3f}, "
+                     f"chất lượng {report['quality_agreement']:.3f}")
+    lines.append(f"   Mức được chọn (sai lệch <= {tolerance:.1%}): {selected}")
+    emit_report(logger, lines, verbose, {'selected': selected, 'tiers': reports})
+
+    profile = {
+        'selected': selected,
+        'reference_tier': reference_tier,
+        'tolerance': tolerance,
+        'images': len(images),
+        'tiers': reports
+    }
+    if save_path is not None:
+        Path(save_path).write_text(json.dumps(profile, indent=2, ensure_ascii=False), encoding='utf-8')
+    return profile
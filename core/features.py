@@ -0,0 +1,323 @@
+"""
+Đặc trưng màu tính một lần cho cả khung hình bằng bảng tích lũy (summed-area table)
+
+Thống kê của mỗi box (tỷ lệ khớp từng chất lượng, trung bình/độ lệch chuẩn xám,
+trung bình S và H) lấy bằng bốn phép tra góc, nên chi phí tỷ lệ với kích thước
+khung hình thay vì tổng diện tích các box (box chồng nhau không quét lại pixel).
+
+Số đếm được cộng theo chất lượng (số khoảng khớp của mỗi pixel) thay vì từng
+khoảng, nên tỷ lệ bằng cách tính trên ảnh cắt sai khác tối đa ở mức làm tròn số
+thực; độ lệch chuẩn xám tính theo E[x^2] - E[x]^2.
+"""
+import math
+
+import cv2
+import numpy as np
+
+
+class BoxFeatures:
+    """Thống kê màu của một box, cùng giao diện với đặc trưng của ảnh cắt"""
+
+    __slots__ = ('size', 'gray_mean', 'gray_std', 'saturation_mean', 'hue_mean',
+                 'fallback_hue_mean', 'class_name', 'quality_counts', 'table')
+
+    def __init__(self, size, gray_mean, gray_std, saturation_mean, hue_mean,
+                 fallback_hue_mean, class_name=None, quality_counts=None, table=None):
+        self.size = size
+        self.gray_mean = gray_mean
+        self.gray_std = gray_std
+        self.saturation_mean = saturation_mean
+        self.hue_mean = hue_mean
+        self.fallback_hue_mean = fallback_hue_mean
+        self.class_name = class_name
+        self.quality_counts = quality_counts
+        self.table = table
+
+    def quality_ratios(self, class_name):
+        """Tỷ lệ khớp từng chất lượng (khoảng chồng lấn được cộng nhiều lần)"""
+        if class_name != self.class_name or self.table is None:
+            raise KeyError(f"Không có số đếm khoảng màu cho '{class_name}'")
+        return {quality: int(count) / self.size
+                for quality, count in zip(self.table.qualities, self.quality_counts)}
+
+
+class CropFeatures:
+    """Đặc trưng của một ảnh cắt BGR, mỗi thành phần chỉ tính khi cần lần đầu
+
+    HSV, ảnh xám, mask pixel hợp lệ và các giá trị trung bình được dùng chung giữa
+    phân loại chất lượng, Hue fallback và điểm chất lượng (mỗi phép chuyển màu
+    chỉ chạy một lần cho mỗi đối tượng). hsv/gray có thể truyền sẵn (vd. view
+    vào ảnh đã chuyển màu của cả khung hình).
+    """
+
+    __slots__ = ('image', 'rule_tables', '_hsv', '_gray', '_valid', '_cache')
+
+    def __init__(self, image, rule_tables=None, hsv=None, gray=None):
+        self.image = image
+        self.rule_tables = rule_tables
+        self._hsv = hsv
+        self._gray = gray
+        self._valid = None
+        self._cache = {}
+
+    @property
+    def size(self):
+        source = self.image if self.image is not None else self._hsv
+        if source is None or source.size == 0:
+            return 0
+        return source.shape[0] * source.shape[1]
+
+    @property
+    def hsv(self):
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.image, cv2.COLOR_BGR2HSV)
+        return self._hsv
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def valid_mask(self):
+        """Pixel hợp lệ cho Hue fallback (không quá tối/sáng, đủ bão hòa)"""
+        if self._valid is None:
+            hsv = self.hsv
+            self._valid = (hsv[:, :, 1] > 30) & (hsv[:, :, 2] > 30) & (hsv[:, :, 2] < 220)
+        return self._valid
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def gray_mean(self):
+        return self._cached('gray_mean', lambda: self.gray.mean())
+
+    @property
+    def gray_std(self):
+        return self._cached('gray_std', lambda: self.gray.std())
+
+    @property
+    def saturation_mean(self):
+        return self._cached('saturation_mean', lambda: self.hsv[:, :, 1].mean())
+
+    @property
+    def hue_mean(self):
+        return self._cached('hue_mean', lambda: np.mean(self.hsv[:, :, 0]))
+
+    @property
+    def fallback_hue_mean(self):
+        """Hue trung bình của pixel hợp lệ (cả ảnh nếu không có pixel nào hợp lệ)"""
+        def compute():
+            valid = self.valid_mask
+            if np.any(valid):
+                return np.mean(self.hsv[valid, 0])
+            return self.hue_mean
+        return self._cached('fallback_hue_mean', compute)
+
+    def quality_ratios(self, class_name):
+        """Tỷ lệ khớp từng chất lượng theo bảng tra của loại trái cây"""
+        return self._cached(('quality_ratios', class_name),
+                            lambda: self.rule_tables[class_name].quality_ratios(self.hsv))
+
+    def coarse_hsv(self, max_side):
+        """HSV của ảnh thu nhỏ (láng giềng gần nhất) để cạnh dài nhất <= max_side
+
+        Nội suy láng giềng gần nhất giữ nguyên giá trị màu của pixel gốc (không
+        trộn màu như INTER_AREA), nên tỷ lệ khớp khoảng màu vẫn là ước lượng không
+        chệch. Trả về None nếu ảnh đã đủ nhỏ.
+        """
+        source = self._hsv if self._hsv is not None else self.image
+        h, w = source.shape[:2]
+        scale = max_side / max(h, w, 1)
+        if scale >= 1.0:
+            return None
+
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        small = cv2.resize(source, size, interpolation=cv2.INTER_NEAREST)
+        if self._hsv is not None:
+            return small
+        return cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+
+    def sample_hsv(self, min_samples):
+        """Mẫu phân tầng tất định: tâm của mỗi ô lưới bước s x s (s thực)
+
+        Bước s chọn sao cho số mẫu xấp xỉ min_samples. Trả về None khi ảnh không
+        đủ lớn để lấy mẫu có lợi (s < 1.5). Nếu HSV của cả ảnh chưa được tính thì
+        chỉ chuyển màu các pixel mẫu.
+        """
+        stride = math.sqrt(self.size / max(min_samples, 1))
+        if stride < 1.5:
+            return None
+
+        source = self._hsv if self._hsv is not None else self.image
+        h, w = source.shape[:2]
+        rows = np.arange(stride / 2, h, stride).astype(np.intp)
+        cols = np.arange(stride / 2, w, stride).astype(np.intp)
+        sample = source[rows[:, None], cols]
+        if self._hsv is not None:
+            return sample
+        return cv2.cvtColor(sample, cv2.COLOR_BGR2HSV)
+
+
+class FrameFeatures:
+    """Bảng tích lũy của một khung hình BGR cho thống kê theo box
+
+    rule_tables: {loại trái cây: HSVRuleTable} (FruitClassifier.rule_tables).
+    Bảng số đếm chất lượng của mỗi loại chỉ được tạo khi có box thuộc loại đó, và
+    chỉ trên hình chữ nhật bao các box của loại đó.
+    """
+
+    def __init__(self, image, rule_tables, hsv=None, gray=None):
+        self.rule_tables = rule_tables
+        self.hsv = hsv if hsv is not None else cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        gray = gray if gray is not None else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        self.shape = self.hsv.shape[:2]
+
+        # Tổng và tổng bình phương độ xám (float64 vẫn chính xác với số nguyên < 2^53)
+        self._gray_sum, self._gray_sqsum = cv2.integral2(gray, sdepth=cv2.CV_64F,
+                                                         sqdepth=cv2.CV_64F)
+
+        hue, saturation, value = cv2.split(self.hsv)
+        self._hue_sum = cv2.integral(hue, sdepth=cv2.CV_64F)
+        self._saturation_sum = cv2.integral(saturation, sdepth=cv2.CV_64F)
+
+        # Pixel hợp lệ cho Hue fallback (không quá tối/sáng, đủ bão hòa)
+        valid = ((saturation > 30) & (value > 30) & (value < 220)).astype(np.uint8)
+        self._valid_count = cv2.integral(valid, sdepth=cv2.CV_64F)
+        self._valid_hue_sum = cv2.integral(hue * valid, sdepth=cv2.CV_64F)
+
+    def _quality_counts(self, class_name, boxes):
+        """Số pixel khớp (tính cả khoảng chồng lấn) của từng chất lượng trên mỗi box"""
+        rule_table = self.rule_tables[class_name]
+        x1, y1 = boxes[:, 0].min(), boxes[:, 1].min()
+        x2, y2 = boxes[:, 2].max(), boxes[:, 3].max()
+        if x2 <= x1 or y2 <= y1:
+            # Mọi box của lớp đều rỗng sau khi cắt theo khung hình
+            return np.zeros((len(boxes), len(rule_table.qualities)), dtype=np.int64)
+        local = boxes - np.array([x1, y1, x1, y1], dtype=np.int64)
+
+        codes = rule_table.cell_codes(self.hsv[y1:y2, x1:x2])
+        counts = []
+        for q in range(len(rule_table.qualities)):
+            multiplicity = rule_table.quality_multiplicity[:, q][codes]
+            counts.append(self.box_sums(cv2.integral(multiplicity, sdepth=cv2.CV_32S), local))
+        return np.stack(counts, axis=1)
+
+    def clip_boxes(self, boxes):
+        """Box nguyên (x1, y1, x2, y2) cắt theo khung hình, x2 >= x1 và y2 >= y1"""
+        h, w = self.shape
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4).copy()
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        boxes[:, 2] = np.maximum(boxes[:, 2], boxes[:, 0])
+        boxes[:, 3] = np.maximum(boxes[:, 3], boxes[:, 1])
+        return boxes
+
+    @staticmethod
+    def box_sums(table, boxes):
+        """Tổng trên từng box từ bảng tích lũy: bốn phép tra góc, vector hóa theo box"""
+        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        return table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]
+
+    def boxes(self, boxes, class_names=None):
+        """Danh sách BoxFeatures cho các box (tọa độ pixel của khung hình)
+
+        class_names: tên lớp của từng box; box thuộc lớp có quy tắc màu được đếm
+        theo từng chất lượng của lớp đó.
+        """
+        boxes = self.clip_boxes(boxes)
+        count = len(boxes)
+        if class_names is None:
+            class_names = [None] * count
+
+        size = ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])).astype(np.int64)
+        n = np.maximum(size, 1).astype(np.float64)
+
+        gray_mean = self.box_sums(self._gray_sum, boxes) / n
+        gray_var = self.box_sums(self._gray_sqsum, boxes) / n - gray_mean ** 2
+        gray_std = np.sqrt(np.maximum(gray_var, 0.0))
+        saturation_mean = self.box_sums(self._saturation_sum, boxes) / n
+        hue_mean = self.box_sums(self._hue_sum, boxes) / n
+
+        valid_count = self.box_sums(self._valid_count, boxes)
+        valid_hue = self.box_sums(self._valid_hue_sum, boxes)
+        fallback_hue = np.where(valid_count > 0, valid_hue / np.maximum(valid_count, 1), hue_mean)
+
+        # Số đếm theo chất lượng, tính theo nhóm box cùng lớp
+        quality_counts = [None] * count
+        names = np.array(class_names, dtype=object)
+        for class_name in set(class_names):
+            if class_name not in self.rule_tables:
+                continue
+            index = np.flatnonzero(names == class_name)
+            for i, row in zip(index, self._quality_counts(class_name, boxes[index])):
+                quality_counts[i] = row
+
+        return [
+            BoxFeatures(int(size[i]), float(gray_mean[i]), float(gray_std[i]),
+                        float(saturation_mean[i]), float(hue_mean[i]), float(fallback_hue[i]),
+                        class_names[i], quality_counts[i],
+                        self.rule_tables.get(class_names[i]) if quality_counts[i] is not None else None)
+            for i in range(count)
+        ]
+
+
+def hoeffding_sample_size(tolerance, confidence, hypotheses=1, value_range=1.0):
+    """Số mẫu để mọi trung bình (giá trị trong [0, value_range]) sai lệch không quá
+    tolerance với xác suất >= confidence (bất đẳng thức Hoeffding + chặn hợp)"""
+    delta = max(1.0 - confidence, 1e-12) / max(hypotheses, 1)
+    return int(math.ceil(value_range ** 2 * math.log(2.0 / delta) / (2.0 * tolerance ** 2)))
+
+
+def hoeffding_bound(samples, confidence, hypotheses=1, value_range=1.0):
+    """Sai số tối đa của trung bình trên samples mẫu với xác suất >= confidence"""
+    if samples <= 0:
+        return float(value_range)
+    delta = max(1.0 - confidence, 1e-12) / max(hypotheses, 1)
+    return float(value_range * math.sqrt(math.log(2.0 / delta) / (2.0 * samples)))
+
+
+def convert_region(frame, boxes, mode='union'):
+    """Chuyển HSV và ảnh xám một lần cho vùng chứa các box
+
+    mode: 'frame' - cả khung hình, 'union' - hình chữ nhật bao tất cả box,
+    'crop' - không chuyển chung (mỗi ảnh cắt tự chuyển). boxes đã được cắt theo
+    khung hình. Trả về (hsv, gray, (x0, y0)) với (x0, y0) là góc vùng đã chuyển,
+    hoặc None nếu không chuyển chung. Ảnh cắt lấy bằng view
+    hsv[y1 - y0:y2 - y0, x1 - x0:x2 - x0] (không sao chép).
+    """
+    if mode not in ('frame', 'union') or len(boxes) == 0:
+        return None
+
+    if mode == 'frame':
+        x0, y0 = 0, 0
+        region = frame
+    else:
+        x0, y0 = int(boxes[:, 0].min()), int(boxes[:, 1].min())
+        x1, y1 = int(boxes[:, 2].max()), int(boxes[:, 3].max())
+        region = frame[y0:y1, x0:x1]
+
+    if region.size == 0:
+        return None
+    return (cv2.cvtColor(region, cv2.COLOR_BGR2HSV),
+            cv2.cvtColor(region, cv2.COLOR_BGR2GRAY), (x0, y0))
+
+
+def should_use_frame_features(mode, frame_shape, boxes, area_ratio=1.5):
+    """Chọn cách tính đặc trưng: True/False theo cài đặt, 'auto' theo mật độ box
+
+    Ở chế độ 'auto', bảng tích lũy chỉ có lợi khi tổng diện tích các box vượt
+    area_ratio lần diện tích khung hình (nhiều box hoặc box chồng nhau).
+    """
+    if mode != 'auto':
+        return bool(mode)
+    if len(boxes) == 0:
+        return False
+
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    areas = (boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)
+    return areas.sum() > area_ratio * frame_shape[0] * frame_shape[1]
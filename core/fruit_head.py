@@ -0,0 +1,223 @@
+"""
+Huấn luyện đầu phát hiện chỉ gồm các lớp trái cây (AGRICULTURAL_PRODUCTS) từ yolov8n
+
+Mô hình COCO chấm điểm 80 lớp cho mỗi anchor và NMS chạy trên tất cả; đầu 4 lớp
+làm tensor đầu ra nhỏ hơn và ít ứng viên hơn nên giải mã + NMS rẻ hơn ở mọi khung hình.
+Nhãn lấy từ chính mô hình hiện tại (pseudo-label, chưng cất kiến thức bằng nhãn cứng)
+hoặc sinh ảnh tổng hợp để kiểm thử quy trình.
+"""
+import random
+import shutil
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .backends import DetectionResult, NumpyBoxes, result_to_arrays
+from .config import AGRICULTURAL_PRODUCTS, FRUIT_HEAD_PATH, MODEL_PATH
+from .evaluation import detection_agreement
+from .log import emit_report, get_logger
+from .quantization import find_calibration_images
+
+logger = get_logger('core.fruit_head')
+
+FRUIT_CLASSES = list(AGRICULTURAL_PRODUCTS)
+
+
+def _write_dataset_yaml(output_dir):
+    """Ghi data.yaml theo định dạng dataset của ultralytics"""
+    output_dir = Path(output_dir)
+    lines = [f"path: {output_dir.resolve()}", "train: images/train", "val: images/val", "names:"]
+    lines += [f"  {i}: {name}" for i, name in enumerate(FRUIT_CLASSES)]
+    yaml_path = output_dir / 'data.yaml'
+    yaml_path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return yaml_path
+
+
+def _write_sample(output_dir, split, name, image, boxes, class_ids):
+    """Lưu một ảnh và file nhãn YOLO (class cx cy w h, chuẩn hóa về [0, 1])"""
+    output_dir = Path(output_dir)
+    h, w = image.shape[:2]
+    image_dir = output_dir / 'images' / split
+    label_dir = output_dir / 'labels' / split
+    image_dir.mkdir(parents=True, exist_ok=True)
+    label_dir.mkdir(parents=True, exist_ok=True)
+
+    cv2.imwrite(str(image_dir / f"{name}.jpg"), image)
+
+    lines = []
+    for (x1, y1, x2, y2), class_id in zip(np.asarray(boxes).reshape(-1, 4).tolist(), class_ids):
+        cx, cy = (x1 + x2) / 2 / w, (y1 + y2) / 2 / h
+        bw, bh = (x2 - x1) / w, (y2 - y1) / h
+        lines.append(f"{int(class_id)} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}")
+    (label_dir / f"{name}.txt").write_text("\n".join(lines), encoding='utf-8')
+
+
+def build_pseudo_label_dataset(image_dir, output_dir, teacher, confidence=0.4,
+                               val_ratio=0.1, max_images=None, batch_size=8, seed=0):
+    """Tạo dataset 4 lớp từ phát hiện trái cây của mô hình hiện tại (teacher)
+
+    teacher: DetectionModel đã tải (ví dụ yolov8n.pt COCO). Lớp của teacher được
+    ánh xạ sang FRUIT_CLASSES theo tên; lớp không có trong teacher (vd. 'tomato'
+    với COCO) chỉ có nhãn nếu dataset được bổ sung nhãn thủ công.
+    """
+    image_paths = find_calibration_images(image_dir, max_images)
+    if not image_paths:
+        raise ValueError(f"Không có ảnh trong: {image_dir}")
+
+    output_dir = Path(output_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    fruit_index = {name: i for i, name in enumerate(FRUIT_CLASSES)}
+    class_map = {int(i): fruit_index[name] for i, name in teacher.get_class_names().items()
+                 if name in fruit_index}
+    classes = sorted(class_map)
+
+    rng = random.Random(seed)
+    labelled = boxes_total = skipped = 0
+
+    for start in range(0, len(image_paths), batch_size):
+        chunk = image_paths[start:start + batch_size]
+        images = [cv2.imread(str(path)) for path in chunk]
+        valid = [(path, image) for path, image in zip(chunk, images) if image is not None]
+        results_list = teacher.predict_batch([image for _, image in valid], confidence,
+                                             batch_size, classes)
+
+        for (path, image), results in zip(valid, results_list):
+            # Teacher lỗi trên ảnh này: bỏ qua, không ghi file nhãn rỗng (sẽ thành ảnh "không có trái cây")
+            if results is None:
+                skipped += 1
+                continue
+            xyxy, _, cls = result_to_arrays(results)
+            split = 'val' if rng.random() < val_ratio else 'train'
+            _write_sample(output_dir, split, path.stem, image, xyxy,
+                          [class_map[int(c)] for c in cls])
+            labelled += 1
+            boxes_total += len(xyxy)
+
+    if skipped:
+        logger.warning("Bỏ qua %d ảnh teacher không dự đoán được", skipped)
+    logger.info("Đã tạo dataset pseudo-label: %d ảnh, %d box → %s", labelled, boxes_total, output_dir)
+    return _write_dataset_yaml(output_dir)
+
+
+def make_synthetic_dataset(output_dir, count=40, imgsz=320, val_ratio=0.2, seed=0):
+    """Sinh dataset tổng hợp: hình elip màu trái cây trên nền ngẫu nhiên (để kiểm thử)"""
+    # (màu BGR, tỷ lệ rộng/cao) gần đúng cho từng lớp
+    shapes = {
+        'apple': ((40, 40, 200), 1.0),
+        'banana': ((40, 210, 230), 2.8),
+        'orange': ((30, 140, 250), 1.0),
+        'tomato': ((30, 30, 230), 1.15),
+    }
+
+    output_dir = Path(output_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    rng = np.random.default_rng(seed)
+
+    for index in range(count):
+        background = rng.integers(60, 200, size=3)
+        image = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+        image[...] = background
+        image = cv2.add(image, rng.integers(0, 25, size=image.shape, dtype=np.uint8))
+
+        boxes, class_ids = [], []
+        for _ in range(int(rng.integers(1, 5))):
+            class_id = int(rng.integers(len(FRUIT_CLASSES)))
+            color, aspect = shapes[FRUIT_CLASSES[class_id]]
+            ry = int(rng.integers(imgsz // 20, imgsz // 7))
+            rx = int(ry * aspect)
+            cx = int(rng.integers(rx, imgsz - rx))
+            cy = int(rng.integers(ry, imgsz - ry))
+            cv2.ellipse(image, (cx, cy), (rx, ry), 0, 0, 360, color, -1)
+            boxes.append((cx - rx, cy - ry, cx + rx, cy + ry))
+            class_ids.append(class_id)
+
+        split = 'val' if index < max(1, int(count * val_ratio)) else 'train'
+        _write_sample(output_dir, split, f"synthetic_{index:04d}", image, boxes, class_ids)
+
+    logger.info("Đã sinh %d ảnh tổng hợp → %s", count, output_dir)
+    return _write_dataset_yaml(output_dir)
+
+
+def train_fruit_head(data_yaml, base_weights=MODEL_PATH, output_path=FRUIT_HEAD_PATH,
+                     epochs=30, imgsz=640, batch=16, **train_args):
+    """Fine-tune yolov8n thành mô hình 4 lớp trái cây
+
+    Backbone và neck lấy từ base_weights; ultralytics tạo lại lớp phân loại cuối
+    của Detect cho số lớp của dataset. Trả về đường dẫn trọng số đã lưu.
+    """
+    from .model_cache import disable_network
+
+    base_weights = Path(base_weights)
+    if not base_weights.exists():
+        raise FileNotFoundError(f"Không tìm thấy mô hình gốc: {base_weights}")
+
+    disable_network()
+    from ultralytics import YOLO
+
+    output_path = Path(output_path)
+    model = YOLO(str(base_weights))
+    model.train(data=str(data_yaml), epochs=epochs, imgsz=imgsz, batch=batch,
+                project=str(output_path.parent / 'runs'), name=output_path.stem,
+                exist_ok=True, **train_args)
+
+    best = Path(model.trainer.best)
+    if not best.exists():
+        best = Path(model.trainer.last)
+    shutil.copy2(best, output_path)
+
+    logger.info("Đã lưu mô hình trái cây 4 lớp: %s", output_path)
+    return output_path
+
+
+def evaluate_fruit_head(reference, fruit_model, image_paths, confidence=0.5,
+                        iou_threshold=0.5, warmup=2, verbose=False):
+    """So sánh mô hình 4 lớp với mô hình gốc (đã lọc lớp trái cây): độ trễ và trùng khớp
+
+    reference, fruit_model: DetectionModel đã tải. Lớp được so theo tên.
+    """
+    images = [image for image in (cv2.imread(str(p)) for p in image_paths) if image is not None]
+    if not images:
+        raise ValueError("Không có ảnh hợp lệ để đánh giá")
+
+    report = {'images': len(images)}
+    outputs = {}
+
+    for label, model in (('reference', reference), ('fruit', fruit_model)):
+        classes = model.get_class_ids('auto')
+        for image in images[:warmup]:
+            model.predict(image, confidence, classes)
+
+        start = time.perf_counter()
+        results = [model.predict(image, confidence, classes) for image in images]
+        report[f'{label}_latency_ms'] = (time.perf_counter() - start) / len(images) * 1000
+        outputs[label] = results
+
+    # Đổi chỉ số lớp về tên chung để so sánh hai bảng lớp khác nhau
+    fruit_index = {name: i for i, name in enumerate(FRUIT_CLASSES)}
+
+    def to_fruit(model, results):
+        names = model.get_class_names()
+        converted = []
+        for result in results:
+            xyxy, conf, cls = result_to_arrays(result)
+            ids = np.array([fruit_index.get(names[int(c)], -1) for c in cls], dtype=np.int64)
+            data = np.column_stack([xyxy, conf, ids]) if len(ids) else np.empty((0, 6))
+            converted.append(DetectionResult(NumpyBoxes(data), dict(enumerate(FRUIT_CLASSES)),
+                                             result.orig_shape if result is not None else None))
+        return converted
+
+    report.update(detection_agreement(to_fruit(reference, outputs['reference']),
+                                      to_fruit(fruit_model, outputs['fruit']), iou_threshold))
+
+    emit_report(logger, [
+        "📊 SO SÁNH MÔ HÌNH 4 LỚP:",
+        f"   Mô hình gốc: {report['reference_latency_ms']:.1f} ms/ảnh",
+        f"   Mô hình trái cây: {report['fruit_latency_ms']:.1f} ms/ảnh",
+        f"   Trùng khớp phát hiện: {report['agreement']:.3f} "
+        f"(precision {report['precision']:.3f}, recall {report['recall']:.3f})"
+    ], verbose, report)
+    return report
+
@@ -0,0 +1,105 @@
+"""
+Biên dịch CLASSIFICATION_RULES thành bảng tra HSV (lookup table)
+
+Mỗi kênh H, S, V được chia thành các đoạn tại các biên của mọi khoảng màu của một
+loại trái cây; trong mỗi ô (đoạn H x đoạn S x đoạn V) việc khớp với từng khoảng là
+cố định. Phân loại một ảnh chỉ còn tra bảng để lấy chỉ số ô của từng pixel rồi
+bincount, thay vì một lần cv2.inRange + np.sum cho mỗi khoảng màu.
+"""
+import cv2
+import numpy as np
+
+
+class HSVRuleTable:
+    """Bảng tra của một loại trái cây: ô HSV lượng tử hóa -> các khoảng màu khớp"""
+
+    def __init__(self, color_ranges):
+        # Thứ tự chất lượng và khoảng màu giữ đúng như trong quy tắc
+        self.qualities = list(color_ranges)
+        self.ranges = []
+        for quality, ranges_list in color_ranges.items():
+            for lower, upper in ranges_list:
+                lower = np.array(lower, dtype=np.uint8).astype(np.int64)
+                upper = np.array(upper, dtype=np.uint8).astype(np.int64)
+                self.ranges.append((quality, lower, upper))
+
+        # Điểm cắt trên từng kênh: cv2.inRange so sánh lower <= x <= upper
+        self.cuts = []
+        luts = []
+        for channel in range(3):
+            cuts = {0, 256}
+            for _, lower, upper in self.ranges:
+                cuts.add(int(lower[channel]))
+                cuts.add(int(upper[channel]) + 1)
+            cuts = np.array(sorted(c for c in cuts if 0 <= c <= 256), dtype=np.int64)
+            self.cuts.append(cuts)
+            luts.append(np.searchsorted(cuts, np.arange(256), side='right') - 1)
+
+        self.shape = tuple(len(cuts) - 1 for cuts in self.cuts)
+        nh, ns, nv = self.shape
+
+        # Bảng 3 kênh cho cv2.LUT: giá trị H, S, V -> chỉ số đoạn trên kênh đó
+        self.channel_lut = np.stack(luts, axis=-1).astype(np.uint8).reshape(1, 256, 3)
+        self.strides = (np.int32(ns * nv), np.int32(nv))
+        self.num_cells = nh * ns * nv
+
+        # Ma trận khớp (ô, khoảng) dựa trên giá trị đại diện (đầu đoạn) của mỗi ô
+        h0, s0, v0 = (cuts[:-1] for cuts in self.cuts)
+        grid = np.stack(np.meshgrid(h0, s0, v0, indexing='ij'), axis=-1).reshape(-1, 3)
+        self.membership = np.stack(
+            [np.all((grid >= lower) & (grid <= upper), axis=1) for _, lower, upper in self.ranges],
+            axis=1
+        ).astype(np.int64) if self.ranges else np.zeros((self.num_cells, 0), dtype=np.int64)
+
+        # Số khoảng khớp của mỗi ô theo từng chất lượng (khoảng chồng lấn được đếm nhiều lần)
+        self.quality_multiplicity = np.zeros((self.num_cells, len(self.qualities)), dtype=np.uint8)
+        for r, (quality, _, _) in enumerate(self.ranges):
+            self.quality_multiplicity[:, self.qualities.index(quality)] += self.membership[:, r].astype(np.uint8)
+
+        # Bitmask các khoảng khớp của mỗi ô (bit r = khoảng thứ r)
+        weights = np.left_shift(np.uint64(1), np.arange(len(self.ranges), dtype=np.uint64))
+        self.cell_bits = (self.membership.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+    def cell_codes(self, hsv):
+        """Chỉ số ô của từng pixel (cùng kích thước với ảnh HSV)
+
+        Chỉ số ô = h * (ns * nv) + s * nv + v với h, s, v là chỉ số đoạn của từng kênh.
+        """
+        index = cv2.LUT(np.ascontiguousarray(hsv), self.channel_lut)
+        codes = index[..., 0] * self.strides[0]
+        codes += index[..., 1] * self.strides[1]
+        codes += index[..., 2]
+        return codes
+
+    def range_counts(self, hsv):
+        """Số pixel khớp với từng khoảng màu (giống np.sum(cv2.inRange(...) > 0))"""
+        counts = np.bincount(self.cell_codes(hsv).ravel(), minlength=self.num_cells)
+        return counts @ self.membership
+
+    def range_masks(self, codes):
+        """Mask uint8 (0/1) cho từng khoảng màu từ chỉ số ô"""
+        bits = self.cell_bits[codes]
+        return [((bits >> np.uint64(r)) & np.uint64(1)).astype(np.uint8)
+                for r in range(len(self.ranges))]
+
+    def ratios_from_counts(self, counts, total_pixels):
+        """Tỷ lệ theo chất lượng, cộng dồn từng khoảng theo đúng thứ tự như cách cũ
+
+        Khoảng chồng lấn được tính nhiều lần, giống hệt cách cộng tỷ lệ của từng
+        cv2.inRange trước đây.
+        """
+        ratios = {quality: 0 for quality in self.qualities}
+        for (quality, _, _), count in zip(self.ranges, counts):
+            if total_pixels > 0:
+                ratios[quality] += int(count) / total_pixels
+        return ratios
+
+    def quality_ratios(self, hsv):
+        """Tỷ lệ pixel khớp của từng chất lượng trên ảnh HSV"""
+        total_pixels = hsv.shape[0] * hsv.shape[1]
+        return self.ratios_from_counts(self.range_counts(hsv), total_pixels)
+
+
+def compile_rules(rules):
+    """Biên dịch toàn bộ quy tắc: {loại trái cây: HSVRuleTable}"""
+    return {class_name: HSVRuleTable(rule['color_ranges']) for class_name, rule in rules.items()}
@@ -0,0 +1,203 @@
+"""
+Ghi log có cấu trúc thay cho print debug trong đường xử lý nóng
+
+- Mỗi module có logger riêng ('fruit.<module>') và mức log riêng (LOG_SETTINGS['levels']).
+  Mặc định là INFO (thông báo tải mô hình, nạp quy tắc...); log của đường xử lý
+  nóng ở mức DEBUG nên mỗi lệnh chỉ tốn một lần kiểm tra mức.
+- Thông điệp được định dạng lười (logger.debug("... %s", value)). Thống kê chỉ
+  phục vụ debug được đặt sau logger.isEnabledFor(logging.DEBUG).
+- RateLimitFilter lấy mẫu và giới hạn tần suất theo từng vị trí gọi, để khi chạy
+  lô thì I/O console không chiếm thời gian xử lý.
+- Có thể ghi thêm JSON Lines ra file (LOG_SETTINGS['json_path']).
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+from .config import (
+    CLASSIFICATION_RULES,
+    LOG_SETTINGS,
+    PRODUCT_NAMES_VI,
+    QUALITY_COLORS,
+    QUALITY_NAMES_VI
+)
+
+ROOT_LOGGER = 'fruit'
+
+LEVEL_ICONS = {
+    logging.DEBUG: '🔍',
+    logging.INFO: 'ℹ️ ',
+    logging.WARNING: '⚠️ ',
+    logging.ERROR: '❌',
+    logging.CRITICAL: '❌'
+}
+
+# Handler do configure_logging cài (để cấu hình lại không bị nhân đôi)
+_handlers = []
+
+
+def get_logger(name):
+    """Logger của một module: 'core.classification' -> 'fruit.core.classification'"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class RateLimitFilter(logging.Filter):
+    """Lấy mẫu và giới hạn tần suất bản ghi theo từng vị trí gọi (file, dòng)
+
+    Mỗi vị trí gọi chỉ giữ 1/sample_every bản ghi. Sau đó một token bucket cho
+    tối đa `rate` bản ghi/giây, và tối đa `burst` bản ghi liền nhau. Bản ghi trên
+    max_level (mặc định ERROR trở lên) luôn được giữ. Số bản ghi bị bỏ qua được
+    gắn vào bản ghi kế tiếp của cùng vị trí (record.suppressed).
+    """
+
+    def __init__(self, rate=20.0, burst=50, sample_every=1, max_level=logging.WARNING):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.sample_every = max(1, int(sample_every))
+        self.max_level = max_level
+        self._buckets = {}  # (logger, file, dòng) -> [token, thời điểm, đã gặp, đã bỏ]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        # Một bộ lọc dùng chung cho mọi handler: mỗi bản ghi chỉ được quyết định một lần
+        decision = getattr(record, 'rate_allowed', None)
+        if decision is not None:
+            return decision
+        record.rate_allowed = self._allow(record)
+        return record.rate_allowed
+
+    def _allow(self, record):
+        record.suppressed = 0
+        if record.levelno > self.max_level:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0, 0]
+            bucket[2] += 1
+
+            if (bucket[2] - 1) % self.sample_every:
+                bucket[3] += 1
+                return False
+
+            if self.rate > 0:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                if bucket[0] < 1.0:
+                    bucket[3] += 1
+                    return False
+                bucket[0] -= 1.0
+
+            record.suppressed, bucket[3] = bucket[3], 0
+        return True
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Định dạng console giống các print hiện có: biểu tượng + thông điệp"""
+
+    def format(self, record):
+        message = f"{LEVEL_ICONS.get(record.levelno, '')} {record.getMessage()}"
+        if getattr(record, 'suppressed', 0):
+            message += f" (bỏ qua {record.suppressed} bản ghi tương tự)"
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Một đối tượng JSON mỗi dòng; trường `data` (extra={'data': {...}}) được gộp vào"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'line': record.lineno
+        }
+        data = getattr(record, 'data', None)
+        if isinstance(data, dict):
+            entry.update(data)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def emit_report(logger, lines, verbose=False, data=None):
+    """Báo cáo nhiều dòng của các hàm đo/đánh giá
+
+    verbose=True (gọi trực tiếp từ dòng lệnh/notebook): in ra console. Ngược lại
+    ghi một bản ghi INFO (data: trường có cấu trúc cho file JSON).
+    """
+    text = "\n".join(lines)
+    if verbose:
+        print(text)
+    else:
+        logger.info(text, extra={'data': data} if data is not None else None)
+
+
+def configure_logging(settings=None):
+    """Cài handler và mức log cho logger 'fruit' theo LOG_SETTINGS (gọi lại được)
+
+    settings: các khóa ghi đè LOG_SETTINGS ('level', 'levels', 'console',
+    'json_path', 'rate_limit', 'burst', 'sample_every').
+    """
+    options = dict(LOG_SETTINGS)
+    options.update(settings or {})
+
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in _handlers:
+        root.removeHandler(handler)
+        handler.close()
+    _handlers.clear()
+
+    root.setLevel(logging.getLevelName(str(options['level']).upper()))
+    root.propagate = False
+    for name, level in (options.get('levels') or {}).items():
+        get_logger(name).setLevel(logging.getLevelName(str(level).upper()))
+
+    rate_filter = RateLimitFilter(options['rate_limit'], options['burst'], options['sample_every'])
+
+    if options['console']:
+        console = logging.StreamHandler()
+        console.setFormatter(ConsoleFormatter())
+        _handlers.append(console)
+
+    if options.get('json_path'):
+        json_file = logging.FileHandler(options['json_path'], encoding='utf-8')
+        json_file.setFormatter(JsonFormatter())
+        _handlers.append(json_file)
+
+    for handler in _handlers:
+        handler.addFilter(rate_filter)
+        root.addHandler(handler)
+
+    log_rules_summary()
+    return root
+
+
+def log_rules_summary():
+    """Bảng quy tắc màu và màu hiển thị (chỉ khi 'core.config' bật DEBUG)"""
+    logger = get_logger('core.config')
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
+    lines = ["CẤU HÌNH PHÂN LOẠI MÀU HSV"]
+    for product, rules in CLASSIFICATION_RULES.items():
+        lines.append(f"📦 {PRODUCT_NAMES_VI.get(product, product).upper()}:")
+        for quality, ranges in rules['color_ranges'].items():
+            lines.append(f"   {QUALITY_NAMES_VI.get(quality, quality)}:")
+            lines.extend(f"      {lower} -> {upper}" for lower, upper in ranges)
+
+    lines.append("📊 MÀU SẮC PHÂN LOẠI:")
+    lines.extend(f"   {QUALITY_NAMES_VI.get(quality, quality):12s}: {color}"
+                 for quality, color in QUALITY_COLORS.items())
+    logger.debug("\n".join(lines))
@@ -0,0 +1,199 @@
+"""
+Bộ đệm mô hình cục bộ: trọng số đã gộp (fused), chỉ dùng cho suy luận, không cần mạng
+
+Mô hình trong bộ đệm không được memory-map khi tải: ultralytics (YOLO()) tự gọi
+torch.load và không cho truyền mmap=True, còn ONNX Runtime đọc file vào bộ nhớ
+của session. Checkpoint đã gộp chỉ vài MB nên thời gian tải chủ yếu là giải tuần
+tự hóa, không phải đọc file; mmap chỉ dùng khi tính checksum.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+from datetime import datetime
+from importlib import metadata
+from pathlib import Path
+
+from .config import MODEL_CACHE_DIR
+from .log import get_logger
+
+logger = get_logger('core.model_cache')
+
+# Thư viện ảnh hưởng tới định dạng file đã tuần tự hóa của từng backend
+BACKEND_LIBRARIES = {
+    'ultralytics': ('ultralytics', 'torch'),
+    'onnxruntime': ('ultralytics', 'torch', 'onnx', 'onnxruntime'),
+}
+
+ARTIFACT_NAMES = {
+    'ultralytics': 'model.pt',
+    'onnxruntime': 'model.onnx',
+}
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def disable_network():
+    """Chặn ultralytics tự tải trọng số/cài thư viện qua mạng (gọi trước khi import)"""
+    os.environ.setdefault('YOLO_OFFLINE', 'True')
+    os.environ.setdefault('YOLO_AUTOINSTALL', 'False')
+
+
+def file_sha256(path):
+    """SHA-256 của file, đọc qua memory map (không nạp cả file vào bộ nhớ Python)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest.update(mapped)
+    return digest.hexdigest()
+
+
+def library_versions(backend_name):
+    """Phiên bản các thư viện dùng để tạo và đọc file của backend"""
+    versions = {}
+    for package in BACKEND_LIBRARIES.get(backend_name, ()):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+class ModelCache:
+    """Quản lý các mô hình đã chuẩn bị sẵn trong MODEL_CACHE_DIR
+
+    Mỗi mục là một thư mục đặt tên theo hash trọng số gốc + phiên bản thư viện,
+    gồm file mô hình và manifest.json (nguồn, phiên bản, checksum). Trọng số gốc
+    phải có sẵn trên máy: bộ đệm không bao giờ tải gì qua mạng.
+    """
+
+    def __init__(self, cache_dir=MODEL_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+
+    def cache_key(self, weights_path, backend_name, source_hash=None):
+        """Khóa của mục: hash trọng số gốc + backend + phiên bản thư viện"""
+        source_hash = source_hash or file_sha256(weights_path)
+        versions = json.dumps(library_versions(backend_name), sort_keys=True)
+        key = hashlib.sha256(f"{source_hash}|{backend_name}|{versions}".encode()).hexdigest()
+        return key[:16]
+
+    def entry_dir(self, weights_path, backend_name, source_hash=None):
+        """Thư mục của mục tương ứng với trọng số và backend"""
+        key = self.cache_key(weights_path, backend_name, source_hash)
+        return self.cache_dir / f"{Path(weights_path).stem}-{backend_name}-{key}"
+
+    def resolve(self, weights_path, backend_name='ultralytics'):
+        """Đường dẫn file mô hình trong bộ đệm, tạo mới nếu chưa có hoặc bị hỏng"""
+        weights_path = Path(weights_path)
+        if not weights_path.exists():
+            raise FileNotFoundError(
+                f"Không tìm thấy trọng số {weights_path}. Hãy chép file vào {weights_path.parent} "
+                "(ứng dụng không tải mô hình qua mạng)."
+            )
+        if backend_name not in ARTIFACT_NAMES:
+            return weights_path
+
+        source_hash = file_sha256(weights_path)
+        entry = self.entry_dir(weights_path, backend_name, source_hash)
+        artifact = entry / ARTIFACT_NAMES[backend_name]
+
+        if self.verify(entry):
+            return artifact
+
+        if entry.exists():
+            logger.warning("Bộ đệm mô hình bị hỏng, tạo lại: %s", entry.name)
+        return self.build(weights_path, backend_name, entry, source_hash)
+
+    def verify(self, entry):
+        """Kiểm tra manifest và checksum của file mô hình trong mục"""
+        manifest_path = Path(entry) / MANIFEST_NAME
+        if not manifest_path.exists():
+            return False
+
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+            artifact = Path(entry) / manifest['artifact']
+            return artifact.exists() and file_sha256(artifact) == manifest['artifact_sha256']
+        except (ValueError, KeyError, OSError):
+            return False
+
+    def build(self, weights_path, backend_name, entry, source_hash=None):
+        """Tạo mục bộ đệm: gộp Conv+BN, lưu mô hình chỉ dùng suy luận và manifest"""
+        weights_path = Path(weights_path)
+        entry = Path(entry)
+        staging = entry.with_name(entry.name + '.tmp')
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        logger.info("Đang tạo bộ đệm mô hình cho %s (%s)...", weights_path.name, backend_name)
+        try:
+            artifact = staging / ARTIFACT_NAMES[backend_name]
+            if backend_name == 'ultralytics':
+                self._build_fused_checkpoint(weights_path, artifact)
+            else:
+                self._build_onnx(weights_path, artifact)
+
+            manifest = {
+                'source': str(weights_path),
+                'source_sha256': source_hash or file_sha256(weights_path),
+                'backend': backend_name,
+                'versions': library_versions(backend_name),
+                'artifact': artifact.name,
+                'artifact_sha256': file_sha256(artifact),
+                'created': datetime.now().isoformat(timespec='seconds')
+            }
+            (staging / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+
+            # Thay thế trọn vẹn để tiến trình khác không đọc phải mục đang ghi dở
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        logger.info("Đã lưu bộ đệm mô hình: %s", entry)
+        return entry / ARTIFACT_NAMES[backend_name]
+
+    @staticmethod
+    def _build_fused_checkpoint(weights_path, output_path):
+        """Lưu checkpoint ultralytics đã gộp lớp, bỏ trạng thái huấn luyện (optimizer, EMA)"""
+        disable_network()
+        import torch
+        from ultralytics import YOLO
+
+        yolo = YOLO(str(weights_path))
+        model = yolo.model.fuse(verbose=False).eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+
+        checkpoint = {
+            'model': model,
+            'train_args': dict((yolo.ckpt or {}).get('train_args', {})),
+            'date': datetime.now().isoformat(timespec='seconds'),
+        }
+        torch.save(checkpoint, str(output_path))
+
+    @staticmethod
+    def _build_onnx(weights_path, output_path):
+        """Xuất ONNX (batch động) từ trọng số gốc vào mục bộ đệm"""
+        from .backends import OnnxRuntimeBackend
+
+        exported = OnnxRuntimeBackend.export(weights_path, output_dir=output_path.parent)
+        os.replace(exported, output_path)
+
+    def entries(self):
+        """Danh sách manifest của các mục trong bộ đệm"""
+        manifests = []
+        for manifest_path in sorted(self.cache_dir.glob(f"*/{MANIFEST_NAME}")):
+            try:
+                manifests.append(json.loads(manifest_path.read_text(encoding='utf-8')))
+            except ValueError:
+                continue
+        return manifests
+
+    def clear(self):
+        """Xóa toàn bộ bộ đệm"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,176 @@
+"""
+Mô hình CNN phân loại chất lượng (tầng 2) chạy theo lô trên các ảnh cắt đối tượng
+
+Mọi ảnh cắt của một hoặc nhiều khung hình được letterbox vào chung một tensor
+(N, 3, H, W) và chạy một lượt ONNX Runtime hoặc OpenCV DNN trên CPU, nên chi phí
+mỗi trái cây chỉ là phần chia của một lượt suy luận. Nhãn lấy từ metadata
+'names' của file ONNX (như mô hình phân loại của ultralytics) hoặc QUALITY_LABELS.
+"""
+import ast
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .backends import to_input_tensor
+from .config import DEFAULT_SETTINGS, QUALITY_MODEL_PATH
+from .log import emit_report, get_logger
+
+logger = get_logger('core.quality_model')
+
+# Thứ tự lớp mặc định khi file mô hình không có metadata 'names'
+QUALITY_LABELS = ['xanh', 'chin', 'hong', 'trung_binh']
+
+RUNTIMES = ('onnxruntime', 'opencv')
+
+
+def _softmax(logits):
+    """Softmax theo hàng; giữ nguyên nếu đầu ra đã là xác suất"""
+    logits = np.asarray(logits, dtype=np.float32)
+    sums = logits.sum(axis=1)
+    if np.all(logits >= 0) and np.allclose(sums, 1.0, atol=1e-3):
+        return logits
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+class QualityModel:
+    """Bộ phân loại chất lượng CNN trên CPU (ONNX Runtime hoặc OpenCV DNN)"""
+
+    def __init__(self, runtime='onnxruntime', num_threads=None, batch_size=None):
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Runtime không hợp lệ: {runtime}. Hỗ trợ: {', '.join(RUNTIMES)}")
+        self.runtime = runtime
+        self.num_threads = num_threads
+        self.batch_size = max(1, int(batch_size or DEFAULT_SETTINGS['quality_model_batch']))
+        self.session = None
+        self.net = None
+        self.input_name = None
+        self.fixed_batch = None
+        self.input_shape = (DEFAULT_SETTINGS['quality_model_input'],) * 2
+        self.labels = list(QUALITY_LABELS)
+        self.model_name = None
+
+        # Tensor đầu vào cấp phát sẵn cho mỗi luồng; cv2.dnn.Net không an toàn luồng
+        self._local = threading.local()
+        self._net_lock = threading.Lock()
+
+    def load(self, model_path=QUALITY_MODEL_PATH):
+        """Tải mô hình ONNX đầu vào (N, 3, H, W) RGB [0, 1], đầu ra (N, số lớp)"""
+        model_path = Path(model_path)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Không tìm thấy mô hình chất lượng: {model_path}")
+
+        if self.runtime == 'onnxruntime':
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.num_threads:
+                options.intra_op_num_threads = self.num_threads
+            self.session = ort.InferenceSession(
+                str(model_path), sess_options=options, providers=['CPUExecutionProvider']
+            )
+
+            model_input = self.session.get_inputs()[0]
+            self.input_name = model_input.name
+            batch, _, height, width = model_input.shape
+            self.fixed_batch = batch if isinstance(batch, int) else None
+            if isinstance(height, int) and isinstance(width, int):
+                self.input_shape = (height, width)
+
+            metadata = self.session.get_modelmeta().custom_metadata_map
+            if 'imgsz' in metadata and not isinstance(height, int):
+                self.input_shape = tuple(ast.literal_eval(metadata['imgsz']))[:2]
+            if 'names' in metadata:
+                names = ast.literal_eval(metadata['names'])
+                self.labels = [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+        else:
+            self.net = cv2.dnn.readNetFromONNX(str(model_path))
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            if self.num_threads:
+                cv2.setNumThreads(self.num_threads)
+
+        self.model_name = model_path.name
+        self._local = threading.local()
+        logger.info("Đã tải mô hình chất lượng: %s (%s, %dx%d, %d lớp)", self.model_name,
+                    self.runtime, self.input_shape[1], self.input_shape[0], len(self.labels))
+        return True
+
+    def is_loaded(self):
+        return self.session is not None or self.net is not None
+
+    def _input_buffer(self, batch_size):
+        """(tensor, ảnh letterbox) cấp phát sẵn của luồng hiện tại"""
+        local = self._local
+        tensor = getattr(local, 'input', None)
+        if tensor is None or tensor.shape[0] < batch_size:
+            local.input = tensor = np.empty((batch_size, 3, *self.input_shape), dtype=np.float32)
+        canvas = getattr(local, 'canvas', None)
+        if canvas is None:
+            local.canvas = canvas = np.empty((*self.input_shape, 3), dtype=np.uint8)
+        return tensor[:batch_size], canvas
+
+    def _run(self, tensor):
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: tensor})[0]
+        with self._net_lock:
+            self.net.setInput(tensor)
+            return self.net.forward()
+
+    def predict(self, crops, batch_size=None):
+        """Xác suất từng lớp cho các ảnh cắt BGR (có thể từ nhiều khung hình)
+
+        Các ảnh cắt được letterbox vào chung một tensor và chạy theo lô
+        batch_size (mô hình có batch cố định thì dùng đúng batch đó).
+        Trả về mảng (N, số lớp).
+        """
+        crops = list(crops)
+        if not crops:
+            return np.empty((0, len(self.labels)), dtype=np.float32)
+
+        step = self.fixed_batch or max(1, int(batch_size or self.batch_size))
+        outputs = []
+        for start in range(0, len(crops), step):
+            chunk = crops[start:start + step]
+            tensor, canvas = self._input_buffer(self.fixed_batch or len(chunk))
+            for i, crop in enumerate(chunk):
+                to_input_tensor(crop, self.input_shape, tensor[i], canvas)
+            outputs.append(_softmax(np.asarray(self._run(tensor)).reshape(len(tensor), -1))[:len(chunk)])
+
+        return np.concatenate(outputs)
+
+    def classify(self, crops, batch_size=None):
+        """Nhãn chất lượng và độ tin cậy cho các ảnh cắt: (mảng nhãn, mảng xác suất)"""
+        probabilities = self.predict(crops, batch_size)
+        index = probabilities.argmax(axis=1)
+        labels = np.array(self.labels, dtype=object)[index] if len(index) else np.empty(0, dtype=object)
+        return labels, probabilities[np.arange(len(index)), index]
+
+    def benchmark(self, crops, batch_sizes=(1, 2, 4, 8, 16, 32, 64), repeats=3, verbose=False):
+        """Thông lượng (ảnh cắt/giây) theo kích thước lô; mỗi mức lấy lượt nhanh nhất
+
+        verbose: in bảng kết quả ra console thay vì ghi log INFO.
+        """
+        crops = list(crops)
+        if not crops:
+            raise ValueError("Không có ảnh cắt để đo")
+
+        report = {}
+        for batch_size in batch_sizes:
+            self.predict(crops[:batch_size], batch_size)  # Khởi động
+            best = float('inf')
+            for _ in range(max(1, repeats)):
+                start = time.perf_counter()
+                self.predict(crops, batch_size)
+                best = min(best, time.perf_counter() - start)
+            report[batch_size] = len(crops) / best if best > 0 else float('inf')
+
+        lines = [f"📊 THÔNG LƯỢNG MÔ HÌNH CHẤT LƯỢNG ({self.runtime}, {len(crops)} ảnh cắt):"]
+        lines.extend(f"   batch {batch_size:>3}: {throughput:,.0f} ảnh cắt/giây"
+                     for batch_size, throughput in report.items())
+        emit_report(logger, lines, verbose, {'crops_per_second': report})
+        return report
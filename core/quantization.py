@@ -0,0 +1,209 @@
+"""
+Lượng tử hóa INT8 (post-training, static) cho mô hình ONNX với tập hiệu chuẩn từ ảnh trái cây
+"""
+import re
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .backends import OnnxRuntimeBackend, to_input_tensor
+from .config import MODEL_PATH, ONNX_MODEL_PATH, QUANTIZED_MODEL_PATH
+from .evaluation import detection_agreement
+from .log import emit_report, get_logger
+
+logger = get_logger('core.quantization')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+
+def find_calibration_images(folder, max_images=200):
+    """Lấy danh sách ảnh hiệu chuẩn (sắp xếp theo tên để kết quả lặp lại được)"""
+    folder = Path(folder)
+    paths = sorted(p for p in folder.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if max_images and len(paths) > max_images:
+        # Lấy đều trên toàn bộ thư mục thay vì chỉ các ảnh đầu
+        step = len(paths) / max_images
+        paths = [paths[int(i * step)] for i in range(max_images)]
+    return paths
+
+
+class FruitCalibrationReader:
+    """Đọc ảnh hiệu chuẩn theo giao diện CalibrationDataReader của onnxruntime"""
+
+    def __init__(self, image_paths, input_name, input_shape, preprocess=None):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.input_shape = input_shape
+        self.preprocess = preprocess
+        self._index = 0
+
+    def get_next(self):
+        """Trả về input của ảnh tiếp theo, None khi hết ảnh"""
+        while self._index < len(self.image_paths):
+            image = cv2.imread(str(self.image_paths[self._index]))
+            self._index += 1
+            if image is None:
+                continue
+
+            # Cùng tiền xử lý như khi suy luận để dải giá trị activation khớp
+            if self.preprocess is not None:
+                image = self.preprocess(image)
+
+            tensor = np.empty((1, 3, *self.input_shape), dtype=np.float32)
+            to_input_tensor(image, self.input_shape, tensor[0])
+            return {self.input_name: tensor}
+
+        return None
+
+    def rewind(self):
+        """Quay lại ảnh đầu tiên"""
+        self._index = 0
+
+
+def _head_nodes_to_exclude(model_path):
+    """Các node giải mã box ở đầu Detect (không phải Conv) được giữ FP32"""
+    import onnx
+
+    graph = onnx.load(str(model_path), load_external_data=False).graph
+    layers = [int(match.group(1)) for match in
+              (re.match(r'^/model\.(\d+)/', node.name) for node in graph.node) if match]
+    if not layers:
+        return []
+
+    head_prefix = f"/model.{max(layers)}/"
+    return [node.name for node in graph.node
+            if node.name.startswith(head_prefix) and node.op_type != 'Conv']
+
+
+def _copy_metadata(source_path, target_path):
+    """Chép metadata (names, imgsz...) của mô hình FP32 sang mô hình INT8"""
+    import onnx
+
+    source = onnx.load(str(source_path), load_external_data=False)
+    target = onnx.load(str(target_path))
+    existing = {prop.key for prop in target.metadata_props}
+
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            target.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(target, str(target_path))
+
+
+def quantize_model(calibration_dir, fp32_model=None, output_path=QUANTIZED_MODEL_PATH,
+                   max_images=200, preprocess='auto', per_channel=True, exclude_head=True):
+    """Lượng tử hóa INT8 static mô hình ONNX, hiệu chuẩn bằng ảnh trong calibration_dir
+
+    preprocess: hàm ảnh -> ảnh áp dụng trước letterbox; 'auto' =
+    processing.inference_preprocess (cùng tiền xử lý với ImageProcessor), None = ảnh gốc.
+    """
+    from onnxruntime.quantization import (
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static
+    )
+
+    if fp32_model is None:
+        fp32_model = ONNX_MODEL_PATH if ONNX_MODEL_PATH.exists() else OnnxRuntimeBackend.export(MODEL_PATH)
+    fp32_model = Path(fp32_model)
+    output_path = Path(output_path)
+
+    image_paths = find_calibration_images(calibration_dir, max_images)
+    if not image_paths:
+        raise ValueError(f"Không có ảnh hiệu chuẩn trong: {calibration_dir}")
+
+    reference = OnnxRuntimeBackend()
+    reference.load(fp32_model)
+    if preprocess == 'auto':
+        from processing import inference_preprocess
+        preprocess = inference_preprocess(reference.imgsz)
+    reader = FruitCalibrationReader(image_paths, reference.input_name,
+                                    reference.input_shape, preprocess)
+
+    # Chuẩn hóa đồ thị (shape inference, gộp node) trước khi lượng tử hóa nếu có thể
+    model_input = fp32_model
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        model_input = output_path.with_name(f"{fp32_model.stem}_prep.onnx")
+        quant_pre_process(str(fp32_model), str(model_input))
+    except Exception as e:
+        logger.warning("Bỏ qua bước tiền xử lý đồ thị: %s", e)
+        model_input = fp32_model
+
+    nodes_to_exclude = _head_nodes_to_exclude(model_input) if exclude_head else []
+
+    logger.info("Đang hiệu chuẩn INT8 với %d ảnh...", len(image_paths))
+    quantize_static(
+        str(model_input),
+        str(output_path),
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=nodes_to_exclude
+    )
+
+    if model_input != fp32_model:
+        model_input.unlink(missing_ok=True)
+    _copy_metadata(fp32_model, output_path)
+
+    logger.info("Đã lưu mô hình INT8: %s", output_path)
+    return output_path
+
+
+def evaluate_quantization(fp32_model, int8_model, image_paths, confidence=0.5,
+                          iou_threshold=0.5, preprocess='auto', warmup=2, verbose=False):
+    """So sánh độ trễ và mức trùng khớp phát hiện giữa mô hình FP32 và INT8
+
+    preprocess: như quantize_model ('auto' = tiền xử lý của ImageProcessor).
+    """
+    if preprocess == 'auto':
+        reference = OnnxRuntimeBackend()
+        reference.load(fp32_model)
+        from processing import inference_preprocess
+        preprocess = inference_preprocess(reference.imgsz)
+
+    images = []
+    for path in image_paths:
+        image = cv2.imread(str(path))
+        if image is not None:
+            images.append(preprocess(image) if preprocess is not None else image)
+    if not images:
+        raise ValueError("Không có ảnh hợp lệ để đánh giá")
+
+    report = {'images': len(images)}
+    outputs = {}
+
+    for label, model_path in (('fp32', fp32_model), ('int8', int8_model)):
+        backend = OnnxRuntimeBackend()
+        backend.load(model_path)
+
+        for image in images[:warmup]:
+            backend.predict([image], confidence)
+
+        results = []
+        start = time.perf_counter()
+        for image in images:
+            results.extend(backend.predict([image], confidence))
+        elapsed = time.perf_counter() - start
+
+        outputs[label] = results
+        report[f'{label}_latency_ms'] = elapsed / len(images) * 1000
+
+    report['speedup'] = report['fp32_latency_ms'] / max(report['int8_latency_ms'], 1e-9)
+    report.update(detection_agreement(outputs['fp32'], outputs['int8'], iou_threshold))
+
+    emit_report(logger, [
+        "📊 KẾT QUẢ LƯỢNG TỬ HÓA INT8:",
+        f"   Độ trễ FP32: {report['fp32_latency_ms']:.1f} ms/ảnh",
+        f"   Độ trễ INT8: {report['int8_latency_ms']:.1f} ms/ảnh (nhanh hơn {report['speedup']:.2f}x)",
+        f"   Trùng khớp phát hiện: {report['agreement']:.3f} "
+        f"(precision {report['precision']:.3f}, recall {report['recall']:.3f}, "
+        f"IoU TB {report['mean_iou']:.3f})"
+    ], verbose, report)
+
+    return report
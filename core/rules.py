@@ -0,0 +1,260 @@
+"""
+Nạp, kiểm tra và biên dịch quy tắc màu HSV từ file ngoài, tự nạp lại khi file đổi
+
+Định dạng file (JSON):
+    {
+        "color_classification_threshold": 0.15,       # tùy chọn
+        "rules": {
+            "apple": {"color_ranges": {"chin": [[[0, 50, 50], [10, 255, 255]], ...], ...}},
+            ...
+        }
+    }
+Cũng chấp nhận file chỉ gồm phần "rules" (cùng cấu trúc với CLASSIFICATION_RULES).
+"""
+import json
+import math
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .config import CLASSIFICATION_RULES, DEFAULT_SETTINGS
+from .hsv_lut import compile_rules
+from .log import get_logger
+
+logger = get_logger('core.rules')
+
+# Giới hạn của OpenCV HSV (8 bit): H trong [0, 179], S và V trong [0, 255]
+HSV_MAX = (179, 255, 255)
+
+
+class RuleError(ValueError):
+    """Quy tắc màu không hợp lệ"""
+
+
+def _parse_triple(value, where):
+    """Một bộ (H, S, V) số nguyên trong giới hạn của OpenCV"""
+    if not isinstance(value, (list, tuple)) or len(value) != 3:
+        raise RuleError(f"{where}: cần 3 giá trị (H, S, V), nhận {value!r}")
+
+    triple = []
+    for channel, (item, limit) in enumerate(zip(value, HSV_MAX)):
+        if (isinstance(item, bool) or not isinstance(item, (int, float))
+                or not math.isfinite(item) or item != int(item)):
+            raise RuleError(f"{where}: giá trị kênh {'HSV'[channel]} phải là số nguyên, nhận {item!r}")
+        if not 0 <= item <= limit:
+            raise RuleError(f"{where}: kênh {'HSV'[channel]} = {item} ngoài khoảng [0, {limit}]")
+        triple.append(int(item))
+    return tuple(triple)
+
+
+def _overlap(range_a, range_b):
+    """Hộp HSV giao nhau của hai khoảng (None nếu không giao)"""
+    lower = np.maximum(range_a[0], range_b[0])
+    upper = np.minimum(range_a[1], range_b[1])
+    if np.any(lower > upper):
+        return None
+    return tuple(lower.tolist()), tuple(upper.tolist())
+
+
+def validate_rules(rules):
+    """Kiểm tra và chuẩn hóa quy tắc, trả về (rules, warnings)
+
+    - Mỗi khoảng là [lower, upper] với H trong [0, 179], S, V trong [0, 255].
+    - S, V phải có lower <= upper. Khoảng có H lower > upper được hiểu là vòng qua
+      màu đỏ (vd. 170 -> 10) và tách thành hai khoảng [lower, 179] và [0, upper].
+    - Khoảng của hai chất lượng khác nhau giao nhau chỉ sinh cảnh báo (pixel trong
+      vùng giao được tính cho cả hai chất lượng).
+    """
+    if not isinstance(rules, dict) or not rules:
+        raise RuleError("Quy tắc phải là dict {loại trái cây: {'color_ranges': ...}} khác rỗng")
+
+    normalized = {}
+    warnings = []
+
+    for product, rule in rules.items():
+        color_ranges = rule.get('color_ranges') if isinstance(rule, dict) else None
+        if not isinstance(color_ranges, dict) or not color_ranges:
+            raise RuleError(f"{product}: thiếu 'color_ranges'")
+
+        product_ranges = {}
+        for quality, ranges_list in color_ranges.items():
+            if not isinstance(ranges_list, (list, tuple)):
+                raise RuleError(f"{product}/{quality}: danh sách khoảng không hợp lệ")
+
+            parsed = []
+            for index, pair in enumerate(ranges_list):
+                where = f"{product}/{quality}[{index}]"
+                if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                    raise RuleError(f"{where}: cần [lower, upper]")
+                lower = _parse_triple(pair[0], where + ".lower")
+                upper = _parse_triple(pair[1], where + ".upper")
+
+                for channel in (1, 2):
+                    if lower[channel] > upper[channel]:
+                        raise RuleError(f"{where}: kênh {'HSV'[channel]} có lower > upper "
+                                        f"({lower[channel]} > {upper[channel]})")
+
+                if lower[0] > upper[0]:
+                    # Vòng Hue qua màu đỏ: tách thành hai khoảng
+                    warnings.append(f"{where}: H {lower[0]} -> {upper[0]} vòng qua 0, "
+                                    "tách thành hai khoảng")
+                    parsed.append(((lower[0], lower[1], lower[2]), (HSV_MAX[0], upper[1], upper[2])))
+                    parsed.append(((0, lower[1], lower[2]), (upper[0], upper[1], upper[2])))
+                else:
+                    parsed.append((lower, upper))
+
+            product_ranges[quality] = parsed
+
+        # Cảnh báo khoảng giao nhau giữa các chất lượng khác nhau
+        items = [(quality, np.array(lower), np.array(upper))
+                 for quality, parsed in product_ranges.items() for lower, upper in parsed]
+        for i, (quality_a, lower_a, upper_a) in enumerate(items):
+            for quality_b, lower_b, upper_b in items[i + 1:]:
+                if quality_a == quality_b:
+                    continue
+                box = _overlap((lower_a, upper_a), (lower_b, upper_b))
+                if box is not None:
+                    warnings.append(f"{product}: '{quality_a}' và '{quality_b}' giao nhau "
+                                    f"trong {box[0]} -> {box[1]}")
+
+        normalized[product] = {
+            'color_ranges': {quality: [[list(lower), list(upper)] for lower, upper in parsed]
+                             for quality, parsed in product_ranges.items()}
+        }
+
+    return normalized, warnings
+
+
+class RuleSet:
+    """Quy tắc đã kiểm tra cùng bảng tra đã biên dịch, thay thế nguyên khối trong bộ phân loại
+
+    threshold là ngưỡng phân loại màu có hiệu lực (None = color_classification_threshold
+    trong cấu hình), nên một phép gán RuleSet thay cả quy tắc, bảng tra và ngưỡng.
+    """
+
+    def __init__(self, rules, threshold=None, source=None, warnings=(), tables=None):
+        self.rules = rules
+        self.tables = tables if tables is not None else compile_rules(rules)
+        if threshold is None:
+            threshold = DEFAULT_SETTINGS['color_classification_threshold']
+        self.threshold = float(threshold)
+        self.source = source
+        self.warnings = list(warnings)
+
+    def with_threshold(self, threshold):
+        """RuleSet mới dùng chung quy tắc/bảng tra, chỉ đổi ngưỡng"""
+        return RuleSet(self.rules, threshold, self.source, self.warnings, self.tables)
+
+
+def compile_ruleset(rules, threshold=None, source=None):
+    """Kiểm tra + biên dịch quy tắc thành RuleSet"""
+    if threshold is not None:
+        try:
+            value = float(threshold)
+        except (TypeError, ValueError):
+            raise RuleError(f"color_classification_threshold phải là số, nhận {threshold!r}") from None
+        if isinstance(threshold, bool) or not 0.0 <= value <= 1.0:
+            raise RuleError(f"color_classification_threshold = {threshold!r} ngoài khoảng [0, 1]")
+    normalized, warnings = validate_rules(rules)
+    return RuleSet(normalized, None if threshold is None else float(threshold), source, warnings)
+
+
+def load_ruleset(path):
+    """Đọc file quy tắc JSON và biên dịch"""
+    path = Path(path)
+    try:
+        data = json.loads(path.read_text(encoding='utf-8'))
+    except ValueError as e:
+        raise RuleError(f"{path.name}: JSON không hợp lệ ({e})") from e
+
+    if isinstance(data, dict) and 'rules' in data:
+        return compile_ruleset(data['rules'], data.get('color_classification_threshold'), str(path))
+    return compile_ruleset(data, None, str(path))
+
+
+def export_rules(path, rules=CLASSIFICATION_RULES,
+                 threshold=DEFAULT_SETTINGS['color_classification_threshold']):
+    """Ghi quy tắc ra file JSON (điểm bắt đầu để chỉnh sửa), ghi tạm rồi thay thế"""
+    path = Path(path)
+    data = {'color_classification_threshold': threshold, 'rules': rules}
+    temp = path.with_name(path.name + '.tmp')
+    temp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding='utf-8')
+    os.replace(temp, path)
+    return path
+
+
+class RuleWatcher:
+    """Theo dõi file quy tắc và nạp lại vào bộ phân loại khi file thay đổi
+
+    Luồng nền kiểm tra thời điểm sửa/kích thước file mỗi interval giây. Quy tắc
+    mới được kiểm tra và biên dịch trước, rồi thay thế nguyên khối vào bộ phân
+    loại; nếu file lỗi thì giữ nguyên quy tắc đang chạy.
+    """
+
+    def __init__(self, classifier, path, interval=None):
+        self.classifier = classifier
+        self.path = Path(path)
+        if interval is None:
+            interval = DEFAULT_SETTINGS['rules_reload_interval']
+        self.interval = max(0.1, float(interval))
+        self.last_error = None
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _file_signature(self):
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """Nạp lại nếu file đã đổi, trả về True nếu đã thay quy tắc"""
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            ruleset = load_ruleset(self.path)
+        except (RuleError, OSError) as e:
+            self.last_error = str(e)
+            logger.error("Không nạp được quy tắc màu: %s", e)
+            return False
+
+        self.last_error = None
+        self.classifier.apply_ruleset(ruleset)
+        if ruleset.warnings:
+            logger.warning("%d cảnh báo quy tắc màu:\n   %s", len(ruleset.warnings),
+                           "\n   ".join(ruleset.warnings[:5]),
+                           extra={'data': {'warnings': ruleset.warnings}})
+        logger.info("Đã nạp quy tắc màu từ %s", self.path.name)
+        return True
+
+    def start(self):
+        """Nạp file lần đầu và bắt đầu theo dõi"""
+        self.check()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='RuleWatcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Dừng theo dõi"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # Lỗi bất ngờ chỉ được ghi lại, luồng theo dõi tiếp tục chạy
+            try:
+                self.check()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("Lỗi khi nạp lại quy tắc màu từ %s", self.path.name)
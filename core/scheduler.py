@@ -0,0 +1,176 @@
+"""
+Gom lô (micro-batching) các yêu cầu dự đoán đồng thời trước DetectionModel
+"""
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from .config import DEFAULT_SETTINGS
+
+_STOP = object()
+
+
+class InferenceRequest:
+    """Một ảnh chờ dự đoán cùng tham số và future của người gọi"""
+
+    __slots__ = ('image', 'key', 'future', 'enqueued')
+
+    def __init__(self, image, confidence, classes, imgsz):
+        self.image = image
+        self.key = (confidence, tuple(classes) if classes is not None else None, imgsz)
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class BatchScheduler:
+    """Gom các yêu cầu predict() từ nhiều nguồn thành lô và chạy trong một luồng riêng
+
+    Một lô được chạy khi đủ max_batch_size ảnh hoặc khi yêu cầu cũ nhất đã chờ
+    max_wait_ms. Khi hệ thống rảnh (hàng đợi trống lúc yêu cầu đến) lô một ảnh
+    được chạy ngay nên độ trễ của yêu cầu đơn lẻ không tăng. Các yêu cầu có tham
+    số khác nhau (độ tin cậy, lớp, imgsz) được chạy thành các lượt riêng.
+
+    Các thuộc tính khác (get_class_ids, get_class_names...) chuyển thẳng tới
+    mô hình, nên có thể đưa scheduler vào ImageProcessor thay cho DetectionModel.
+    """
+
+    def __init__(self, model, max_batch_size=None, max_wait_ms=None, history=1000):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size or DEFAULT_SETTINGS['batch_size']))
+        if max_wait_ms is None:
+            max_wait_ms = DEFAULT_SETTINGS['scheduler_max_wait_ms']
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._waits = deque(maxlen=history)
+        self._requests = 0
+        self._batches = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Khởi động luồng gom lô"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='BatchScheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Dừng luồng gom lô sau khi chạy hết các yêu cầu đang chờ"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, image, confidence=0.5, classes=None, imgsz=None):
+        """Đưa một ảnh vào hàng đợi, trả về Future với kết quả (hoặc None nếu lỗi)"""
+        if self._thread is None:
+            self.start()
+        request = InferenceRequest(image, confidence, classes, imgsz)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, image, confidence=0.5, classes=None, imgsz=None):
+        """Cùng giao diện với DetectionModel.predict, nhưng đi qua hàng đợi"""
+        return self.submit(image, confidence, classes, imgsz).result()
+
+    def predict_batch(self, images, confidence=0.5, batch_size=8, classes=None, imgsz=None):
+        """Đưa nhiều ảnh vào hàng đợi, chúng được gom chung với yêu cầu của nguồn khác"""
+        futures = [self.submit(image, confidence, classes, imgsz) for image in images]
+        return [future.result() for future in futures]
+
+    def _collect(self, first):
+        """Gom thêm yêu cầu cho lô bắt đầu bằng first"""
+        batch = [first]
+        # Hàng đợi trống khi yêu cầu đầu tiên được lấy ra: hệ thống rảnh, chạy ngay
+        idle = self._queue.empty()
+        deadline = first.enqueued + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                if idle:
+                    request = self._queue.get_nowait()
+                else:
+                    request = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if request is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(request)
+
+        return batch
+
+    def _run(self):
+        """Vòng lặp của luồng gom lô"""
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            self._execute(self._collect(first))
+
+    def _execute(self, batch):
+        """Chạy một lô (mỗi nhóm tham số một lượt) và trả kết quả cho từng future"""
+        start = time.perf_counter()
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._waits.extend(start - request.enqueued for request in batch)
+
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.key, []).append(request)
+
+        for (confidence, classes, imgsz), requests in groups.items():
+            try:
+                results = self.model.predict_batch(
+                    [request.image for request in requests], confidence,
+                    len(requests), list(classes) if classes is not None else None, imgsz
+                )
+                for request, result in zip(requests, results):
+                    request.future.set_result(result)
+            except Exception as e:
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def stats(self):
+        """Thống kê: độ sâu hàng đợi, phân bố kích thước lô và thời gian chờ (ms)"""
+        with self._stats_lock:
+            waits = np.array(self._waits, dtype=np.float64) * 1000
+            histogram = dict(sorted(self._batch_sizes.items()))
+            batches, requests = self._batches, self._requests
+
+        return {
+            'queue_depth': self._queue.qsize(),
+            'requests': requests,
+            'batches': batches,
+            'mean_batch_size': requests / batches if batches else 0.0,
+            'batch_size_histogram': histogram,
+            'wait_ms_mean': float(waits.mean()) if len(waits) else 0.0,
+            'wait_ms_p50': float(np.percentile(waits, 50)) if len(waits) else 0.0,
+            'wait_ms_p95': float(np.percentile(waits, 95)) if len(waits) else 0.0,
+            'wait_ms_max': float(waits.max()) if len(waits) else 0.0
+        }
+
+    def reset_stats(self):
+        """Xóa thống kê đã thu thập"""
+        with self._stats_lock:
+            self._batch_sizes.clear()
+            self._waits.clear()
+            self._requests = self._batches = 0
@@ -9,12 +9,16 @@ import os
 from datetime import datetime
 
 from core import DetectionModel, FruitClassifier, DEFAULT_SETTINGS
-from core.config import PRODUCT_NAMES_VI
+from core.config import PRODUCT_NAMES_VI, QUALITY_MODEL_PATH, RULES_PATH
+from core.log import get_logger
 from processing import ImageProcessor
+from processing.pipeline import DENOISE_TIERS, PIPELINE_PRESETS, PREPROCESSING_STEPS, build_pipeline
 from gui.styles import configure_styles
 from gui.components import ImageCanvas, ProgressDialog
 from utils import save_results
 
+logger = get_logger('gui.main_window')
+
 
 class FruitDetectionApp:
     def __init__(self, root):
@@ -31,6 +35,15 @@ class FruitDetectionApp:
         # Khởi tạo các thành phần
         self.model = DetectionModel()
         self.classifier = FruitClassifier()
+        # Quy tắc màu ngoài: chỉnh file trong lúc chạy, không cần khởi động lại
+        # (file tạo sau khi mở ứng dụng cũng được nạp, file chưa có được coi là chưa đổi)
+        self.rule_watcher = self.classifier.watch_rules(RULES_PATH)
+        # Mô hình CNN chất lượng (nếu có), quy tắc HSV vẫn là dự phòng
+        if QUALITY_MODEL_PATH.exists():
+            try:
+                self.classifier.load_quality_model(QUALITY_MODEL_PATH)
+            except Exception as e:
+                logger.warning("Không tải được mô hình chất lượng: %s", e)
         self.image_processor = ImageProcessor(self.model, self.classifier)
 
         # Biến lưu trữ
@@ -46,12 +59,12 @@ class FruitDetectionApp:
         # Thiết lập UI
         self.setup_ui()
 
-        # Tải mô hình
-        self.load_model()
-
         # Thanh trạng thái
         self.update_status("Sẵn sàng - Hệ thống phân loại sản phẩm nông nghiệp")
 
+        # Tải mô hình trên luồng nền, giao diện dùng được ngay
+        self.load_model()
+
     def create_menu_bar(self):
         """Tạo thanh menu"""
         menubar = tk.Menu(self.root)
@@ -68,8 +81,11 @@ class FruitDetectionApp:
 
         # Menu Xử lý
         process_menu = tk.Menu(menubar, tearoff=0)
+        self.process_menu = process_menu
         menubar.add_cascade(label="Xử lý", menu=process_menu)
         process_menu.add_command(label="Phân tích ảnh", command=self.analyze_image, accelerator="F5")
+        process_menu.add_command(label="Phân loại lại (giữ kết quả phát hiện)",
+                                 command=self.reclassify_image, accelerator="F6")
         process_menu.add_command(label="Tiền xử lý ảnh...", command=self.show_preprocessing_preview)
         process_menu.add_separator()
         process_menu.add_command(label="Reset", command=self.reset_app, accelerator="Ctrl+R")
@@ -82,13 +98,10 @@ class FruitDetectionApp:
         preprocess_menu = tk.Menu(settings_menu, tearoff=0)
         settings_menu.add_cascade(label="Tiền xử lý ảnh", menu=preprocess_menu)
 
-        # Các biến cho menu tiền xử lý
+        # Các biến cho menu tiền xử lý (bật/tắt bước của pipeline)
+        default_steps = DEFAULT_SETTINGS['preprocessing_pipeline']
         self.preprocess_vars = {
-            'resize': tk.BooleanVar(value=True),
-            'enhance_contrast': tk.BooleanVar(value=True),
-            'denoise': tk.BooleanVar(value=True),
-            'sharpen': tk.BooleanVar(value=False),
-            'normalize': tk.BooleanVar(value=True)
+            step: tk.BooleanVar(value=step in default_steps) for step in PREPROCESSING_STEPS
         }
 
         preprocess_menu.add_checkbutton(label="Resize ảnh", variable=self.preprocess_vars['resize'],
@@ -101,6 +114,37 @@ class FruitDetectionApp:
                                        command=self.update_preprocessing_config)
         preprocess_menu.add_checkbutton(label="Chuẩn hóa", variable=self.preprocess_vars['normalize'],
                                        command=self.update_preprocessing_config)
+        preprocess_menu.add_separator()
+
+        # Mức khử nhiễu ('auto' = mức nhanh nhất đạt độ chính xác theo kết quả đo)
+        denoise_menu = tk.Menu(preprocess_menu, tearoff=0)
+        preprocess_menu.add_cascade(label="Mức khử nhiễu", menu=denoise_menu)
+        self.denoise_tier_var = tk.StringVar(value=DEFAULT_SETTINGS['denoise_tier'])
+        denoise_labels = {
+            'auto': "Tự động (theo kết quả đo)",
+            'none': "Không khử nhiễu",
+            'median': "Median 3x3",
+            'bilateral': "Bilateral",
+            'nlm_downsampled': "Non-local Means (ảnh 1/2)",
+            'nlm': "Non-local Means (đầy đủ, chậm)"
+        }
+        for tier in ('auto',) + DENOISE_TIERS:
+            denoise_menu.add_radiobutton(label=denoise_labels[tier], value=tier,
+                                         variable=self.denoise_tier_var,
+                                         command=self.update_preprocessing_config)
+        preprocess_menu.add_separator()
+
+        # Chuỗi nâng cao (CLAHE, median, gamma, bão hòa, unsharp, bilateral) thay cho các bước trên
+        self.enhanced_pipeline_var = tk.BooleanVar(value=False)
+        preprocess_menu.add_checkbutton(label="Chuỗi tiền xử lý nâng cao",
+                                       variable=self.enhanced_pipeline_var,
+                                       command=self.update_preprocessing_config)
+        preprocess_menu.add_separator()
+
+        # Resize một lần về kích thước đầu vào của mô hình thay vì 800x600 + letterbox
+        self.model_resize_var = tk.BooleanVar(value=DEFAULT_SETTINGS['resize_mode'] == 'model')
+        preprocess_menu.add_checkbutton(label="Resize theo kích thước mô hình (1 lần)",
+                                       variable=self.model_resize_var)
 
         # Menu Trợ giúp
         help_menu = tk.Menu(menubar, tearoff=0)
@@ -113,12 +157,20 @@ class FruitDetectionApp:
         self.root.bind('<Control-s>', lambda e: self.save_results())
         self.root.bind('<Control-r>', lambda e: self.reset_app())
         self.root.bind('<F5>', lambda e: self.analyze_image())
+        self.root.bind('<F6>', lambda e: self.reclassify_image())
         self.root.bind('<Control-q>', lambda e: self.root.quit())
 
     def update_preprocessing_config(self):
-        """Cập nhật cấu hình tiền xử lý"""
-        config = {key: var.get() for key, var in self.preprocess_vars.items()}
-        self.image_processor.set_preprocessing_config(**config)
+        """Dựng lại pipeline tiền xử lý từ các bước được chọn trong menu"""
+        steps = [step for step in PREPROCESSING_STEPS if self.preprocess_vars[step].get()]
+        if self.enhanced_pipeline_var.get():
+            # Giữ bước resize, các bước còn lại theo preset 'enhanced'
+            steps = [step for step in steps if step == 'resize'] + PIPELINE_PRESETS['enhanced']
+        pipeline = self.image_processor.set_pipeline(
+            build_pipeline(steps, denoise_tier=self.denoise_tier_var.get())
+        )
+        logger.info("Pipeline tiền xử lý: %s", ' -> '.join(pipeline.describe()) or 'không có bước',
+                    extra={'data': {'stages': pipeline.describe()}})
         self.update_status("Đã cập nhật cấu hình tiền xử lý")
 
     def show_help(self):
@@ -166,12 +218,48 @@ class FruitDetectionApp:
         messagebox.showinfo("Về ứng dụng", about_text)
 
     def load_model(self):
-        """Tải mô hình YOLO"""
-        self.update_status("Đang tải mô hình YOLO...")
-        if not self.model.load():
-            messagebox.showerror("Lỗi", "Không thể tải mô hình. Ứng dụng có thể không hoạt động đúng.")
+        """Tải mô hình YOLO (luồng nền) và theo dõi trạng thái"""
+        self.set_analysis_enabled(False)
+        self.model.load_async()
+        self.poll_model_state()
+
+    def poll_model_state(self):
+        """Cập nhật thanh trạng thái theo trạng thái tải mô hình"""
+        state = self.model.state
+
+        if state == 'ready':
+            self.set_analysis_enabled(True)
+            self.update_status(f"Mô hình {self.model.model_name} đã sẵn sàng")
+        elif state == 'error':
+            self.update_status("Không thể tải mô hình")
+            messagebox.showerror("Lỗi", "Không thể tải mô hình. Ứng dụng có thể không hoạt động đúng.\n"
+                                 f"{self.model.load_error}")
+        else:
+            messages = {
+                'warming_up': "Đang khởi động mô hình (chạy thử)...",
+            }
+            self.status_bar.config(text=messages.get(state, "Đang tải mô hình YOLO..."))
+            self.root.after(200, self.poll_model_state)
+
+    # Mục menu Xử lý cần mô hình đã tải (tắt cho đến khi state == 'ready')
+    MODEL_MENU_ENTRIES = ("Phân tích ảnh", "Phân loại lại (giữ kết quả phát hiện)")
+
+    def set_analysis_enabled(self, enabled):
+        """Bật/tắt các thao tác cần mô hình"""
+        state = 'normal' if enabled else 'disabled'
+        self.analyze_btn.config(state=state)
+        for label in self.MODEL_MENU_ENTRIES:
+            self.process_menu.entryconfig(label, state=state)
+
+    def model_ready(self):
+        """True nếu mô hình đã sẵn sàng; ngược lại báo cho người dùng (phím tắt bỏ qua menu bị tắt)"""
+        if self.model.state == 'ready':
+            return True
+        if self.model.state in ('idle', 'loading', 'warming_up'):
+            messagebox.showinfo("Thông báo", "Mô hình đang được tải, vui lòng chờ...")
         else:
-            self.update_status("Mô hình đã sẵn sàng")
+            messagebox.showerror("Lỗi", "Mô hình chưa được tải!")
+        return False
 
     def setup_ui(self):
         """Thiết lập giao diện người dùng"""
@@ -315,6 +403,8 @@ class FruitDetectionApp:
                 style='Primary.TButton'
             )
             btn.pack(pady=3, fill=tk.X)
+            if command == self.analyze_image:
+                self.analyze_btn = btn
 
     def on_confidence_change(self, *args):
         """Xử lý thay đổi ngưỡng tin cậy"""
@@ -513,8 +603,7 @@ class FruitDetectionApp:
             messagebox.showwarning("Cảnh báo", "Vui lòng tải ảnh trước!")
             return
 
-        if not self.model.is_loaded():
-            messagebox.showerror("Lỗi", "Mô hình chưa được tải!")
+        if not self.model_ready():
             return
 
         # Hiển thị dialog tiến trình
@@ -527,7 +616,8 @@ class FruitDetectionApp:
                 'product_type': self.product_var.get(),
                 'enable_quality': self.quality_var.get(),
                 'enable_size': self.size_var.get(),
-                'enable_preprocessing': self.preprocess_var.get()
+                'enable_preprocessing': self.preprocess_var.get(),
+                'resize_mode': 'model' if self.model_resize_var.get() else 'fixed'
             }
 
             progress.update_message("Đang tiền xử lý ảnh...")
@@ -542,39 +632,8 @@ class FruitDetectionApp:
             if not result or 'detections' not in result:
                 raise ValueError("Không có kết quả phát hiện")
 
-            # Cập nhật kết quả
-            self.processed_image = result['processed_image']
-            self.detection_results = result['detections']
-
             progress.update_message("Đang cập nhật giao diện...")
-
-            # Hiển thị ảnh đã xử lý
-            processed_rgb = cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(processed_rgb)
-            self.image_canvas.display_pil_image(pil_image)
-
-            # Cập nhật trạng thái toggle button
-            self.toggle_img_btn.config(state='normal', text="🔄 Xem ảnh gốc")
-            self.showing_original = False
-
-            # Cập nhật UI
-            self.update_results_table()
-            self.update_statistics()
-
-            # Tính số lượng từng loại
-            class_counts = {}
-            for result in self.detection_results:
-                class_name = result['class']
-                class_counts[class_name] = class_counts.get(class_name, 0) + 1
-
-            total_count = len(self.detection_results)
-            class_info = []
-            for class_name, count in sorted(class_counts.items(), key=lambda x: x[1], reverse=True):
-                class_name_vn = PRODUCT_NAMES_VI.get(class_name, class_name)
-                percentage = (count / total_count * 100) if total_count > 0 else 0
-                class_info.append(f"{class_name_vn}: {count} ({percentage:.1f}%)")
-
-            self.update_status(f"Đã phân tích {total_count} sản phẩm. " + " | ".join(class_info))
+            self.show_analysis_result(result)
 
             progress.update_message("Phân tích hoàn tất!")
 
@@ -587,6 +646,70 @@ class FruitDetectionApp:
         finally:
             progress.close()
 
+    def reclassify_image(self):
+        """Chỉ phân loại lại chất lượng trên box đã phát hiện (sau khi chỉnh quy tắc màu)"""
+        if not self.image_path:
+            messagebox.showwarning("Cảnh báo", "Vui lòng tải ảnh trước!")
+            return
+
+        if not self.model_ready():
+            return
+
+        if self.image_path not in self.image_processor.run_cache:
+            messagebox.showinfo("Thông báo", "Ảnh chưa được phân tích, hãy chạy 'Phân tích ảnh' trước.")
+            return
+
+        try:
+            settings = {
+                'enable_quality': self.quality_var.get(),
+                'enable_size': self.size_var.get()
+            }
+            result = self.image_processor.reclassify(self.image_path, settings)
+            self.show_analysis_result(result)
+
+        except Exception as e:
+            messagebox.showerror("Lỗi", f"Phân loại lại thất bại: {str(e)}")
+            self.update_status("Lỗi khi phân loại lại")
+            import traceback
+            traceback.print_exc()
+
+    def show_analysis_result(self, result):
+        """Hiển thị ảnh kết quả, bảng phân loại, thống kê và trạng thái"""
+        # Cập nhật kết quả
+        self.processed_image = result['processed_image']
+        self.detection_results = result['detections']
+
+        # Hiển thị ảnh đã xử lý
+        processed_rgb = cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2RGB)
+        pil_image = Image.fromarray(processed_rgb)
+        self.image_canvas.display_pil_image(pil_image)
+
+        # Cập nhật trạng thái toggle button
+        self.toggle_img_btn.config(state='normal', text="🔄 Xem ảnh gốc")
+        self.showing_original = False
+
+        # Cập nhật UI
+        self.update_results_table()
+        self.update_statistics()
+
+        # Tính số lượng từng loại
+        class_counts = {}
+        for detection in self.detection_results:
+            class_name = detection['class']
+            class_counts[class_name] = class_counts.get(class_name, 0) + 1
+
+        total_count = len(self.detection_results)
+        class_info = []
+        for class_name, count in sorted(class_counts.items(), key=lambda x: x[1], reverse=True):
+            class_name_vn = PRODUCT_NAMES_VI.get(class_name, class_name)
+            percentage = (count / total_count * 100) if total_count > 0 else 0
+            class_info.append(f"{class_name_vn}: {count} ({percentage:.1f}%)")
+
+        status = f"Đã phân tích {total_count} sản phẩm. " + " | ".join(class_info)
+        if 'reclassify_ms' in result:
+            status += f" (phân loại lại {result['reclassify_ms']:.0f} ms)"
+        self.update_status(status)
+
     def update_results_table(self):
         """Cập nhật bảng kết quả phân loại"""
         # Xóa dữ liệu cũ
@@ -918,17 +1041,12 @@ class FruitDetectionApp:
                 steps_frame = ttk.LabelFrame(preview_window, text="CÁC BƯỚC TIỀN XỬ LÝ ĐƯỢC ÁP DỤNG", padding=10)
                 steps_frame.pack(pady=10, padx=20, fill=tk.X)
 
-                steps_text = []
-                for step, enabled in self.preprocess_vars.items():
-                    if enabled.get():
-                        step_name = {
-                            'resize': 'Resize ảnh về kích thước phù hợp',
-                            'enhance_contrast': 'Tăng cường tương phản (CLAHE)',
-                            'denoise': 'Khử nhiễu (Non-local Means)',
-                            'sharpen': 'Làm sắc nét (Unsharp Mask)',
-                            'normalize': 'Chuẩn hóa cường độ pixel'
-                        }.get(step, step)
-                        steps_text.append(f"✓ {step_name}")
+                steps_text = [f"✓ {label}" for label in previews['steps']]
+                if previews['timings']:
+                    # Thời gian từng bước (bước theo pixel liền nhau được gộp thành một lượt)
+                    steps_text.append("⏱ " + ", ".join(
+                        f"{name}: {ms:.1f} ms" for name, ms in previews['timings'].items()
+                    ))
 
                 if steps_text:
                     for step in steps_text:
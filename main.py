@@ -8,12 +8,16 @@ import os
 # Thêm thư mục gốc vào sys.path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from core.log import configure_logging
 from gui.main_window import FruitDetectionApp
 
 
 def main():
     """Hàm chính khởi chạy ứng dụng"""
     try:
+        # Log theo LOG_SETTINGS (mức từng module, giới hạn tần suất, JSON tùy chọn)
+        configure_logging()
+
         # Tạo cửa sổ chính
         root = tk.Tk()
 
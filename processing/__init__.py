@@ -2,7 +2,14 @@
 Xử lý ảnh (không có video)
 """
 
-from .image_processor import ImageProcessor
+from .image_processor import ImageProcessor, inference_preprocess
+from .run_cache import RunCache
+from .pipeline import (
+    PipelineError,
+    PreprocessingPipeline,
+    build_pipeline,
+    register_stage
+)
 from .preprocessing import (
     preprocess_image,
     enhance_contrast,
@@ -13,6 +20,12 @@ from .preprocessing import (
 
 __all__ = [
     'ImageProcessor',
+    'inference_preprocess',
+    'RunCache',
+    'PipelineError',
+    'PreprocessingPipeline',
+    'build_pipeline',
+    'register_stage',
     'preprocess_image',
     'enhance_contrast',
     'reduce_noise',
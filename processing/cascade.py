@@ -0,0 +1,109 @@
+"""
+Suy luận hai tầng (cascade): chỉ chạy lại các vùng chưa chắc chắn ở tầng thứ hai
+"""
+import cv2
+import numpy as np
+
+# Nhóm chất lượng có màu đặc trưng của trái cây (bỏ 'hong' vì gồm cả vùng tối/xám của nền)
+FRUIT_COLOR_QUALITIES = ('xanh', 'chin', 'trung_binh')
+
+
+def fruit_color_ranges(rules, products):
+    """Các khoảng HSV (lower, upper) của màu trái cây cho danh sách sản phẩm"""
+    ranges = []
+    for product in products:
+        color_ranges = rules.get(product, {}).get('color_ranges', {})
+        for quality in FRUIT_COLOR_QUALITIES:
+            for lower, upper in color_ranges.get(quality, []):
+                if (tuple(lower), tuple(upper)) not in ranges:
+                    ranges.append((tuple(lower), tuple(upper)))
+    return ranges
+
+
+def expand_boxes(xyxy, margin, image_shape, min_size=0):
+    """Nới rộng box thêm margin (tỷ lệ cạnh) mỗi phía, cạnh tối thiểu min_size, cắt theo ảnh"""
+    h, w = image_shape[:2]
+    boxes = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int64)
+
+    center = (boxes[:, :2] + boxes[:, 2:]) / 2
+    size = (boxes[:, 2:] - boxes[:, :2]) * (1 + 2 * margin)
+    size = np.maximum(size, min_size)
+
+    expanded = np.concatenate([center - size / 2, center + size / 2], axis=1)
+    expanded[:, [0, 2]] = expanded[:, [0, 2]].clip(0, w)
+    expanded[:, [1, 3]] = expanded[:, [1, 3]].clip(0, h)
+    return expanded.round().astype(np.int64)
+
+
+def find_color_regions(image, covered_boxes, color_ranges, min_area_ratio=0.002,
+                       max_area_ratio=0.25, work_width=160):
+    """Tìm vùng có màu trái cây nhưng không nằm trong box nào của tầng thứ nhất
+
+    Chạy trên bản thu nhỏ (cạnh ngang work_width) nên chi phí không đáng kể.
+    Vùng quá lớn (> max_area_ratio khung hình) được coi là nền và bỏ qua.
+    Trả về mảng box xyxy (int) theo tọa độ của image, sắp xếp theo diện tích giảm dần.
+    """
+    if not color_ranges:
+        return np.empty((0, 4), dtype=np.int64)
+
+    h, w = image.shape[:2]
+    scale = min(1.0, work_width / w)
+    small = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                       interpolation=cv2.INTER_AREA) if scale < 1.0 else image
+
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    mask = np.zeros(hsv.shape[:2], dtype=np.uint8)
+    for lower, upper in color_ranges:
+        mask |= cv2.inRange(hsv, np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+
+    # Loại phần đã có box
+    for x1, y1, x2, y2 in (np.asarray(covered_boxes, dtype=np.float32).reshape(-1, 4) * scale).astype(np.int64):
+        mask[max(0, y1):max(0, y2) + 1, max(0, x1):max(0, x2) + 1] = 0
+
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), dtype=np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    frame_area = mask.shape[0] * mask.shape[1]
+    areas = stats[1:count, cv2.CC_STAT_AREA]
+    keep = (areas >= min_area_ratio * frame_area) & (areas <= max_area_ratio * frame_area)
+    stats = stats[1:count][keep]
+    stats = stats[np.argsort(-stats[:, cv2.CC_STAT_AREA])]
+
+    x, y = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    boxes = np.stack([x, y, x + stats[:, cv2.CC_STAT_WIDTH], y + stats[:, cv2.CC_STAT_HEIGHT]], axis=1)
+    return (boxes / scale).round().astype(np.int64).reshape(-1, 4)
+
+
+def merge_regions(regions, max_regions=6):
+    """Gộp các vùng chồng nhau thành hình chữ nhật bao, giữ tối đa max_regions vùng lớn nhất"""
+    regions = [list(r) for r in np.asarray(regions, dtype=np.int64).reshape(-1, 4)]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    regions = [r for r in regions if r[2] > r[0] and r[3] > r[1]]
+    regions.sort(key=lambda r: (r[2] - r[0]) * (r[3] - r[1]), reverse=True)
+    return np.array(regions[:max_regions], dtype=np.int64).reshape(-1, 4)
+
+
+def boxes_in_regions(xyxy, regions):
+    """Mask (box, vùng): tâm box nằm trong vùng"""
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    regions = np.asarray(regions, dtype=np.float32).reshape(-1, 4)
+    cx = (xyxy[:, 0] + xyxy[:, 2])[:, None] / 2
+    cy = (xyxy[:, 1] + xyxy[:, 3])[:, None] / 2
+    return ((cx >= regions[None, :, 0]) & (cx < regions[None, :, 2]) &
+            (cy >= regions[None, :, 1]) & (cy < regions[None, :, 3]))
@@ -1,10 +1,61 @@
 """
 Xử lý ảnh và phân tích
 """
+import time
 import cv2
 import numpy as np
-from core.config import AGRICULTURAL_PRODUCTS
+from core.backends import result_to_arrays
+from core.config import DEFAULT_SETTINGS, AGRICULTURAL_PRODUCTS
+from core.log import get_logger
+from processing.pipeline import PREPROCESSING_STEPS, PreprocessingPipeline, build_pipeline
 from processing.preprocessing import preprocess_image
+from processing.run_cache import RunCache
+from processing.tiling import compute_tiles, merge_tile_detections
+from processing.cascade import (
+    boxes_in_regions,
+    expand_boxes,
+    find_color_regions,
+    fruit_color_ranges,
+    merge_regions
+)
+
+logger = get_logger('processing.image_processor')
+
+
+def resize_to_input(image, input_size):
+    """Resize giữ tỷ lệ để cạnh dài bằng input_size; trả về (ảnh, (sx, sy))"""
+    h, w = image.shape[:2]
+    gain = min(input_size / w, input_size / h)
+    new_w = min(input_size, max(1, int(round(w * gain))))
+    new_h = min(input_size, max(1, int(round(h * gain))))
+
+    if (new_w, new_h) != (w, h):
+        interpolation = cv2.INTER_AREA if gain < 1.0 else cv2.INTER_LINEAR
+        image = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+
+    return image, (new_w / w, new_h / h)
+
+
+def inference_preprocess(input_size, settings=None):
+    """Hàm ảnh -> ảnh tiền xử lý giống ImageProcessor khi suy luận một lượt, không cần mô hình
+
+    Dùng khi hiệu chuẩn/đánh giá mô hình lượng tử hóa (core.quantization).
+
+    Chạy pipeline tiền xử lý (DEFAULT_SETTINGS['preprocessing_pipeline']) ở
+    800x600, hoặc với resize_mode='model' thì resize một lần về input_size rồi
+    mới chạy pipeline. Letterbox về đầu vào mô hình do backend làm sau đó.
+    """
+    settings = settings or {}
+    pipeline = build_pipeline() if settings.get('enable_preprocessing', True) else None
+    model_resize = settings.get('resize_mode', DEFAULT_SETTINGS['resize_mode']) == 'model'
+
+    def preprocess(image):
+        if model_resize:
+            image = resize_to_input(image, input_size)[0]
+            return pipeline.run(image, target_size=None) if pipeline is not None else image
+        return pipeline.run(image, target_size=(800, 600)) if pipeline is not None else image
+
+    return preprocess
 
 
 class ImageProcessor:
@@ -13,100 +64,346 @@ class ImageProcessor:
     def __init__(self, detection_model, classifier):
         self.model = detection_model
         self.classifier = classifier
+        # Box của các lần phân tích gần nhất, để phân loại lại khi đổi quy tắc màu
+        self.run_cache = RunCache(DEFAULT_SETTINGS['run_cache_size'],
+                                  DEFAULT_SETTINGS['run_cache_box_entries'])
 
-        # Các bước tiền xử lý mặc định
-        self.preprocessing_steps = {
-            'resize': True,
-            'enhance_contrast': True,
-            'denoise': True,
-            'sharpen': False,
-            'normalize': True
-        }
+        # Pipeline tiền xử lý (processing.pipeline), dựng lại khi đổi cấu hình
+        self.pipeline = build_pipeline(DEFAULT_SETTINGS['preprocessing_pipeline'])
+
+    def set_pipeline(self, pipeline):
+        """Thay pipeline tiền xử lý (PreprocessingPipeline, danh sách bước hoặc tên preset)"""
+        if not isinstance(pipeline, PreprocessingPipeline):
+            pipeline = build_pipeline(pipeline, denoise_tier=self.pipeline.denoise_tier)
+        self.pipeline = pipeline
+        return pipeline
+
+    def set_denoise_tier(self, tier):
+        """Đổi mức khử nhiễu (DENOISE_TIERS hoặc 'auto'), giữ nguyên các bước"""
+        return self.set_pipeline(build_pipeline(self.pipeline.names, self.pipeline.strip_rows, tier))
 
     def set_preprocessing_config(self, **kwargs):
-        """Cấu hình các bước tiền xử lý"""
+        """Bật/tắt các bước trong PREPROCESSING_STEPS (vd. denoise=False) và dựng lại pipeline
+
+        denoise_tier: đổi mức khử nhiễu cùng lúc (xem set_denoise_tier).
+        """
+        if 'denoise_tier' in kwargs:
+            self.set_denoise_tier(kwargs.pop('denoise_tier'))
+        enabled = set(self.pipeline.names)
         for key, value in kwargs.items():
-            if key in self.preprocessing_steps:
-                self.preprocessing_steps[key] = value
+            if key in PREPROCESSING_STEPS:
+                (enabled.add if value else enabled.discard)(key)
+        others = [name for name in self.pipeline.names if name not in PREPROCESSING_STEPS]
+        return self.set_pipeline([name for name in PREPROCESSING_STEPS if name in enabled] + others)
 
-    def preprocess_image(self, image, target_size=(800, 600)):
-        """Áp dụng các bước tiền xử lý ảnh"""
-        processed = image.copy()
+    def preprocess_image(self, image, target_size=(800, 600), timings=None):
+        """Áp dụng pipeline tiền xử lý (ảnh đầu vào không bị sửa)
 
-        # 1. Resize ảnh (giữ tỷ lệ)
-        if self.preprocessing_steps['resize'] and target_size:
-            h, w = processed.shape[:2]
-            target_w, target_h = target_size
+        timings: dict (tùy chọn) nhận thời gian (ms) của từng bước.
+        """
+        return self.pipeline.run(image, target_size=target_size, timings=timings)
 
-            # Tính tỷ lệ và resize
-            scale = min(target_w / w, target_h / h)
-            new_w, new_h = int(w * scale), int(h * scale)
+    def analyze(self, image_path, processed_image=None, settings=None, cache=True):
+        """Phân tích ảnh
 
-            # Sử dụng INTER_AREA cho downsampling, INTER_LINEAR cho upsampling
-            if scale < 1.0:
-                interpolation = cv2.INTER_AREA
-            else:
-                interpolation = cv2.INTER_LINEAR
-
-            processed = cv2.resize(processed, (new_w, new_h), interpolation=interpolation)
-
-        # 2. Tăng cường độ tương phản (CLAHE - Adaptive Histogram Equalization)
-        if self.preprocessing_steps['enhance_contrast']:
-            # Chuyển sang LAB color space
-            lab = cv2.cvtColor(processed, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-
-            # Áp dụng CLAHE cho kênh L (độ sáng)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            l_enhanced = clahe.apply(l)
-
-            # Merge lại và chuyển về BGR
-            lab_enhanced = cv2.merge([l_enhanced, a, b])
-            processed = cv2.cvtColor(lab_enhanced, cv2.COLOR_LAB2BGR)
-
-        # 3. Khử nhiễu (Non-local Means Denoising)
-        if self.preprocessing_steps['denoise']:
-            # Áp dụng cho ảnh màu
-            processed = cv2.fastNlMeansDenoisingColored(
-                processed,
-                None,
-                h=10,        # Độ mạnh lọc nhiễu
-                hColor=10,   # Độ mạnh lọc nhiễu màu
-                templateWindowSize=7,
-                searchWindowSize=21
-            )
+        cache=False: không ghi kết quả vào run_cache (dùng khi đo/đánh giá).
+        """
+        if settings is None:
+            settings = {}
+
+        if settings.get('tiled_inference', DEFAULT_SETTINGS['tiled_inference']):
+            result = self.analyze_tiled(image_path, processed_image, settings)
+        elif settings.get('cascade', DEFAULT_SETTINGS['cascade']):
+            result = self.analyze_cascade(image_path, processed_image, settings)
+        else:
+            frame = self._prepare_frame(image_path, processed_image, settings)
+
+            # Dự đoán với YOLO, chỉ giữ các lớp sản phẩm cần thiết trước NMS
+            confidence = settings.get('confidence', 0.5)
+            classes = self.model.get_class_ids(settings.get('product_type', 'auto'))
+            results = self.model.predict(frame['model_image'], confidence, classes)
 
-        # 4. Làm sắc nét (Unsharp Masking)
-        if self.preprocessing_steps['sharpen']:
-            # Tạo bộ lọc làm sắc nét
-            kernel = np.array([[-1, -1, -1],
-                             [-1,  9, -1],
-                             [-1, -1, -1]])
-            processed = cv2.filter2D(processed, -1, kernel)
-
-        # 5. Chuẩn hóa cường độ pixel
-        if self.preprocessing_steps['normalize']:
-            # Chuyển sang float32
-            processed = processed.astype(np.float32) / 255.0
-
-            # Chuẩn hóa mean và std
-            mean = np.mean(processed, axis=(0, 1, 2))
-            std = np.std(processed, axis=(0, 1, 2))
-            processed = (processed - mean) / (std + 1e-8)
-
-            # Scale về khoảng [0, 1] và chuyển về uint8
-            processed = np.clip(processed, -3, 3)  # Cắt bỏ ngoại lệ
-            processed = (processed - processed.min()) / (processed.max() - processed.min() + 1e-8)
-            processed = (processed * 255).astype(np.uint8)
-
-        return processed
-
-    def analyze(self, image_path, processed_image=None, settings=None):
-        """Phân tích ảnh"""
+            if results is None:
+                raise ValueError("Không có kết quả từ mô hình")
+
+            result = self._build_result(frame, results, settings)
+
+        if cache and image_path is not None:
+            self.run_cache.store(image_path, result, settings)
+        return result
+
+    def analyze_batch(self, image_paths, settings=None, batch_size=None):
+        """Phân tích nhiều ảnh, chạy mô hình theo lô
+
+        Trả về danh sách cùng thứ tự với image_paths, mỗi phần tử là kết quả
+        như analyze() hoặc một Exception nếu ảnh đó bị lỗi.
+        """
+        if settings is None:
+            settings = {}
+        if batch_size is None:
+            batch_size = settings.get('batch_size', DEFAULT_SETTINGS['batch_size'])
+        batch_size = max(1, int(batch_size))
+
+        confidence = settings.get('confidence', 0.5)
+        classes = self.model.get_class_ids(settings.get('product_type', 'auto'))
+        image_paths = list(image_paths)
+        outputs = []
+
+        # Đọc và xử lý từng lô để không giữ toàn bộ thư mục ảnh trong bộ nhớ
+        for start in range(0, len(image_paths), batch_size):
+            chunk_paths = image_paths[start:start + batch_size]
+            chunk_outputs = [None] * len(chunk_paths)
+            frames = []
+            positions = []
+
+            for i, image_path in enumerate(chunk_paths):
+                try:
+                    frames.append(self._prepare_frame(image_path, None, settings))
+                    positions.append(i)
+                except Exception as e:
+                    chunk_outputs[i] = e
+
+            if frames:
+                images = [frame['model_image'] for frame in frames]
+                results_list = self.model.predict_batch(images, confidence, batch_size, classes)
+
+                for i, frame, results in zip(positions, frames, results_list):
+                    try:
+                        if results is None:
+                            raise ValueError("Không có kết quả từ mô hình")
+                        chunk_outputs[i] = self._build_result(frame, results, settings)
+                        self.run_cache.store(chunk_paths[i], chunk_outputs[i], settings)
+                    except Exception as e:
+                        chunk_outputs[i] = e
+
+            outputs.extend(chunk_outputs)
+
+        return outputs
+
+    def analyze_tiled(self, image_path, processed_image=None, settings=None):
+        """Phân tích ảnh độ phân giải cao theo các ô chồng lấn ở độ phân giải mô hình"""
         if settings is None:
             settings = {}
 
-        # Đọc ảnh
+        # Giữ nguyên độ phân giải để vật nhỏ không bị mất khi thu nhỏ
+        image = self._prepare_image(image_path, processed_image, settings, target_size=None)
+
+        tile_size = settings.get('tile_size') or self.model.get_input_size()
+        tiles = compute_tiles(
+            image.shape,
+            tile_size,
+            settings.get('tile_overlap', DEFAULT_SETTINGS['tile_overlap']),
+            settings.get('max_tiles', DEFAULT_SETTINGS['max_tiles'])
+        )
+
+        # Các ô là view của ảnh, chạy theo lô qua mô hình
+        confidence = settings.get('confidence', 0.5)
+        classes = self.model.get_class_ids(settings.get('product_type', 'auto'))
+        crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
+        batch_size = settings.get('batch_size', DEFAULT_SETTINGS['batch_size'])
+        results_list = self.model.predict_batch(crops, confidence, batch_size, classes)
+
+        # Đưa tọa độ về toàn khung hình
+        all_xyxy, all_conf, all_cls = [], [], []
+        for (x1, y1, _, _), results in zip(tiles, results_list):
+            if results is None:
+                continue
+            xyxy, conf, cls = result_to_arrays(results)
+            all_xyxy.append(xyxy + np.array([x1, y1, x1, y1], dtype=np.float32))
+            all_conf.append(conf)
+            all_cls.append(cls)
+
+        if all_xyxy:
+            xyxy = np.concatenate(all_xyxy)
+            conf = np.concatenate(all_conf)
+            cls = np.concatenate(all_cls)
+
+            # Gộp box trùng ở đường nối giữa các ô
+            keep = merge_tile_detections(xyxy, conf, cls)
+            xyxy, conf, cls = self._filter_detections(xyxy[keep], conf[keep], cls[keep], settings)
+        else:
+            # Không ô nào có kết quả: trả về kết quả rỗng thay vì báo lỗi
+            xyxy = np.zeros((0, 4), dtype=np.float32)
+            conf = np.zeros(0, dtype=np.float32)
+            cls = np.zeros(0, dtype=np.int64)
+
+        result = self._annotate(image, xyxy, conf, cls, self.model.get_class_names(), settings)
+        result['tiles'] = tiles
+        return result
+
+    def analyze_cascade(self, image_path, processed_image=None, settings=None):
+        """Phân tích hai tầng: mô hình nhỏ ở độ phân giải thấp, chỉ chạy lại vùng khó
+
+        Tầng 1 chạy trên toàn ảnh với cascade_first_imgsz. Box có độ tin cậy trong
+        cascade_band và vùng có màu trái cây chưa có box được cắt (nới rộng thêm
+        cascade_margin) và chạy lại theo lô ở tầng 2 bằng cascade_model hoặc ở độ
+        phân giải cao hơn. Ảnh dễ chỉ tốn một lượt của tầng 1.
+        """
+        if settings is None:
+            settings = {}
+
+        def option(key):
+            return settings.get(key, DEFAULT_SETTINGS[key])
+
+        frame = self._prepare_frame(image_path, processed_image, settings)
+        image = frame['model_image']
+
+        confidence = settings.get('confidence', 0.5)
+        product_type = settings.get('product_type', 'auto')
+        low, high = option('cascade_band')
+        low, high = min(low, confidence), max(high, confidence)
+
+        # Tầng 1: hạ ngưỡng xuống đáy khoảng chưa chắc chắn để thấy các box sát ngưỡng
+        start = time.perf_counter()
+        first = self.model.predict(image, low, self.model.get_class_ids(product_type),
+                                   imgsz=option('cascade_first_imgsz'))
+        first_ms = (time.perf_counter() - start) * 1000
+        if first is None:
+            raise ValueError("Không có kết quả từ mô hình")
+
+        xyxy, conf, cls = result_to_arrays(first)
+        uncertain = conf < high
+
+        min_size = min(image.shape[:2]) / 8
+        regions = [expand_boxes(xyxy[uncertain], option('cascade_margin'), image.shape, min_size)]
+        color_count = 0
+        if option('cascade_color_regions'):
+            products = AGRICULTURAL_PRODUCTS if product_type == 'auto' else [product_type]
+            color_boxes = find_color_regions(image, xyxy,
+                                             fruit_color_ranges(self.classifier.rules, products))
+            color_count = len(color_boxes)
+            regions.append(expand_boxes(color_boxes, option('cascade_margin'), image.shape, min_size))
+        regions = merge_regions(np.concatenate(regions), option('cascade_max_regions'))
+
+        # Tầng 2: chạy lại các vùng cắt theo lô
+        second_ms = 0.0
+        resolved = np.zeros(len(xyxy), dtype=bool)
+        all_xyxy, all_conf, all_cls = [], [], []
+
+        if len(regions):
+            second = self.model.get_cascade_model(option('cascade_model'))
+            crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in regions.tolist()]
+            batch_size = settings.get('batch_size', DEFAULT_SETTINGS['batch_size'])
+
+            start = time.perf_counter()
+            results_list = second.predict_batch(crops, confidence, batch_size,
+                                                second.get_class_ids(product_type),
+                                                imgsz=option('cascade_second_imgsz'))
+            second_ms = (time.perf_counter() - start) * 1000
+
+            class_map = self._class_id_map(second)
+            inside = boxes_in_regions(xyxy, regions)
+
+            for index, ((x1, y1, _, _), results) in enumerate(zip(regions.tolist(), results_list)):
+                if results is None:
+                    continue
+                # Box chưa chắc chắn trong vùng này đã được tầng 2 đánh giá lại
+                resolved |= uncertain & inside[:, index]
+
+                crop_xyxy, crop_conf, crop_cls = result_to_arrays(results)
+                crop_cls = class_map[crop_cls] if len(crop_cls) else crop_cls
+                known = crop_cls >= 0
+                all_xyxy.append(crop_xyxy[known] + np.array([x1, y1, x1, y1], dtype=np.float32))
+                all_conf.append(crop_conf[known])
+                all_cls.append(crop_cls[known])
+
+        # Gộp box tầng 1 (chắc chắn hoặc chưa được chạy lại) với box tầng 2
+        xyxy = np.concatenate([xyxy[~resolved]] + all_xyxy)
+        conf = np.concatenate([conf[~resolved]] + all_conf)
+        cls = np.concatenate([cls[~resolved]] + all_cls)
+
+        keep = merge_tile_detections(xyxy, conf, cls)
+        result = self._finish_result(frame, xyxy[keep], conf[keep], cls[keep],
+                                     self.model.get_class_names(), settings)
+        result['cascade'] = {
+            'first_pass_boxes': len(uncertain),
+            'uncertain': int(uncertain.sum()),
+            'color_regions': color_count,
+            'regions': [tuple(r) for r in regions.tolist()],
+            'escalated': bool(len(regions)),
+            'first_ms': first_ms,
+            'second_ms': second_ms
+        }
+        return result
+
+    def reclassify(self, image_path, settings=None):
+        """Chỉ chạy lại phân loại chất lượng/kích thước trên box đã lưu của image_path
+
+        Dùng khi đổi quy tắc màu hoặc color_classification_threshold: không chạy
+        YOLO. Ảnh chỉ được đọc lại và tiền xử lý lại khi bộ đệm đã bỏ khung hình của
+        mục này (ngoài run_cache_size ảnh gần nhất). settings ghi đè cài đặt của lần
+        phân tích trước (vd. enable_quality, enable_size). Kết quả có cùng dạng với
+        analyze() và thêm 'statistics', 'reclassify_ms'.
+        """
+        from utils.statistics import calculate_statistics
+
+        entry = self.run_cache.get(image_path)
+        if entry is None:
+            raise ValueError(f"Chưa có kết quả phát hiện cho ảnh: {image_path}")
+
+        merged = dict(entry['settings'])
+        merged.update(settings or {})
+
+        start = time.perf_counter()
+        image, crop_image, crop_scale = entry['image'], entry['crop_image'], entry['crop_scale']
+        if image is None:
+            image, crop_image, crop_scale = self._reload_frame(image_path, entry)
+        result = self._annotate(image, entry['boxes'], entry['scores'], entry['class_ids'],
+                                entry['names'], merged, crop_image, crop_scale)
+        result['reclassify_ms'] = (time.perf_counter() - start) * 1000
+        result['statistics'] = calculate_statistics(result['detections'])
+        return result
+
+    def _reload_frame(self, image_path, entry):
+        """Đọc lại ảnh của một mục đã bỏ khung hình, theo cài đặt của lần phân tích"""
+        settings = entry['settings']
+        if settings.get('tiled_inference', DEFAULT_SETTINGS['tiled_inference']):
+            image = self._prepare_image(image_path, None, settings, target_size=None)
+            image, crop_image, crop_scale = image, image, (1.0, 1.0)
+        else:
+            frame = self._prepare_frame(image_path, None, settings)
+            image, crop_image, crop_scale = frame['image'], frame['crop_image'], frame['crop_scale']
+
+        if image.shape != entry['shape']:
+            raise ValueError(f"Ảnh đã thay đổi kể từ lần phân tích, hãy phân tích lại: {image_path}")
+        return image, crop_image, crop_scale
+
+    def reclassify_batch(self, image_paths=None, settings=None):
+        """Phân loại lại nhiều ảnh đã phân tích (mặc định: mọi ảnh trong bộ đệm)
+
+        Trả về {'results': [{'image_path', 'result'} hoặc {'image_path', 'error'}],
+        'statistics': thống kê toàn lô}.
+        """
+        from utils.statistics import calculate_batch_statistics
+
+        if image_paths is None:
+            image_paths = self.run_cache.keys()
+
+        results = []
+        for image_path in image_paths:
+            try:
+                results.append({'image_path': image_path,
+                                'result': self.reclassify(image_path, settings)})
+            except Exception as e:
+                results.append({'image_path': image_path, 'error': str(e)})
+
+        return {'results': results, 'statistics': calculate_batch_statistics(results)}
+
+    def _class_id_map(self, other_model):
+        """Bảng chuyển chỉ số lớp của other_model sang chỉ số lớp của mô hình chính (-1 = không có)"""
+        other_names = other_model.get_class_names()
+        size = max((int(i) for i in other_names), default=-1) + 1
+        if other_model is self.model:
+            return np.arange(size, dtype=np.int64)
+
+        ids = {name: int(i) for i, name in self.model.get_class_names().items()}
+        class_map = np.full(size, -1, dtype=np.int64)
+        for i, name in other_names.items():
+            class_map[int(i)] = ids.get(name, -1)
+        return class_map
+
+    def _read_image(self, image_path, processed_image=None):
+        """Đọc ảnh từ file (hoặc sao chép ảnh đã có)"""
         if processed_image is not None:
             image = processed_image.copy()
         else:
@@ -115,83 +412,228 @@ class ImageProcessor:
         if image is None:
             raise ValueError("Không thể đọc ảnh")
 
+        return image
+
+    def _prepare_image(self, image_path, processed_image, settings, target_size=(800, 600)):
+        """Đọc ảnh và tiền xử lý (nếu được bật trong settings)"""
+        image = self._read_image(image_path, processed_image)
+
         # Tiền xử lý ảnh (nếu được bật trong settings)
         if settings.get('enable_preprocessing', True):
-            image = self.preprocess_image(image)
+            image = self.preprocess_image(image, target_size)
+
+        return image
+
+    def resize_to_model(self, image, input_size=None):
+        """Resize một lần về kích thước đầu vào của mô hình (giữ tỷ lệ)
+
+        Cạnh dài bằng đúng input_size nên bước letterbox của mô hình chỉ còn thêm
+        viền, không nội suy lại. Trả về (ảnh, (sx, sy)) với sx, sy là tỷ lệ thực
+        trên từng trục sau khi làm tròn.
+        """
+        if input_size is None:
+            input_size = self.model.get_input_size()
+        return resize_to_input(image, input_size)
+
+    def _prepare_frame(self, image_path, processed_image, settings):
+        """Chuẩn bị ảnh đưa vào mô hình và ảnh dùng để cắt/vẽ kết quả
+
+        Trả về dict gồm:
+            image: khung hình báo cáo tọa độ và vẽ kết quả
+            model_image: ảnh đưa vào mô hình
+            detection_scale: (sx, sy) pixel của model_image trên pixel của image
+            crop_image, crop_scale: ảnh cắt đối tượng để phân loại và tỷ lệ tương ứng
+        """
+        resize_mode = settings.get('resize_mode', DEFAULT_SETTINGS['resize_mode'])
+
+        if settings.get('multi_resolution', DEFAULT_SETTINGS['multi_resolution']):
+            return self._prepare_multi_resolution_frame(image_path, processed_image, settings)
+
+        if resize_mode == 'model':
+            # Một lần letterbox: các bước tiền xử lý chạy ở đúng độ phân giải mô hình thấy
+            original = self._read_image(image_path, processed_image)
+            model_image, scale = self.resize_to_model(original)
+            if settings.get('enable_preprocessing', True):
+                model_image = self.preprocess_image(model_image, target_size=None)
+
+            return {
+                'image': original,
+                'model_image': model_image,
+                'detection_scale': scale,
+                'crop_image': model_image,
+                'crop_scale': scale
+            }
+
+        image = self._prepare_image(image_path, processed_image, settings)
+        return {
+            'image': image,
+            'model_image': image,
+            'detection_scale': (1.0, 1.0),
+            'crop_image': image,
+            'crop_scale': (1.0, 1.0)
+        }
+
+    def _prepare_multi_resolution_frame(self, image_path, processed_image, settings):
+        """Phát hiện trên bản thu nhỏ, phân loại màu trên ảnh gốc chưa chuẩn hóa
+
+        detection_resolution: (w, h) tối đa của ảnh đưa vào mô hình.
+        classification_resolution: (w, h) tối đa của ảnh cắt đối tượng, None = độ phân giải gốc.
+        """
+        original = self._read_image(image_path, processed_image)
+        h, w = original.shape[:2]
+
+        # Ảnh phát hiện: thu nhỏ rồi mới tiền xử lý (các bước đắt chạy trên ảnh nhỏ)
+        detection_size = settings.get('detection_resolution',
+                                      DEFAULT_SETTINGS['detection_resolution'])
+        model_image = original
+        if settings.get('enable_preprocessing', True):
+            model_image = self.preprocess_image(original, detection_size)
+        elif detection_size:
+            model_image = self._downscale(original, detection_size)
+        detection_scale = (model_image.shape[1] / w, model_image.shape[0] / h)
+
+        # Ảnh phân loại: ảnh gốc (không chuẩn hóa), chỉ thu nhỏ nếu được cấu hình
+        classification_size = settings.get('classification_resolution',
+                                           DEFAULT_SETTINGS['classification_resolution'])
+        crop_image = self._downscale(original, classification_size) if classification_size else original
+        crop_scale = (crop_image.shape[1] / w, crop_image.shape[0] / h)
+
+        return {
+            'image': original,
+            'model_image': model_image,
+            'detection_scale': detection_scale,
+            'crop_image': crop_image,
+            'crop_scale': crop_scale
+        }
 
-        # Dự đoán với YOLO
+    @staticmethod
+    def _downscale(image, max_size):
+        """Thu nhỏ ảnh (giữ tỷ lệ) để vừa max_size (w, h); không phóng to"""
+        h, w = image.shape[:2]
+        max_w, max_h = max_size
+        scale = min(max_w / w, max_h / h)
+        if scale >= 1.0:
+            return image
+        return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                          interpolation=cv2.INTER_AREA)
+
+    def _build_result(self, frame, results, settings):
+        """Lọc, phân loại và vẽ các đối tượng từ kết quả của mô hình"""
+        # Chuyển boxes về host một lần (Results của ultralytics hoặc DetectionResult của ONNX)
+        xyxy, conf, cls = result_to_arrays(results)
+        return self._finish_result(frame, xyxy, conf, cls, results.names, settings)
+
+    def _finish_result(self, frame, xyxy, conf, cls, names, settings):
+        """Lọc box (tọa độ theo model_image), đưa về khung hình báo cáo, phân loại và vẽ"""
+        xyxy, conf, cls = self._filter_detections(xyxy, conf, cls, settings)
+
+        # Đưa tọa độ từ ảnh của mô hình về khung hình báo cáo
+        sx, sy = frame['detection_scale']
+        if (sx, sy) != (1.0, 1.0):
+            xyxy = xyxy / np.array([sx, sy, sx, sy], dtype=np.float32)
+
+        return self._annotate(frame['image'], xyxy, conf, cls, names, settings,
+                              frame['crop_image'], frame['crop_scale'])
+
+    def _filter_detections(self, xyxy, conf, cls, settings):
+        """Giữ các box đủ tin cậy và đúng loại sản phẩm"""
         confidence = settings.get('confidence', 0.5)
-        results = self.model.predict(image, confidence)
+        product_type = settings.get('product_type', 'auto')
 
-        if results is None:
-            raise ValueError("Không có kết quả từ mô hình")
+        class_mask = self.model.get_class_mask(product_type)
+        known = cls < len(class_mask)
+        keep = (conf > confidence) & known
+        keep[known] &= class_mask[cls[known]]
+
+        return xyxy[keep], conf[keep], cls[keep]
+
+    def _annotate(self, image, xyxy, conf, cls, names, settings,
+                  crop_image=None, crop_scale=(1.0, 1.0)):
+        """Phân loại chất lượng/kích thước và vẽ kết quả cho các box đã lọc
+
+        Tọa độ xyxy thuộc khung hình image; vùng cắt để phân loại lấy từ crop_image
+        (mặc định chính là image) theo tỷ lệ crop_scale.
+        """
+        if crop_image is None:
+            crop_image = image
+
+        sx, sy = crop_scale
+        crop_boxes = xyxy * np.array([sx, sy, sx, sy], dtype=np.float32)
+
+        # Vùng cắt crop_image[int(y1):int(y2), int(x1):int(x2)] phải khác rỗng
+        corners = crop_boxes.astype(np.int64)
+        keep = (corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1])
+        xyxy, conf, cls, corners = xyxy[keep], conf[keep], cls[keep], corners[keep]
 
-        # Xử lý kết quả
         processed = image.copy()
         detections = []
 
-        product_type = settings.get('product_type', 'auto')
         enable_quality = settings.get('enable_quality', True)
         enable_size = settings.get('enable_size', True)
 
-        for box in results.boxes:
-            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-            conf = box.conf[0].cpu().numpy()
-            cls = int(box.cls[0].cpu().numpy())
-            class_name = results.names[cls]
-
-            # Kiểm tra loại sản phẩm
-            is_agri_product = class_name in AGRICULTURAL_PRODUCTS
-
-            if (product_type == 'auto' and is_agri_product and conf > confidence) or \
-               (product_type != 'auto' and class_name == product_type and conf > confidence):
-
-                # Cắt ảnh đối tượng
-                obj_img = image[int(y1):int(y2), int(x1):int(x2)]
-
-                if obj_img.size > 0:
-                    # Phân tích đối tượng
-                    analysis = self.classifier.analyze_object(
-                        obj_img, class_name, (x1, y1, x2, y2),
-                        enable_quality, enable_size
-                    )
-
-                    detections.append(analysis)
-
-                    # Vẽ bounding box
-                    color = self.classifier.get_quality_color_bgr(analysis['quality'])
-                    thickness = max(1, int(min(image.shape[:2]) / 300))
-                    cv2.rectangle(processed,
-                                (int(x1), int(y1)),
-                                (int(x2), int(y2)),
-                                color, thickness)
-
-                    # Thêm nhãn
-                    label = f"{class_name} {analysis['quality']}"
-                    if enable_size:
-                        label += f" {analysis['size_category']}"
-
-                    font_scale = min(image.shape[:2]) / 1000
-                    font_scale = max(0.5, min(1.0, font_scale))
-
-                    cv2.putText(processed, label,
-                              (int(x1), int(y1) - 10),
-                              cv2.FONT_HERSHEY_SIMPLEX,
-                              font_scale, color, thickness)
-
-                    # Thông tin kích thước và điểm số
-                    if enable_size:
-                        info_text = f"Size: {analysis['size_px']:.0f}px"
-                        cv2.putText(processed, info_text,
-                                  (int(x1), int(y2) + 20),
-                                  cv2.FONT_HERSHEY_SIMPLEX,
-                                  font_scale * 0.8, color, thickness - 1)
+        # Phân loại mọi đối tượng trong một lần gọi (ảnh dày đặc box dùng bảng tích lũy
+        # của cả khung hình thay vì quét từng ảnh cắt)
+        classified = self.classifier.classify_objects(
+            crop_image, corners, cls, names, enable_quality,
+            settings.get('frame_features', DEFAULT_SETTINGS['frame_features']),
+            settings.get('color_conversion', DEFAULT_SETTINGS['color_conversion']),
+            settings.get('quality_sampling', DEFAULT_SETTINGS['quality_sampling']),
+            settings.get('coarse_to_fine', DEFAULT_SETTINGS['coarse_to_fine']),
+            settings.get('use_quality_model', DEFAULT_SETTINGS['use_quality_model'])
+        )
+
+        thickness = max(1, int(min(image.shape[:2]) / 300))
+        font_scale = min(image.shape[:2]) / 1000
+        font_scale = max(0.5, min(1.0, font_scale))
+
+        for (x1, y1, x2, y2), class_name, quality, quality_score in zip(
+                xyxy.tolist(), classified['class'], classified['quality'],
+                classified['quality_score'].tolist()):
+            # Kết quả phân tích đối tượng
+            analysis = self.classifier.object_result(
+                class_name, (x1, y1, x2, y2), quality, quality_score, enable_size
+            )
+
+            detections.append(analysis)
+
+            # Vẽ bounding box
+            color = self.classifier.get_quality_color_bgr(analysis['quality'])
+            cv2.rectangle(processed,
+                        (int(x1), int(y1)),
+                        (int(x2), int(y2)),
+                        color, thickness)
+
+            # Thêm nhãn
+            label = f"{class_name} {analysis['quality']}"
+            if enable_size:
+                label += f" {analysis['size_category']}"
+
+            cv2.putText(processed, label,
+                      (int(x1), int(y1) - 10),
+                      cv2.FONT_HERSHEY_SIMPLEX,
+                      font_scale, color, thickness)
+
+            # Thông tin kích thước và điểm số
+            if enable_size:
+                info_text = f"Size: {analysis['size_px']:.0f}px"
+                cv2.putText(processed, info_text,
+                          (int(x1), int(y2) + 20),
+                          cv2.FONT_HERSHEY_SIMPLEX,
+                          font_scale * 0.8, color, thickness - 1)
 
         return {
             'processed_image': processed,
             'detections': detections,
             'original_image': image,
-            'settings': settings
+            'settings': settings,
+            # Mảng NumPy của các box còn lại, cùng thứ tự với detections
+            'boxes': xyxy,
+            'scores': conf,
+            'class_ids': cls,
+            # Ảnh và bảng lớp dùng để phân loại lại (RunCache, reclassify)
+            'names': names,
+            'crop_image': crop_image,
+            'crop_scale': crop_scale
         }
 
     def get_preview_images(self, image_path):
@@ -202,7 +644,8 @@ class ImageProcessor:
             return None
 
         # Áp dụng tiền xử lý
-        processed = self.preprocess_image(original.copy())
+        timings = {}
+        processed = self.preprocess_image(original, timings=timings)
 
         # Tạo side-by-side comparison
         h_orig, w_orig = original.shape[:2]
@@ -237,7 +680,9 @@ class ImageProcessor:
         return {
             'original': original,
             'processed': processed,
-            'comparison': comparison_with_title
+            'comparison': comparison_with_title,
+            'steps': self.pipeline.labels,
+            'timings': timings
         }
 
     def preprocess(self, image_path):
@@ -249,19 +694,21 @@ class ImageProcessor:
         if settings is None:
             settings = {}
 
+        image_paths = list(image_paths)
+        outputs = self.analyze_batch(image_paths, settings)
+
         results = []
-        for image_path in image_paths:
-            try:
-                result = self.analyze(image_path, None, settings)
+        for image_path, output in zip(image_paths, outputs):
+            if isinstance(output, Exception):
+                logger.error("Lỗi xử lý %s: %s", image_path, output)
                 results.append({
                     'image_path': image_path,
-                    'result': result
+                    'error': str(output)
                 })
-            except Exception as e:
-                print(f"Lỗi xử lý {image_path}: {e}")
+            else:
                 results.append({
                     'image_path': image_path,
-                    'error': str(e)
+                    'result': output
                 })
 
-        return results
\ No newline at end of file
+        return results
@@ -0,0 +1,445 @@
+"""
+Bộ máy tiền xử lý dạng đồ thị các bước (stage)
+
+Mỗi bước được đăng ký với không gian màu và kiểu dữ liệu đầu vào/đầu ra. Khi dựng
+pipeline, bộ máy:
+- chỉ chèn chuyển đổi màu khi bước kế tiếp cần không gian khác không gian hiện tại,
+  nên các bước LAB liền nhau chỉ đổi màu một lần (không còn BGR->LAB->BGR->LAB);
+- bỏ các bước đồng nhất (bảng tra không đổi giá trị);
+- gộp các bước theo từng pixel liền nhau (bảng tra, chuyển đổi màu) thành một lượt
+  theo dải hàng: bảng tra cùng không gian được ghép thành một bảng, còn mỗi dải đi
+  qua cả chuỗi khi còn nằm trong cache;
+- đo thời gian từng bước (hoặc từng nhóm đã gộp).
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from core.config import DEFAULT_SETTINGS, DENOISE_PROFILE_PATH
+from core.log import emit_report, get_logger
+
+logger = get_logger('processing.pipeline')
+
+# Chuyển đổi trực tiếp giữa các không gian màu (3 kênh, uint8)
+CONVERSIONS = {
+    ('bgr', 'lab'): cv2.COLOR_BGR2LAB,
+    ('lab', 'bgr'): cv2.COLOR_LAB2BGR,
+    ('bgr', 'hsv'): cv2.COLOR_BGR2HSV,
+    ('hsv', 'bgr'): cv2.COLOR_HSV2BGR,
+    ('bgr', 'yuv'): cv2.COLOR_BGR2YUV,
+    ('yuv', 'bgr'): cv2.COLOR_YUV2BGR
+}
+
+# Thứ tự các bước bật/tắt được trong menu (ImageProcessor, FruitDetectionApp)
+PREPROCESSING_STEPS = ['resize', 'enhance_contrast', 'denoise', 'sharpen', 'normalize']
+
+PIPELINE_PRESETS = {
+    # Các bước mặc định của ImageProcessor
+    'default': ['resize', 'enhance_contrast', 'denoise', 'normalize'],
+    # Chuỗi 9 bước của processing.preprocessing.preprocess_image
+    'enhanced': ['enhance_contrast', 'median', 'gamma', 'color_boost',
+                 'unsharp', 'white_balance', 'bilateral']
+}
+
+
+# Các mức khử nhiễu, từ nhanh nhất đến chậm nhất
+DENOISE_TIERS = ('none', 'median', 'bilateral', 'nlm_downsampled', 'nlm')
+
+# Mức dùng cho 'auto' khi chưa có kết quả đo: giữ NLM đầy đủ như trước, chỉ đổi
+# sang mức nhanh hơn sau khi denoise_tier_benchmark đã ghi DENOISE_PROFILE_PATH
+FALLBACK_DENOISE_TIER = 'nlm'
+
+
+class PipelineError(ValueError):
+    """Pipeline tiền xử lý không hợp lệ"""
+
+
+class Stage:
+    """Một bước tiền xử lý đã đăng ký
+
+    kind='op': func(image, context) -> ảnh, chạy trên cả ảnh trong không gian space
+    (space=None: chạy trong không gian hiện tại, vd. resize).
+    kind='lut': func(image, context) -> bảng tra (1, 256, 3) uint8 trong space, hoặc
+    None nếu là bước đồng nhất. Bảng không phụ thuộc ảnh (adaptive=False) được tính
+    một lần khi dựng pipeline (func nhận image=None).
+    """
+
+    def __init__(self, name, label, func, space='bgr', kind='op', adaptive=False,
+                 input_dtype='uint8', output_dtype='uint8'):
+        self.name = name
+        self.label = label
+        self.func = func
+        self.space = space
+        self.kind = kind
+        self.adaptive = adaptive
+        self.input_dtype = input_dtype
+        self.output_dtype = output_dtype
+
+    @property
+    def pointwise(self):
+        return self.kind == 'lut'
+
+
+STAGES = OrderedDict()
+
+
+def register_stage(name, label, space='bgr', kind='op', adaptive=False,
+                   input_dtype='uint8', output_dtype='uint8'):
+    """Decorator đăng ký một bước tiền xử lý theo tên"""
+    def decorator(func):
+        STAGES[name] = Stage(name, label, func, space, kind, adaptive, input_dtype, output_dtype)
+        return func
+    return decorator
+
+
+def _channel_lut(*channels):
+    """Bảng tra 3 kênh cho cv2.LUT từ 3 bảng 256 giá trị (None = giữ nguyên)"""
+    identity = np.arange(256)
+    table = np.stack([identity if c is None else c for c in channels], axis=-1)
+    return np.clip(table, 0, 255).astype(np.uint8).reshape(1, 256, 3)
+
+
+def _compose_lut(first, second):
+    """Bảng tra tương đương áp first rồi second"""
+    composed = np.empty_like(first)
+    for c in range(3):
+        composed[0, :, c] = second[0, first[0, :, c], c]
+    return composed
+
+
+# ============================================================================
+# CÁC BƯỚC TIỀN XỬ LÝ
+# ============================================================================
+
+@register_stage('resize', 'Resize ảnh về kích thước phù hợp', space=None)
+def _resize(image, context):
+    """Resize giữ tỷ lệ về context['target_size'] (w, h); bỏ qua nếu None"""
+    target_size = context.get('target_size')
+    if not target_size:
+        return image
+
+    h, w = image.shape[:2]
+    target_w, target_h = target_size
+    scale = min(target_w / w, target_h / h)
+    new_w, new_h = int(w * scale), int(h * scale)
+
+    # INTER_AREA cho downsampling, INTER_LINEAR cho upsampling
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    return cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+
+
+@register_stage('enhance_contrast', 'Tăng cường tương phản (CLAHE)', space='lab')
+def _clahe(lab, context):
+    """CLAHE trên kênh L (độ sáng)"""
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    lab = lab.copy()
+    lab[:, :, 0] = clahe.apply(np.ascontiguousarray(lab[:, :, 0]))
+    return lab
+
+
+def resolve_denoise_tier(tier=None):
+    """Mức khử nhiễu cụ thể; 'auto' lấy mức đã chọn trong DENOISE_PROFILE_PATH"""
+    if tier is None:
+        tier = DEFAULT_SETTINGS['denoise_tier']
+    if tier == 'auto':
+        try:
+            tier = json.loads(DENOISE_PROFILE_PATH.read_text(encoding='utf-8'))['selected']
+        except (OSError, ValueError, KeyError):
+            tier = FALLBACK_DENOISE_TIER
+    if tier not in DENOISE_TIERS:
+        raise PipelineError(f"Mức khử nhiễu không hợp lệ: {tier}. Hỗ trợ: {', '.join(DENOISE_TIERS)}")
+    return tier
+
+
+def denoise(image, tier):
+    """Khử nhiễu ảnh BGR theo mức tier (xem DENOISE_TIERS)"""
+    if tier == 'none':
+        return image
+    if tier == 'median':
+        return cv2.medianBlur(image, 3)
+    if tier == 'bilateral':
+        return cv2.bilateralFilter(image, 5, 50, 50)
+    if tier == 'nlm_downsampled':
+        # NLM trên ảnh 1/2 (~1/4 số pixel, cửa sổ tìm nhỏ hơn), phóng to lại rồi cộng
+        # phần chi tiết tần số cao của ảnh gốc; chi tiết được co về 0 theo ngưỡng 2 sigma
+        # (sigma ước lượng bằng MAD) nên giữ cạnh nhưng bỏ phần lớn nhiễu hạt
+        h, w = image.shape[:2]
+        if min(h, w) < 16:
+            return cv2.medianBlur(image, 3)
+        small = cv2.resize(image, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        cleaned = cv2.fastNlMeansDenoisingColored(small, None, h=10, hColor=10,
+                                                  templateWindowSize=5, searchWindowSize=11)
+
+        detail = image.astype(np.float32)
+        detail -= cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+        threshold = 2.0 * np.median(np.abs(detail)) / 0.6745
+        detail = np.sign(detail) * np.maximum(np.abs(detail) - threshold, 0)
+
+        result = cv2.resize(cleaned, (w, h), interpolation=cv2.INTER_LINEAR).astype(np.float32)
+        result += detail
+        return np.clip(np.rint(result), 0, 255).astype(np.uint8)
+    return cv2.fastNlMeansDenoisingColored(
+        image,
+        None,
+        h=10,        # Độ mạnh lọc nhiễu
+        hColor=10,   # Độ mạnh lọc nhiễu màu
+        templateWindowSize=7,
+        searchWindowSize=21
+    )
+
+
+@register_stage('denoise', 'Khử nhiễu (mức theo denoise_tier)')
+def _denoise(image, context):
+    return denoise(image, context['denoise_tier'])
+
+
+@register_stage('sharpen', 'Làm sắc nét (Unsharp Mask)')
+def _sharpen(image, context):
+    kernel = np.array([[-1, -1, -1],
+                       [-1,  9, -1],
+                       [-1, -1, -1]])
+    return cv2.filter2D(image, -1, kernel)
+
+
+@register_stage('normalize', 'Chuẩn hóa cường độ pixel', kind='lut', adaptive=True)
+def _normalize(image, context):
+    """Chuẩn hóa mean/std toàn ảnh, cắt ±3 std rồi kéo về [0, 255]
+
+    Phép biến đổi đơn điệu theo giá trị pixel nên tương đương một bảng tra tính từ
+    histogram của ảnh (không cần ảnh float32 trung gian).
+    """
+    hist = np.bincount(image.ravel(), minlength=256).astype(np.float64)
+    values = np.arange(256, dtype=np.float64) / 255.0
+    count = hist.sum()
+    mean = (hist * values).sum() / count
+    std = np.sqrt((hist * (values - mean) ** 2).sum() / count)
+
+    normalized = np.clip((values - mean) / (std + 1e-8), -3, 3)
+    present = np.flatnonzero(hist)
+    low, high = normalized[present[0]], normalized[present[-1]]
+    table = ((normalized - low) / (high - low + 1e-8) * 255).astype(np.uint8)
+    return _channel_lut(table, table, table)
+
+
+@register_stage('median', 'Giảm nhiễu (median 3x3)')
+def _median(image, context):
+    return cv2.medianBlur(image, 3)
+
+
+@register_stage('gamma', 'Hiệu chỉnh gamma (0.8)', kind='lut')
+def _gamma(image, context):
+    # Làm tròn xuống như skimage.exposure.adjust_gamma với ảnh uint8
+    table = np.floor(255 * (np.arange(256) / 255) ** 0.8)
+    return _channel_lut(table, table, table)
+
+
+@register_stage('color_boost', 'Tăng bão hòa (x1.2) và độ sáng (x1.1)', space='hsv', kind='lut')
+def _color_boost(image, context):
+    values = np.arange(256)
+    return _channel_lut(None, np.rint(values * 1.2), np.rint(values * 1.1))
+
+
+@register_stage('unsharp', 'Làm sắc nét (Gaussian unsharp mask)')
+def _unsharp(image, context):
+    gaussian = cv2.GaussianBlur(image, (0, 0), 2.0)
+    return cv2.addWeighted(image, 1.5, gaussian, -0.5, 0)
+
+
+@register_stage('white_balance', 'Cân bằng trắng (cắt kênh a, b)', space='lab', kind='lut')
+def _white_balance(image, context):
+    # Cắt a, b về [0, 255] không đổi giá trị uint8: bước đồng nhất, pipeline bỏ qua.
+    # Bản cũ (simple_white_balance) vẫn đi qua BGR -> LAB -> BGR nên sau cả chuỗi
+    # 'enhanced' lệch tối đa 3 mức xám ở khoảng 23,5% pixel ảnh thật (tới ~10 ở
+    # dưới 0,1% pixel có màu bão hòa mạnh), xem tests/test_pipeline.py
+    return None
+
+
+@register_stage('bilateral', 'Giảm nhiễu giữ biên (bilateral)')
+def _bilateral(image, context):
+    return cv2.bilateralFilter(image, 9, 75, 75)
+
+
+# ============================================================================
+# PIPELINE
+# ============================================================================
+
+def _conversion_path(source, target):
+    """Các cặp (nguồn, đích) để đổi từ source sang target (qua BGR nếu cần)"""
+    if source == target:
+        return []
+    if (source, target) in CONVERSIONS:
+        return [(source, target)]
+    if (source, 'bgr') in CONVERSIONS and ('bgr', target) in CONVERSIONS:
+        return [(source, 'bgr'), ('bgr', target)]
+    raise PipelineError(f"Không có chuyển đổi màu {source} -> {target}")
+
+
+class PreprocessingPipeline:
+    """Chuỗi bước tiền xử lý đã biên dịch thành kế hoạch chạy
+
+    Kế hoạch là danh sách nhóm; mỗi nhóm là một bước 'op' hoặc một dãy thao tác
+    theo pixel (chuyển màu, bảng tra) chạy chung một lượt theo dải strip_rows hàng.
+    """
+
+    def __init__(self, stages, strip_rows=None, denoise_tier=None):
+        unknown = [s for s in stages if isinstance(s, str) and s not in STAGES]
+        if unknown:
+            raise PipelineError(f"Bước tiền xử lý không tồn tại: {', '.join(unknown)}")
+        self.stages = [STAGES[s] if isinstance(s, str) else s for s in stages]
+        if strip_rows is None:
+            strip_rows = DEFAULT_SETTINGS['pipeline_strip_rows']
+        self.strip_rows = max(1, int(strip_rows))
+        self.denoise_tier = resolve_denoise_tier(denoise_tier)
+        self.plan = self._compile()
+
+        # Thời gian cộng dồn theo nhóm: tên -> [số lần, tổng ms]
+        self.stats = OrderedDict()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def names(self):
+        return [stage.name for stage in self.stages]
+
+    def _compile(self):
+        """Chèn chuyển đổi màu tối thiểu, bỏ bước đồng nhất, gộp thao tác theo pixel"""
+        steps = []  # ('convert', (nguồn, đích)) | ('lut', stage, bảng hoặc None) | ('op', stage)
+        space, dtype = 'bgr', 'uint8'
+
+        for stage in self.stages:
+            table = None
+            if stage.kind == 'lut' and not stage.adaptive:
+                table = stage.func(None, {})
+                if table is None:
+                    continue  # Bước đồng nhất
+
+            if stage.input_dtype != dtype:
+                raise PipelineError(f"Bước '{stage.name}' cần {stage.input_dtype}, "
+                                    f"nhận {dtype}")
+            if stage.space is not None and stage.space != space:
+                if dtype != 'uint8':
+                    raise PipelineError(f"Chỉ đổi không gian màu trên ảnh uint8 (trước '{stage.name}')")
+                steps.extend(('convert', pair) for pair in _conversion_path(space, stage.space))
+                space = stage.space
+
+            steps.append(('lut', stage, table) if stage.kind == 'lut' else ('op', stage))
+            dtype = stage.output_dtype
+
+        if dtype != 'uint8':
+            raise PipelineError(f"Pipeline phải kết thúc bằng ảnh uint8, nhận {dtype}")
+        steps.extend(('convert', pair) for pair in _conversion_path(space, 'bgr'))
+
+        # Gộp các thao tác theo pixel liền nhau; bảng tra thích nghi chỉ đứng đầu nhóm
+        # (bảng của nó tính từ ảnh đầu vào của nhóm)
+        plan, group = [], []
+        for step in steps:
+            pointwise = step[0] in ('convert', 'lut')
+            starts_group = step[0] == 'lut' and step[1].adaptive
+            if group and (not pointwise or starts_group):
+                plan.append(('fused', group))
+                group = []
+            if pointwise:
+                group.append(step)
+            else:
+                plan.append(step)
+        if group:
+            plan.append(('fused', group))
+        return plan
+
+    @staticmethod
+    def _group_name(group):
+        return '+'.join(f"{s[1][0]}→{s[1][1]}" if s[0] == 'convert' else s[1].name for s in group)
+
+    @property
+    def labels(self):
+        """Tên hiển thị của các bước (bước khử nhiễu kèm mức đang dùng)"""
+        return [f"{stage.label[:stage.label.find(' (')]} ({self.denoise_tier})"
+                if stage.name == 'denoise' else stage.label for stage in self.stages]
+
+    def describe(self):
+        """Kế hoạch chạy dạng chuỗi, vd. ['bgr→lab+enhance_contrast', ...]"""
+        return [self._group_name(step[1]) if step[0] == 'fused' else step[1].name
+                for step in self.plan]
+
+    def _run_fused(self, image, group, context):
+        """Chạy một nhóm thao tác theo pixel trong một lượt theo dải hàng"""
+        ops = []
+        for step in group:
+            if step[0] == 'convert':
+                ops.append(('convert', CONVERSIONS[step[1]]))
+                continue
+            table = step[2] if step[2] is not None else step[1].func(image, context)
+            if table is None:
+                continue
+            if ops and ops[-1][0] == 'lut':
+                ops[-1] = ('lut', _compose_lut(ops[-1][1], table))
+            else:
+                ops.append(('lut', table))
+
+        def apply(block):
+            for kind, value in ops:
+                block = cv2.cvtColor(block, value) if kind == 'convert' else cv2.LUT(block, value)
+            return block
+
+        if not ops:
+            return image
+        if len(ops) == 1:
+            return apply(image)
+
+        output = np.empty_like(image)
+        for start in range(0, image.shape[0], self.strip_rows):
+            output[start:start + self.strip_rows] = apply(image[start:start + self.strip_rows])
+        return output
+
+    def run(self, image, target_size=None, timings=None):
+        """Áp pipeline lên ảnh BGR uint8 (không sửa ảnh đầu vào)
+
+        timings: dict (tùy chọn) nhận thời gian (ms) của từng nhóm trong lượt này.
+        """
+        context = {'target_size': target_size, 'denoise_tier': self.denoise_tier}
+        processed = image
+        for step in self.plan:
+            start = time.perf_counter()
+            if step[0] == 'fused':
+                processed = self._run_fused(processed, step[1], context)
+                name = self._group_name(step[1])
+            else:
+                processed = step[1].func(processed, context)
+                name = step[1].name
+            elapsed = (time.perf_counter() - start) * 1000.0
+
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+            with self._stats_lock:
+                entry = self.stats.setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+
+        return processed.copy() if processed is image else processed
+
+    def report(self, verbose=False):
+        """Thời gian trung bình (ms) của từng nhóm qua các lượt đã chạy
+
+        verbose: in bảng ra console thay vì ghi log INFO.
+        """
+        with self._stats_lock:
+            stats = [(name, count, total) for name, (count, total) in self.stats.items()]
+        averages = {name: total / count for name, count, total in stats}
+        lines = [f"📊 THỜI GIAN TIỀN XỬ LÝ ({' -> '.join(self.describe()) or 'không có bước'}):"]
+        lines.extend(f"   {name:40s}: {total / count:8.2f} ms x {count}" for name, count, total in stats)
+        emit_report(logger, lines, verbose, {'stage_ms': averages})
+        return averages
+
+
+def build_pipeline(stages=None, strip_rows=None, denoise_tier=None):
+    """Dựng pipeline từ danh sách tên bước hoặc tên preset ('default', 'enhanced')"""
+    if stages is None:
+        stages = DEFAULT_SETTINGS['preprocessing_pipeline']
+    if isinstance(stages, str):
+        if stages not in PIPELINE_PRESETS:
+            raise PipelineError(f"Preset tiền xử lý không tồn tại: {stages}")
+        stages = PIPELINE_PRESETS[stages]
+    return PreprocessingPipeline(stages, strip_rows, denoise_tier)
@@ -0,0 +1,84 @@
+"""
+Bộ nhớ đệm kết quả phát hiện của các lần phân tích, để phân loại lại mà không chạy lại YOLO
+"""
+import threading
+from collections import OrderedDict
+
+
+class RunCache:
+    """Lưu box đã lọc và ảnh dùng để cắt đối tượng của các ảnh đã phân tích gần nhất
+
+    Mỗi mục (theo đường dẫn ảnh) giữ box/độ tin cậy/lớp sau khi lọc, bảng tên lớp,
+    cài đặt của lần chạy và kích thước khung hình báo cáo. Chỉ max_entries mục mới
+    nhất giữ thêm tham chiếu tới khung hình và ảnh cắt (không sao chép); các mục cũ
+    hơn bỏ ảnh ('image' = None) để cả một lô lớn vẫn phân loại lại được mà không
+    giữ mọi khung hình trong bộ nhớ. Khi vượt max_box_entries, mục dùng lâu nhất bị bỏ.
+    """
+
+    def __init__(self, max_entries=32, max_box_entries=10000):
+        self.max_entries = max(1, int(max_entries))
+        self.max_box_entries = max(self.max_entries, int(max_box_entries))
+        self._entries = OrderedDict()
+        self._framed = OrderedDict()  # Khóa các mục còn giữ ảnh (cũ -> mới)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image_path):
+        return str(image_path)
+
+    def store(self, image_path, result, settings):
+        """Ghi nhận kết quả của analyze() cho image_path"""
+        entry = {
+            'image': result['original_image'],
+            'boxes': result['boxes'],
+            'scores': result['scores'],
+            'class_ids': result['class_ids'],
+            'names': result['names'],
+            'crop_image': result['crop_image'],
+            'crop_scale': result['crop_scale'],
+            'shape': result['original_image'].shape,
+            'settings': dict(settings)
+        }
+        key = self.key(image_path)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._framed[key] = True
+            self._framed.move_to_end(key)
+            while len(self._framed) > self.max_entries:
+                old, _ = self._framed.popitem(last=False)
+                if old in self._entries:
+                    self._entries[old] = dict(self._entries[old], image=None, crop_image=None)
+            while len(self._entries) > self.max_box_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._framed.pop(old, None)
+
+    def get(self, image_path):
+        """Mục của image_path, None nếu chưa được phân tích (hoặc đã bị bỏ)
+
+        Mục cũ có thể không còn ảnh ('image' là None): cần đọc lại ảnh từ file.
+        """
+        key = self.key(image_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def keys(self):
+        """Đường dẫn các ảnh đang có trong bộ đệm (cũ -> mới)"""
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._framed.clear()
+
+    def __contains__(self, image_path):
+        with self._lock:
+            return self.key(image_path) in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
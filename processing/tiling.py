@@ -0,0 +1,75 @@
+"""
+Suy luận theo ô (tiled/sliced inference) cho ảnh độ phân giải cao
+"""
+import math
+
+import numpy as np
+
+
+def _tile_positions(length, tile, count):
+    """Vị trí bắt đầu của count ô dài tile phủ đều đoạn [0, length)"""
+    if count <= 1 or length <= tile:
+        return [0]
+    return [int(round(p)) for p in np.linspace(0, length - tile, count)]
+
+
+def _tile_count(length, tile, overlap):
+    """Số ô cần để phủ đoạn dài length với độ chồng lấn overlap"""
+    if length <= tile:
+        return 1
+    stride = max(1, int(tile * (1 - overlap)))
+    return math.ceil((length - tile) / stride) + 1
+
+
+def compute_tiles(image_shape, tile_size=640, overlap=0.2, max_tiles=16):
+    """Chia ảnh thành các ô vuông chồng lấn, trả về danh sách (x1, y1, x2, y2)
+
+    Nếu số ô vượt max_tiles thì tăng kích thước ô (ô sẽ bị thu nhỏ về độ phân giải
+    mô hình), đổi độ nhạy với vật nhỏ lấy độ trễ thấp hơn.
+    """
+    h, w = image_shape[:2]
+    overlap = min(max(float(overlap), 0.0), 0.9)
+    max_tiles = max(1, int(max_tiles))
+    size = max(1, int(tile_size))
+
+    while _tile_count(w, size, overlap) * _tile_count(h, size, overlap) > max_tiles:
+        size = int(math.ceil(size * 1.1))
+
+    nx, ny = _tile_count(w, size, overlap), _tile_count(h, size, overlap)
+    tiles = []
+    for y in _tile_positions(h, size, ny):
+        for x in _tile_positions(w, size, nx):
+            tiles.append((x, y, min(x + size, w), min(y + size, h)))
+
+    return tiles
+
+
+def merge_tile_detections(xyxy, conf, cls, iou_threshold=0.5, ios_threshold=0.8):
+    """Gộp box trùng ở vùng chồng lấn giữa các ô (NMS theo lớp)
+
+    Ngoài IoU còn dùng IoS (giao trên diện tích box nhỏ hơn) để loại box bị cắt
+    dở ở mép ô nằm gọn trong box đầy đủ của ô bên cạnh.
+    """
+    if len(xyxy) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    x1, y1, x2, y2 = xyxy[:, 0], xyxy[:, 1], xyxy[:, 2], xyxy[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = conf.argsort()[::-1]
+    keep = []
+
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        inter_w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        inter_h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        ios = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+
+        duplicate = (cls[rest] == cls[i]) & ((iou > iou_threshold) | (ios > ios_threshold))
+        order = rest[~duplicate]
+
+    return np.array(keep, dtype=np.int64)
@@ -0,0 +1,99 @@
+"""
+Dữ liệu tổng hợp dùng chung cho các bài kiểm thử (không cần mô hình hay ảnh thật)
+"""
+import cv2
+import numpy as np
+import pytest
+
+from core.backends import DetectionResult, InferenceBackend, NumpyBoxes
+from core.detection_model import DetectionModel
+
+# Một phần bảng lớp COCO: có lớp trái cây và lớp không phải sản phẩm
+FAKE_NAMES = {0: 'person', 2: 'car', 46: 'banana', 47: 'apple', 49: 'orange', 52: 'tomato'}
+
+
+def synthetic_frame(seed=0, shape=(240, 320)):
+    """Khung hình BGR: nền nhiễu mịn và vài mảng màu trái cây (đỏ, vàng, xanh, cam)"""
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    hsv = np.empty((h, w, 3), dtype=np.uint8)
+    hsv[..., 0] = rng.integers(0, 180, (h, w))
+    hsv[..., 1] = rng.integers(0, 256, (h, w))
+    hsv[..., 2] = rng.integers(0, 256, (h, w))
+    hsv = cv2.GaussianBlur(hsv, (5, 5), 0)
+
+    # Mảng màu có Hue quanh 0 (vòng qua 179), 25, 60 và 15
+    for hue, (x, y) in zip((0, 25, 60, 15), ((40, 30), (180, 40), (60, 140), (200, 150))):
+        patch = hsv[y:y + 70, x:x + 90]
+        jitter = rng.integers(-6, 7, patch.shape[:2])
+        patch[..., 0] = (hue + jitter) % 180
+        patch[..., 1] = rng.integers(120, 256, patch.shape[:2])
+        patch[..., 2] = rng.integers(80, 240, patch.shape[:2])
+
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def synthetic_boxes(seed=0, shape=(240, 320), count=12):
+    """Box nguyên (x1, y1, x2, y2) ngẫu nhiên nằm trong khung hình, có chồng lấn"""
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    x1 = rng.integers(0, w - 20, count)
+    y1 = rng.integers(0, h - 20, count)
+    x2 = np.minimum(w, x1 + rng.integers(8, 140, count))
+    y2 = np.minimum(h, y1 + rng.integers(8, 120, count))
+    return np.stack([x1, y1, x2, y2], axis=1).astype(np.int64)
+
+
+class FakeBackend(InferenceBackend):
+    """Backend giả: box (x1, y1, x2, y2, conf, cls) với tọa độ theo tỷ lệ cạnh ảnh đầu vào
+
+    rows cũng có thể là hàm ảnh -> box theo pixel. Lọc độ tin cậy và lớp như
+    backend thật; calls ghi lại (kích thước ảnh, confidence, classes, imgsz).
+    """
+
+    name = 'fake'
+
+    def __init__(self, rows, names=None):
+        super().__init__()
+        self.rows = rows
+        self.names = dict(names or FAKE_NAMES)
+        self.calls = []
+
+    def predict(self, images, confidence=0.5, classes=None, imgsz=None):
+        results = []
+        for image in images:
+            self.calls.append((image.shape[:2], confidence, classes, imgsz))
+            h, w = image.shape[:2]
+            if callable(self.rows):
+                data = np.asarray(self.rows(image), dtype=np.float32).reshape(-1, 6)
+            else:
+                data = np.array(self.rows, dtype=np.float32).reshape(-1, 6)
+                data[:, [0, 2]] *= w
+                data[:, [1, 3]] *= h
+            keep = data[:, 4] > confidence
+            if classes is not None:
+                keep &= np.isin(data[:, 5], classes)
+            results.append(DetectionResult(NumpyBoxes(data[keep]), self.names, (h, w)))
+        return results
+
+    def is_loaded(self):
+        return True
+
+
+def fake_detection_model(rows, names=None):
+    """DetectionModel đã sẵn sàng, chạy trên FakeBackend"""
+    model = DetectionModel()
+    model.backend = FakeBackend(rows, names)
+    model.class_names = model.backend.names
+    model.state = 'ready'
+    return model
+
+
+@pytest.fixture
+def frame():
+    return synthetic_frame()
+
+
+@pytest.fixture
+def boxes():
+    return synthetic_boxes()
@@ -0,0 +1,153 @@
+"""
+Letterbox, NMS và giải mã đầu ra của backend ONNX Runtime so với cài đặt tham chiếu
+"""
+import cv2
+import numpy as np
+import pytest
+
+from core.backends import OnnxRuntimeBackend, batched_nms, letterbox, nms, scale_boxes
+from tests.conftest import synthetic_frame
+
+
+def reference_letterbox(image, new_shape, color=(114, 114, 114)):
+    """Letterbox kiểu ultralytics (LetterBox, auto=False): resize rồi cv2.copyMakeBorder"""
+    h0, w0 = image.shape[:2]
+    gain = min(new_shape[0] / h0, new_shape[1] / w0)
+    resized_w, resized_h = int(round(w0 * gain)), int(round(h0 * gain))
+    dw, dh = (new_shape[1] - resized_w) / 2, (new_shape[0] - resized_h) / 2
+    if (resized_w, resized_h) != (w0, h0):
+        interpolation = cv2.INTER_AREA if gain < 1.0 else cv2.INTER_LINEAR
+        image = cv2.resize(image, (resized_w, resized_h), interpolation=interpolation)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, gain, (left, top)
+
+
+def iou(a, b):
+    inter_w = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    inter_h = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = inter_w * inter_h
+    area_a = max(0.0, a[2] - a[0]) * max(0.0, a[3] - a[1])
+    area_b = max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+    return inter / (area_a + area_b - inter + 1e-9)
+
+
+def reference_nms(boxes, scores, iou_threshold, class_ids=None):
+    """NMS tham lam viết bằng vòng lặp Python (theo lớp nếu có class_ids)"""
+    keep = []
+    for i in sorted(range(len(boxes)), key=lambda k: -scores[k]):
+        if all(iou(boxes[i], boxes[k]) <= iou_threshold
+               for k in keep if class_ids is None or class_ids[k] == class_ids[i]):
+            keep.append(i)
+    return keep
+
+
+def random_boxes(seed, count=60, extent=400):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, extent, (count, 2))
+    wh = rng.uniform(5, 120, (count, 2))
+    boxes = np.concatenate([xy, xy + wh], axis=1).astype(np.float32)
+    scores = rng.permutation(count).astype(np.float32) / count
+    return boxes, scores, rng.integers(0, 3, count)
+
+
+@pytest.mark.parametrize('shape', [(240, 320), (320, 240), (480, 1280), (100, 100), (640, 640)])
+@pytest.mark.parametrize('new_shape', [(640, 640), (320, 480)])
+def test_letterbox_matches_reference(shape, new_shape):
+    image = synthetic_frame(1, shape)
+    expected, expected_gain, expected_pad = reference_letterbox(image, new_shape)
+    out, gain, pad = letterbox(image, new_shape)
+    assert out.shape == (*new_shape, 3)
+    assert gain == pytest.approx(expected_gain)
+    assert pad == expected_pad
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_letterbox_writes_into_given_buffer():
+    image = synthetic_frame(2)
+    buffer = np.zeros((640, 640, 3), dtype=np.uint8)
+    out, _, _ = letterbox(image, (640, 640), out=buffer)
+    assert out is buffer
+    np.testing.assert_array_equal(buffer, reference_letterbox(image, (640, 640))[0])
+
+
+def test_scale_boxes_inverts_letterbox_and_clips():
+    orig_shape = (240, 320)
+    _, gain, pad = letterbox(synthetic_frame(0, orig_shape), (640, 640))
+    boxes = np.array([[10, 20, 100, 200], [0, 0, 320, 240]], dtype=np.float32)
+    letterboxed = boxes * gain
+    letterboxed[:, [0, 2]] += pad[0]
+    letterboxed[:, [1, 3]] += pad[1]
+    np.testing.assert_allclose(scale_boxes(letterboxed, gain, pad, orig_shape), boxes, atol=1e-4)
+
+    outside = np.array([[pad[0] - 30, pad[1] - 30, 700, 700]], dtype=np.float32)
+    np.testing.assert_allclose(scale_boxes(outside, gain, pad, orig_shape), [[0, 0, 320, 240]])
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('iou_threshold', [0.3, 0.5, 0.7])
+def test_nms_matches_reference(seed, iou_threshold):
+    boxes, scores, _ = random_boxes(seed)
+    assert nms(boxes, scores, iou_threshold).tolist() == reference_nms(boxes, scores, iou_threshold)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batched_nms_matches_per_class_reference(seed):
+    boxes, scores, class_ids = random_boxes(seed)
+    keep = batched_nms(boxes, scores, class_ids, 0.5)
+    assert keep.tolist() == reference_nms(boxes, scores, 0.5, class_ids)
+
+
+def test_nms_empty():
+    empty = np.empty((0, 4), dtype=np.float32)
+    assert nms(empty, np.empty(0)).size == 0
+    assert batched_nms(empty, np.empty(0), np.empty(0)).size == 0
+
+
+def reference_postprocess(prediction, confidence, iou_threshold, gain, pad, orig_shape, classes=None):
+    """Giải mã từng anchor bằng Python: chọn lớp điểm cao nhất trong classes, lọc, NMS theo lớp"""
+    candidates = classes if classes is not None else range(prediction.shape[0] - 4)
+    boxes, scores, class_ids = [], [], []
+    for cx, cy, w, h, *class_scores in prediction.T.tolist():
+        best = max(candidates, key=lambda c: class_scores[c])
+        if class_scores[best] > confidence:
+            boxes.append([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+            scores.append(class_scores[best])
+            class_ids.append(best)
+    keep = reference_nms(boxes, scores, iou_threshold, class_ids)
+    boxes = scale_boxes(np.array([boxes[i] for i in keep]).reshape(-1, 4), gain, pad, orig_shape)
+    return boxes, [scores[i] for i in keep], [class_ids[i] for i in keep]
+
+
+def fake_prediction(seed, num_classes=5, anchors=300):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 640, (2, anchors))
+    sizes = rng.uniform(10, 150, (2, anchors))
+    scores = rng.uniform(0, 1, (num_classes, anchors)) ** 3
+    return np.concatenate([centers, sizes, scores]).astype(np.float32)
+
+
+@pytest.mark.parametrize('classes', [None, [1, 3], [0, 1, 2, 3, 4], [2]])
+def test_postprocess_matches_reference(classes):
+    backend = OnnxRuntimeBackend()
+    backend.names = {i: str(i) for i in range(5)}
+    orig_shape = (480, 640)
+    gain, pad = 1.0, (0, 80)
+    prediction = fake_prediction(3)
+
+    result = backend._postprocess(prediction, 0.4, gain, pad, orig_shape, classes)
+    boxes, scores, class_ids = reference_postprocess(prediction, 0.4, backend.iou_threshold,
+                                                     gain, pad, orig_shape, classes)
+
+    assert result.orig_shape == orig_shape
+    np.testing.assert_allclose(result.boxes.xyxy, boxes, atol=1e-3)
+    np.testing.assert_allclose(result.boxes.conf, scores, rtol=1e-6)
+    assert result.boxes.cls.astype(int).tolist() == class_ids
+
+
+def test_postprocess_empty_classes_and_max_det():
+    backend = OnnxRuntimeBackend(max_det=4)
+    prediction = fake_prediction(4)
+    assert len(backend._postprocess(prediction, 0.1, 1.0, (0, 0), (640, 640), []).boxes) == 0
+    assert len(backend._postprocess(prediction, 0.1, 1.0, (0, 0), (640, 640)).boxes) == 4
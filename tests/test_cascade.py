@@ -0,0 +1,141 @@
+"""
+Cascade: vùng cần chạy lại (nới rộng, gộp, vùng màu chưa có box) và analyze_cascade
+"""
+import numpy as np
+import pytest
+
+from core.classification import FruitClassifier
+from core.config import CLASSIFICATION_RULES
+from processing.cascade import (
+    FRUIT_COLOR_QUALITIES,
+    boxes_in_regions,
+    expand_boxes,
+    find_color_regions,
+    fruit_color_ranges,
+    merge_regions
+)
+from processing.image_processor import ImageProcessor
+from tests.conftest import fake_detection_model
+
+RED = (0, 0, 255)  # HSV (0, 255, 255): màu 'chin' của táo
+
+
+def test_expand_boxes_margin_min_size_and_clip():
+    boxes = expand_boxes([[100, 100, 140, 120], [0, 0, 10, 10]], 0.5, (200, 300), min_size=30)
+    # Cạnh 40 x 20 -> 80 x 40 quanh tâm (120, 110)
+    assert boxes[0].tolist() == [80, 90, 160, 130]
+    # Cạnh tối thiểu 30 quanh tâm (5, 5), cắt ở mép ảnh
+    assert boxes[1].tolist() == [0, 0, 20, 20]
+    assert expand_boxes([], 0.5, (200, 300)).shape == (0, 4)
+
+
+def test_merge_regions_unions_overlaps_and_limits_count():
+    regions = np.array([
+        [0, 0, 50, 50], [40, 40, 100, 100],        # giao nhau -> một vùng bao
+        [200, 200, 210, 210],                        # nhỏ nhất
+        [120, 0, 180, 60], [170, 50, 190, 70],       # giao nhau dây chuyền
+        [300, 300, 300, 320]                         # rỗng, bị bỏ
+    ])
+    merged = merge_regions(regions, max_regions=2)
+    assert merged.tolist() == [[0, 0, 100, 100], [120, 0, 190, 70]]
+    assert merge_regions(regions, max_regions=6).shape == (3, 4)
+
+
+def test_touching_regions_are_not_merged():
+    merged = merge_regions([[0, 0, 10, 10], [10, 0, 20, 10]])
+    assert len(merged) == 2
+
+
+def test_boxes_in_regions_by_center():
+    inside = boxes_in_regions([[0, 0, 10, 10], [95, 95, 120, 120]], [[0, 0, 100, 100]])
+    assert inside[:, 0].tolist() == [True, False]
+
+
+def test_fruit_color_ranges_keep_fruit_qualities_once():
+    products = ['apple', 'banana']
+    ranges = fruit_color_ranges(CLASSIFICATION_RULES, products)
+    expected = {(tuple(lower), tuple(upper)) for product in products
+                for quality in FRUIT_COLOR_QUALITIES
+                for lower, upper in CLASSIFICATION_RULES[product]['color_ranges'].get(quality, [])}
+    assert len(ranges) == len(set(ranges))
+    assert set(ranges) == expected
+    assert fruit_color_ranges(CLASSIFICATION_RULES, ['unknown']) == []
+
+
+def test_find_color_regions_skips_covered_tiny_and_background_blobs():
+    image = np.full((480, 640, 3), 128, dtype=np.uint8)
+    image[40:120, 40:160] = RED     # đã có box của tầng 1
+    image[200:280, 320:400] = RED   # chưa có box
+    image[400:404, 600:604] = RED   # quá nhỏ
+    ranges = fruit_color_ranges(CLASSIFICATION_RULES, ['apple'])
+
+    regions = find_color_regions(image, [[36, 36, 164, 124]], ranges)
+    assert regions.shape == (1, 4)
+    assert np.abs(regions[0] - [320, 200, 400, 280]).max() <= 4
+
+    background = np.full((480, 640, 3), RED, dtype=np.uint8)
+    assert len(find_color_regions(background, [], ranges)) == 0
+    assert len(find_color_regions(image, [], [])) == 0
+
+
+def cascade_processor(image_width, first_conf):
+    """Mô hình giả: box của hình vuông đỏ, độ tin cậy first_conf trên cả khung hình, 0.85 trên vùng cắt"""
+    def detect(image):
+        ys, xs = np.nonzero(np.all(image == RED, axis=2))
+        if not len(xs):
+            return []
+        conf = first_conf if image.shape[1] == image_width else 0.85
+        return [(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, conf, 47)]
+    return ImageProcessor(fake_detection_model(detect), FruitClassifier())
+
+
+def cascade_frame():
+    image = np.full((480, 640, 3), 128, dtype=np.uint8)
+    image[200:260, 300:380] = RED
+    return image
+
+
+SETTINGS = {'enable_preprocessing': False, 'cascade': True, 'product_type': 'apple'}
+
+
+def test_confident_first_pass_is_not_escalated():
+    processor = cascade_processor(640, 0.9)
+    result = processor.analyze(None, cascade_frame(), SETTINGS)
+
+    (shape, confidence, _, imgsz), = processor.model.backend.calls
+    assert shape == (480, 640) and imgsz == 320
+    assert confidence == 0.25  # đáy của cascade_band
+    assert result['cascade']['escalated'] is False
+    assert result['boxes'].tolist() == [[300, 200, 380, 260]]
+    assert result['scores'] == pytest.approx([0.9])
+
+
+def test_uncertain_box_is_replaced_by_second_pass():
+    processor = cascade_processor(640, 0.4)
+    result = processor.analyze(None, cascade_frame(), SETTINGS)
+
+    calls = processor.model.backend.calls
+    assert len(calls) == 2
+    assert calls[1][3] is None  # tầng 2 ở kích thước của mô hình
+    (x1, y1, x2, y2), = result['cascade']['regions']
+    assert calls[1][0] == (y2 - y1, x2 - x1)
+    assert x1 <= 300 and y1 <= 200 and x2 >= 380 and y2 >= 260
+    assert result['cascade']['uncertain'] == 1
+    assert result['boxes'].tolist() == [[300, 200, 380, 260]]
+    assert result['scores'] == pytest.approx([0.85])
+
+
+def test_missed_fruit_colour_region_is_escalated():
+    image = cascade_frame()
+    processor = cascade_processor(640, 0.1)  # tầng 1 bỏ sót (dưới đáy cascade_band)
+    result = processor.analyze(None, image, SETTINGS)
+
+    assert result['cascade']['uncertain'] == 0
+    assert result['cascade']['color_regions'] == 1
+    assert result['boxes'].tolist() == [[300, 200, 380, 260]]
+    assert result['scores'] == pytest.approx([0.85])
+
+    processor = cascade_processor(640, 0.1)
+    result = processor.analyze(None, image, dict(SETTINGS, cascade_color_regions=False))
+    assert result['cascade']['escalated'] is False
+    assert len(result['boxes']) == 0
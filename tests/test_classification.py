@@ -0,0 +1,179 @@
+"""
+Phân loại theo khung hình (classify_objects) phải khớp phân tích từng ảnh cắt (analyze_object)
+"""
+import numpy as np
+import pytest
+
+from core.classification import FruitClassifier
+from core.config import CLASSIFICATION_RULES
+from core.features import CropFeatures, hoeffding_bound, hoeffding_sample_size
+from tests.conftest import synthetic_frame
+
+
+@pytest.fixture
+def classifier():
+    classifier = FruitClassifier()
+    classifier.sampling = False
+    classifier.coarse_to_fine = False
+    return classifier
+
+
+def class_names_for(boxes):
+    products = list(CLASSIFICATION_RULES)
+    return [products[i % len(products)] for i in range(len(boxes))]
+
+
+def test_crop_features_match_analyze_object(classifier, frame, boxes):
+    for (x1, y1, x2, y2), class_name in zip(boxes.tolist(), class_names_for(boxes)):
+        crop = frame[y1:y2, x1:x2]
+        expected = classifier.analyze_object(crop, class_name, (x1, y1, x2, y2))
+        features = classifier.crop_features(crop)
+        assert classifier.analyze_features(features, class_name, (x1, y1, x2, y2)) == expected
+
+
+@pytest.mark.parametrize('frame_features', [False, True])
+@pytest.mark.parametrize('color_conversion', ['union', 'frame', 'crop'])
+def test_classify_objects_matches_analyze_object(classifier, frame, boxes, frame_features,
+                                                 color_conversion):
+    class_names = class_names_for(boxes)
+    result = classifier.classify_objects(frame, boxes, class_names, frame_features=frame_features,
+                                         color_conversion=color_conversion, use_quality_model=False)
+
+    for i, ((x1, y1, x2, y2), class_name) in enumerate(zip(boxes.tolist(), class_names)):
+        expected = classifier.analyze_object(frame[y1:y2, x1:x2], class_name, (x1, y1, x2, y2))
+        assert result['class'][i] == class_name
+        assert result['quality'][i] == expected['quality']
+        assert result['quality_score'][i] == pytest.approx(expected['quality_score'])
+    assert not result['ratio_error'].any()
+    assert not result['from_model'].any()
+
+
+def test_classify_objects_uses_class_id_names(classifier, frame, boxes):
+    names = {i: name for i, name in enumerate(CLASSIFICATION_RULES)}
+    class_ids = np.arange(len(boxes)) % len(names)
+    by_id = classifier.classify_objects(frame, boxes, class_ids, names, use_quality_model=False)
+    by_name = classifier.classify_objects(frame, boxes, [names[i] for i in class_ids],
+                                          use_quality_model=False)
+    assert list(by_id['quality']) == list(by_name['quality'])
+
+
+
+def test_classify_objects_without_quality_keeps_scores(classifier, frame, boxes):
+    class_names = class_names_for(boxes)
+    full = classifier.classify_objects(frame, boxes, class_names, use_quality_model=False)
+    result = classifier.classify_objects(frame, boxes, class_names, enable_quality=False,
+                                         use_quality_model=False)
+    assert set(result['quality']) == {'unknown'}
+    assert result['quality_score'] == pytest.approx(full['quality_score'])
+
+
+def test_classify_objects_batch_matches_single_frames(classifier, boxes):
+    frames = [synthetic_frame(seed) for seed in range(3)]
+    boxes_list = [boxes, boxes[:4], boxes[:0]]
+    class_ids_list = [class_names_for(b) for b in boxes_list]
+    batch = classifier.classify_objects_batch(frames, boxes_list, class_ids_list, use_quality_model=False)
+    for frame, b, class_ids, result in zip(frames, boxes_list, class_ids_list, batch):
+        expected = classifier.classify_objects(frame, b, class_ids, use_quality_model=False)
+        assert list(result['quality']) == list(expected['quality'])
+        assert result['quality_score'] == pytest.approx(expected['quality_score'])
+    assert len(batch[2]['quality']) == 0
+
+
+def test_sampling_applies_with_auto_frame_features(classifier):
+    # Ảnh cắt lớn một màu: lấy mẫu có lợi nên sai số tỷ lệ được báo (> 0)
+    frame = np.full((1200, 1200, 3), (30, 30, 180), dtype=np.uint8)
+    boxes = np.array([[0, 0, 1200, 1200], [0, 0, 1190, 1190], [10, 10, 1200, 1200]])
+    result = classifier.classify_objects(frame, boxes, ['apple'] * 3, frame_features='auto',
+                                         sampling=True, use_quality_model=False)
+    assert (result['ratio_error'] > 0).all()
+
+
+def test_reduced_modes_are_ignored_with_frame_features(classifier, frame, boxes, caplog):
+    class_names = class_names_for(boxes)
+    exact = classifier.classify_objects(frame, boxes, class_names, frame_features=True,
+                                        use_quality_model=False)
+    for option in ({'sampling': True}, {'coarse_to_fine': True}):
+        result = classifier.classify_objects(frame, boxes, class_names, frame_features=True,
+                                             use_quality_model=False, **option)
+        assert list(result['quality']) == list(exact['quality'])
+        assert not result['ratio_error'].any()
+    assert 'bỏ qua quality_sampling/coarse_to_fine' in caplog.text
+
+
+@pytest.mark.parametrize('tolerance, confidence, hypotheses, value_range', [
+    (0.01, 0.95, 1, 1.0), (0.02, 0.99, 4, 2.0), (0.05, 0.9, 3, 1.0)])
+def test_hoeffding_sample_size_meets_tolerance(tolerance, confidence, hypotheses, value_range):
+    samples = hoeffding_sample_size(tolerance, confidence, hypotheses, value_range)
+    assert hoeffding_bound(samples, confidence, hypotheses, value_range) <= tolerance
+    assert hoeffding_bound(samples - 1, confidence, hypotheses, value_range) > tolerance
+    assert hoeffding_bound(0, confidence) == 1.0
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_sampled_ratios_stay_within_error_bound(classifier, seed):
+    image = synthetic_frame(seed, (900, 1200))
+    for class_name in CLASSIFICATION_RULES:
+        features = classifier.crop_features(image)
+        quality, info = classifier.classify_quality_sampled(features, class_name)
+        assert quality == classifier.classify_quality_features(CropFeatures(image, classifier.rule_tables),
+                                                               class_name)
+        assert info['total_pixels'] == image.shape[0] * image.shape[1]
+        if info['full_scan']:
+            assert info['error_bound'] == 0.0
+            continue
+
+        assert info['sampled_pixels'] < info['total_pixels']
+        table = classifier.rule_tables[class_name]
+        target = hoeffding_sample_size(classifier.sampling_tolerance, classifier.sampling_confidence,
+                                       len(table.qualities),
+                                       max(table.quality_multiplicity.max(), 1))
+        sampled = table.quality_ratios(features.sample_hsv(target))
+        exact = features.quality_ratios(class_name)
+        for q in exact:
+            assert abs(sampled[q] - exact[q]) <= info['error_bound']
+
+
+def test_small_crops_are_scanned_fully(classifier, frame):
+    features = classifier.crop_features(frame[:40, :40])
+    quality, info = classifier.classify_quality_sampled(features, 'apple')
+    assert info == {'sampled_pixels': 1600, 'total_pixels': 1600, 'error_bound': 0.0, 'full_scan': True}
+    assert quality == classifier.classify_quality_features(features, 'apple')
+
+
+def test_coarse_pass_decides_clear_crops_without_escalating(classifier):
+    # Ảnh cắt một màu: tỷ lệ thô bằng tỷ lệ đầy đủ, quyết định rõ ràng
+    crop = np.full((300, 400, 3), (30, 30, 180), dtype=np.uint8)
+    features = classifier.crop_features(crop)
+    quality, escalated = classifier.classify_quality_coarse(features, 'apple')
+    assert not escalated
+    assert quality == classifier.classify_quality_features(features, 'apple')
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_ambiguous_coarse_pass_escalates_to_full_scan(classifier, seed):
+    image = synthetic_frame(seed, (480, 640))
+    for class_name in CLASSIFICATION_RULES:
+        features = classifier.crop_features(image)
+        quality, escalated = classifier.classify_quality_coarse(features, class_name, margin=1.0)
+        assert escalated
+        assert quality == classifier.classify_quality_features(features, class_name)
+
+
+def test_small_crops_skip_coarse_pass(classifier, frame):
+    features = classifier.crop_features(frame[:classifier.coarse_size, :classifier.coarse_size])
+    assert features.coarse_hsv(classifier.coarse_size) is None
+    quality, escalated = classifier.classify_quality_coarse(features, 'apple')
+    assert not escalated
+    assert quality == classifier.classify_quality_features(features, 'apple')
+
+
+def test_classify_objects_reports_escalated_crops(classifier, frame, boxes):
+    class_names = class_names_for(boxes)
+    classifier.coarse_margin = 1.0
+    result = classifier.classify_objects(frame, boxes, class_names, coarse_to_fine=True,
+                                         use_quality_model=False)
+    exact = classifier.classify_objects(frame, boxes, class_names, frame_features=False,
+                                        use_quality_model=False)
+    large = [max(x2 - x1, y2 - y1) > classifier.coarse_size for x1, y1, x2, y2 in boxes.tolist()]
+    assert result['escalated'].tolist() == large
+    assert list(result['quality']) == list(exact['quality'])
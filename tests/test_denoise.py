@@ -0,0 +1,115 @@
+"""
+Các mức khử nhiễu: chọn mức ('auto' theo kết quả đo), đổi mức trên ImageProcessor và denoise_tier_benchmark
+"""
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from core.classification import FruitClassifier
+from core.evaluation import denoise_tier_benchmark
+from processing import pipeline as pipeline_module
+from processing.image_processor import ImageProcessor
+from processing.pipeline import DENOISE_TIERS, PipelineError, denoise, resolve_denoise_tier
+from tests.conftest import fake_detection_model, synthetic_frame
+
+ROWS = [
+    (0.05, 0.05, 0.40, 0.45, 0.90, 47),
+    (0.50, 0.40, 0.90, 0.90, 0.80, 49),
+]
+
+
+@pytest.fixture
+def profile_path(tmp_path, monkeypatch):
+    """Kết quả đo khử nhiễu trong thư mục tạm (chưa có file)"""
+    path = tmp_path / 'denoise_profile.json'
+    monkeypatch.setattr(pipeline_module, 'DENOISE_PROFILE_PATH', path)
+    return path
+
+
+def make_processor():
+    return ImageProcessor(fake_detection_model(ROWS), FruitClassifier())
+
+
+def test_resolve_explicit_and_auto_tiers(profile_path):
+    for tier in DENOISE_TIERS:
+        assert resolve_denoise_tier(tier) == tier
+    assert resolve_denoise_tier('auto') == 'nlm'
+
+    profile_path.write_text(json.dumps({'selected': 'median'}), encoding='utf-8')
+    assert resolve_denoise_tier('auto') == 'median'
+
+    profile_path.write_text('{hỏng', encoding='utf-8')
+    assert resolve_denoise_tier('auto') == 'nlm'
+
+    with pytest.raises(PipelineError):
+        resolve_denoise_tier('gaussian')
+
+
+@pytest.mark.parametrize('tier', DENOISE_TIERS)
+@pytest.mark.parametrize('shape', [(240, 320), (9, 13)])
+def test_denoise_keeps_shape_and_dtype(tier, shape):
+    image = synthetic_frame(0, shape)
+    result = denoise(image, tier)
+    assert result.shape == image.shape
+    assert result.dtype == np.uint8
+    if tier == 'none':
+        assert result is image
+
+
+def test_nlm_downsampled_stays_close_to_full_nlm():
+    image = synthetic_frame(1)
+    noisy = np.clip(image + np.random.default_rng(1).normal(0, 8, image.shape), 0, 255).astype(np.uint8)
+    full = denoise(noisy, 'nlm').astype(int)
+    error = {tier: np.abs(denoise(noisy, tier).astype(int) - full).mean()
+             for tier in ('none', 'nlm_downsampled')}
+    assert error['nlm_downsampled'] < error['none']
+
+
+def test_set_denoise_tier_keeps_steps(profile_path):
+    processor = make_processor()
+    processor.set_pipeline(['resize', 'denoise', 'gamma'])
+    processor.set_denoise_tier('median')
+    assert processor.pipeline.names == ['resize', 'denoise', 'gamma']
+    assert processor.pipeline.denoise_tier == 'median'
+
+    processor.set_preprocessing_config(denoise=False, denoise_tier='bilateral')
+    assert processor.pipeline.names == ['resize', 'gamma']
+    assert processor.pipeline.denoise_tier == 'bilateral'
+
+
+def test_analyze_without_cache_leaves_run_cache_empty(profile_path):
+    processor = make_processor()
+    image = synthetic_frame(2)
+    processor.analyze('a.jpg', image, {'enable_preprocessing': False}, cache=False)
+    assert len(processor.run_cache) == 0
+    processor.analyze('a.jpg', image, {'enable_preprocessing': False})
+    assert len(processor.run_cache) == 1
+
+
+def test_benchmark_selects_fastest_matching_tier(tmp_path, profile_path):
+    paths = []
+    for seed in range(2):
+        path = tmp_path / f'frame{seed}.png'
+        cv2.imwrite(str(path), synthetic_frame(seed))
+        paths.append(path)
+    processor = make_processor()
+    previous = processor.pipeline
+
+    profile = denoise_tier_benchmark(processor, paths, tiers=['none', 'median'],
+                                     tolerance=1.0, save_path=profile_path)
+
+    assert [report['tier'] for report in profile['tiers']] == ['nlm', 'none', 'median']
+    fastest = min(profile['tiers'], key=lambda report: report['denoise_ms'])
+    assert profile['selected'] == fastest['tier']
+    assert profile['tiers'][0]['detection_agreement'] == 1.0
+    assert profile['images'] == 2
+    assert processor.pipeline is previous
+    assert len(processor.run_cache) == 0
+    assert resolve_denoise_tier('auto') == profile['selected']
+
+
+def test_benchmark_without_readable_images(tmp_path):
+    with pytest.raises(ValueError):
+        denoise_tier_benchmark(make_processor(), [tmp_path / 'missing.png'], save_path=None)
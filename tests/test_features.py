@@ -0,0 +1,90 @@
+"""
+Đặc trưng theo box từ bảng tích lũy của khung hình phải khớp tính trực tiếp trên ảnh cắt
+"""
+import cv2
+import numpy as np
+import pytest
+
+from core.config import CLASSIFICATION_RULES
+from core.features import CropFeatures, FrameFeatures, convert_region, should_use_frame_features
+from core.hsv_lut import compile_rules
+
+
+def test_frame_features_match_crop_features(frame, boxes):
+    tables = compile_rules(CLASSIFICATION_RULES)
+    products = list(CLASSIFICATION_RULES)
+    class_names = [products[i % len(products)] for i in range(len(boxes))]
+
+    box_features = FrameFeatures(frame, tables).boxes(boxes, class_names)
+
+    for (x1, y1, x2, y2), class_name, features in zip(boxes.tolist(), class_names, box_features):
+        crop = CropFeatures(frame[y1:y2, x1:x2], tables)
+        assert features.size == crop.size
+        assert features.gray_mean == pytest.approx(crop.gray_mean, abs=1e-9)
+        assert features.gray_std == pytest.approx(crop.gray_std, abs=1e-6)
+        assert features.saturation_mean == pytest.approx(crop.saturation_mean, abs=1e-9)
+        assert features.hue_mean == pytest.approx(crop.hue_mean, abs=1e-9)
+        assert features.fallback_hue_mean == pytest.approx(crop.fallback_hue_mean, abs=1e-9)
+        assert features.quality_ratios(class_name) == pytest.approx(crop.quality_ratios(class_name))
+
+
+def test_frame_features_clip_boxes_outside_frame(frame):
+    tables = compile_rules(CLASSIFICATION_RULES)
+    h, w = frame.shape[:2]
+    features = FrameFeatures(frame, tables).boxes(np.array([[-10, -10, 20, 30], [w - 5, 0, w + 40, h + 9]]))
+    assert [f.size for f in features] == [20 * 30, 5 * h]
+
+
+def test_box_sums_match_direct_sums(frame, boxes):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    table = cv2.integral(gray, sdepth=cv2.CV_64F)
+    expected = [gray[y1:y2, x1:x2].sum() for x1, y1, x2, y2 in boxes.tolist()]
+    assert FrameFeatures.box_sums(table, boxes).tolist() == expected
+
+
+def test_empty_box_and_class_without_rules(frame):
+    tables = compile_rules(CLASSIFICATION_RULES)
+    h, w = frame.shape[:2]
+    empty, outside, other = FrameFeatures(frame, tables).boxes(
+        np.array([[50, 50, 50, 80], [w + 5, 0, w + 20, 10], [0, 0, 10, 10]]),
+        ['apple', 'apple', 'person'])
+    assert empty.size == outside.size == 0
+    assert empty.gray_mean == 0.0
+    assert list(empty.quality_counts) == [0] * len(tables['apple'].qualities)
+    with pytest.raises(KeyError):
+        other.quality_ratios('person')
+
+
+@pytest.mark.parametrize('mode, boxes, expected', [
+    (True, [], True),
+    (False, [[0, 0, 100, 100]] * 10, False),
+    ('auto', [], False),
+    ('auto', [[0, 0, 100, 100]], False),
+    ('auto', [[0, 0, 100, 100]] * 2, True),
+])
+def test_should_use_frame_features(mode, boxes, expected):
+    assert should_use_frame_features(mode, (100, 100), boxes, area_ratio=1.5) == expected
+
+
+@pytest.mark.parametrize('mode', ['union', 'frame'])
+def test_convert_region_views_match_per_crop_conversion(frame, boxes, mode):
+    hsv, gray, (x0, y0) = convert_region(frame, boxes, mode)
+    if mode == 'frame':
+        assert (x0, y0) == (0, 0) and hsv.shape[:2] == frame.shape[:2]
+    else:
+        assert (x0, y0) == (boxes[:, 0].min(), boxes[:, 1].min())
+        assert hsv.shape[:2] == (boxes[:, 3].max() - y0, boxes[:, 2].max() - x0)
+
+    for x1, y1, x2, y2 in boxes.tolist():
+        view = hsv[y1 - y0:y2 - y0, x1 - x0:x2 - x0]
+        assert np.shares_memory(view, hsv)
+        crop = frame[y1:y2, x1:x2]
+        np.testing.assert_array_equal(view, cv2.cvtColor(crop, cv2.COLOR_BGR2HSV))
+        np.testing.assert_array_equal(gray[y1 - y0:y2 - y0, x1 - x0:x2 - x0],
+                                      cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY))
+
+
+def test_convert_region_skips_crop_mode_and_empty_input(frame, boxes):
+    assert convert_region(frame, boxes, 'crop') is None
+    assert convert_region(frame, boxes[:0], 'union') is None
+    assert convert_region(frame, np.array([[10, 10, 10, 40]]), 'union') is None
@@ -0,0 +1,49 @@
+"""
+Bảng tra HSV phải cho đúng kết quả của cách tính cũ bằng cv2.inRange
+"""
+import cv2
+import numpy as np
+import pytest
+
+from core.config import CLASSIFICATION_RULES
+from core.hsv_lut import HSVRuleTable
+
+
+def inrange_ratios(hsv, color_ranges):
+    """Cách cũ: một cv2.inRange cho mỗi khoảng màu, cộng tỷ lệ theo chất lượng"""
+    total = hsv.shape[0] * hsv.shape[1]
+    ratios = {}
+    for quality, ranges_list in color_ranges.items():
+        ratios[quality] = 0
+        for lower, upper in ranges_list:
+            mask = cv2.inRange(hsv, np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+            ratios[quality] += np.sum(mask > 0) / total
+    return ratios
+
+
+@pytest.mark.parametrize('product', list(CLASSIFICATION_RULES))
+def test_lut_ratios_match_inrange(frame, boxes, product):
+    color_ranges = CLASSIFICATION_RULES[product]['color_ranges']
+    table = HSVRuleTable(color_ranges)
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+
+    for x1, y1, x2, y2 in [(0, 0, frame.shape[1], frame.shape[0])] + boxes.tolist():
+        crop = np.ascontiguousarray(hsv[y1:y2, x1:x2])
+        expected = inrange_ratios(crop, color_ranges)
+        actual = table.quality_ratios(crop)
+        assert list(actual) == list(expected)
+        for quality in expected:
+            assert actual[quality] == pytest.approx(expected[quality], abs=1e-12)
+
+
+def test_lut_counts_overlapping_ranges_twice():
+    # Hai khoảng cùng chất lượng chồng nhau: pixel trong vùng giao được đếm hai lần như inRange
+    color_ranges = {'a': [[[0, 0, 0], [20, 255, 255]], [[10, 0, 0], [30, 255, 255]]],
+                    'b': [[[25, 0, 0], [40, 255, 255]]]}
+    hsv = np.zeros((1, 4, 3), dtype=np.uint8)
+    hsv[0, :, 0] = [5, 15, 27, 50]
+    ratios = HSVRuleTable(color_ranges).quality_ratios(hsv)
+    assert ratios == pytest.approx(inrange_ratios(hsv, color_ranges))
+    assert ratios['a'] == pytest.approx(4 / 4)
+    assert ratios['b'] == pytest.approx(1 / 4)
+
@@ -0,0 +1,173 @@
+"""
+ImageProcessor.analyze trên mô hình giả: lọc box, tọa độ và phân loại
+"""
+import numpy as np
+import pytest
+
+from core.backends import result_to_arrays
+from core.classification import FruitClassifier
+from core.config import AGRICULTURAL_PRODUCTS
+from processing.image_processor import ImageProcessor, inference_preprocess
+from tests.conftest import fake_detection_model, synthetic_frame
+
+# Box theo tỷ lệ cạnh ảnh: (x1, y1, x2, y2, conf, cls)
+ROWS = [
+    (0.05, 0.05, 0.30, 0.40, 0.90, 47),  # apple
+    (0.40, 0.10, 0.70, 0.50, 0.55, 46),  # banana sát ngưỡng
+    (0.10, 0.50, 0.35, 0.90, 0.45, 49),  # orange dưới ngưỡng mặc định
+    (0.60, 0.55, 0.95, 0.95, 0.80, 0),   # person: không phải sản phẩm
+    (0.50, 0.50, 0.50, 0.80, 0.95, 52),  # tomato rỗng (x1 == x2)
+    (0.20, 0.20, 0.60, 0.60, 0.70, 52),  # tomato
+]
+
+
+def make_processor(rows=ROWS):
+    return ImageProcessor(fake_detection_model(rows), FruitClassifier())
+
+
+def reference_detections(processor, image, settings):
+    """Vòng lặp từng box của bản cũ: dự đoán mọi lớp rồi lọc, cắt và analyze_object"""
+    confidence = settings.get('confidence', 0.5)
+    product_type = settings.get('product_type', 'auto')
+    result = processor.model.backend.predict([image], confidence)[0]
+    detections = []
+    for (x1, y1, x2, y2), conf, cls in zip(*[array.tolist() for array in result_to_arrays(result)]):
+        class_name = result.names[cls]
+        wanted = class_name in AGRICULTURAL_PRODUCTS if product_type == 'auto' else class_name == product_type
+        obj_img = image[int(y1):int(y2), int(x1):int(x2)]
+        if wanted and conf > confidence and obj_img.size > 0:
+            detections.append(processor.classifier.analyze_object(
+                obj_img, class_name, (x1, y1, x2, y2),
+                settings.get('enable_quality', True), settings.get('enable_size', True)))
+    return detections
+
+
+@pytest.mark.parametrize('product_type', ['auto', 'apple', 'tomato', 'orange'])
+@pytest.mark.parametrize('confidence', [0.5, 0.3])
+def test_analyze_matches_per_box_loop(product_type, confidence):
+    processor = make_processor()
+    image = synthetic_frame(0)
+    settings = {'enable_preprocessing': False, 'confidence': confidence, 'product_type': product_type}
+
+    result = processor.analyze(None, image, settings)
+
+    assert result['detections'] == reference_detections(processor, image, settings)
+    assert len(result['boxes']) == len(result['scores']) == len(result['class_ids']) == len(result['detections'])
+    for box, class_id, detection in zip(result['boxes'].tolist(), result['class_ids'], result['detections']):
+        assert detection['class'] == processor.model.class_names[class_id]
+        assert tuple(detection['bbox']) == pytest.approx(tuple(box))
+
+
+def test_analyze_asks_model_only_for_product_classes():
+    processor = make_processor()
+    processor.analyze(None, synthetic_frame(0), {'enable_preprocessing': False, 'product_type': 'banana'})
+    (_, confidence, classes, _), = processor.model.backend.calls
+    assert confidence == 0.5
+    assert classes == [46]
+
+
+def test_filter_detections_drops_unknown_low_and_other_classes():
+    processor = make_processor()
+    xyxy = np.arange(24, dtype=np.float32).reshape(6, 4)
+    conf = np.array([0.9, 0.9, 0.2, 0.9, 0.9, 0.6], dtype=np.float32)
+    cls = np.array([47, 0, 46, 90, 200, 52], dtype=np.int64)
+
+    boxes, scores, class_ids = processor._filter_detections(xyxy, conf, cls, {})
+    assert class_ids.tolist() == [47, 52]
+    assert boxes.tolist() == xyxy[[0, 5]].tolist()
+    assert scores.tolist() == conf[[0, 5]].tolist()
+
+
+def test_analyze_without_boxes_is_empty():
+    result = make_processor([]).analyze(None, synthetic_frame(0), {'enable_preprocessing': False})
+    assert result['detections'] == []
+    assert result['boxes'].shape == (0, 4)
+
+
+def square_detector(color=(0, 0, 255)):
+    """Trả về box bao các pixel đúng màu color (lớp apple)"""
+    def detect(image):
+        ys, xs = np.nonzero(np.all(image == color, axis=2))
+        if not len(xs):
+            return []
+        return [(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.9, 47)]
+    return detect
+
+
+def square_frame():
+    image = np.full((960, 1280, 3), 128, dtype=np.uint8)
+    image[400:480, 600:720] = (0, 0, 255)
+    return image
+
+
+@pytest.mark.parametrize('shape', [(960, 1280), (1280, 960), (300, 200), (640, 640)])
+def test_resize_to_model_makes_long_side_input_size(shape):
+    processor = make_processor()
+    image = synthetic_frame(0, shape)
+    resized, (sx, sy) = processor.resize_to_model(image, 640)
+    assert max(resized.shape[:2]) == 640
+    assert (sx, sy) == (resized.shape[1] / shape[1], resized.shape[0] / shape[0])
+
+
+def test_model_resize_mode_runs_model_at_input_size_and_reports_original_frame():
+    processor = ImageProcessor(fake_detection_model(square_detector()), FruitClassifier())
+    image = square_frame()
+
+    result = processor.analyze(None, image, {'enable_preprocessing': False, 'resize_mode': 'model'})
+
+    (model_shape, _, _, _), = processor.model.backend.calls
+    assert model_shape == (480, 640)
+    assert result['original_image'].shape == image.shape
+    assert result['boxes'].tolist() == [[600, 400, 720, 480]]
+    assert result['crop_scale'] == (0.5, 0.5)
+
+
+def test_model_resize_mode_preprocesses_at_model_resolution():
+    processor = make_processor()
+    image = synthetic_frame(0, (960, 1280))
+    frame = processor._prepare_frame(None, image, {'resize_mode': 'model'})
+    expected = processor.preprocess_image(processor.resize_to_model(image)[0], target_size=None)
+    np.testing.assert_array_equal(frame['model_image'], expected)
+    assert frame['image'] is not image and np.array_equal(frame['image'], image)
+
+
+def test_multi_resolution_detects_small_and_classifies_original_crops():
+    processor = ImageProcessor(fake_detection_model(square_detector()), FruitClassifier())
+    image = square_frame()
+    image[100:300, 100:300] = synthetic_frame(1, (200, 200))
+    processor.model.backend.rows = lambda small: square_detector()(small) + [(50, 50, 150, 150, 0.8, 52)]
+    settings = {'enable_preprocessing': False, 'multi_resolution': True,
+                'detection_resolution': (640, 480)}
+
+    result = processor.analyze(None, image, settings)
+
+    (model_shape, _, _, _), = processor.model.backend.calls
+    assert model_shape == (480, 640)
+    assert result['boxes'].tolist() == [[600, 400, 720, 480], [100, 100, 300, 300]]
+    assert result['crop_image'] is result['original_image']
+    for (x1, y1, x2, y2), detection in zip(result['boxes'].astype(int).tolist(), result['detections']):
+        expected = processor.classifier.analyze_object(image[y1:y2, x1:x2], detection['class'],
+                                                       (x1, y1, x2, y2))
+        assert detection['quality'] == expected['quality']
+        assert detection['quality_score'] == pytest.approx(expected['quality_score'])
+
+
+def test_multi_resolution_can_limit_classification_resolution():
+    processor = make_processor()
+    image = synthetic_frame(0, (960, 1280))
+    frame = processor._prepare_frame(None, image, {
+        'enable_preprocessing': False, 'multi_resolution': True,
+        'detection_resolution': (320, 240), 'classification_resolution': (640, 480)})
+    assert frame['model_image'].shape[:2] == (240, 320)
+    assert frame['detection_scale'] == (0.25, 0.25)
+    assert frame['crop_image'].shape[:2] == (480, 640)
+    assert frame['crop_scale'] == (0.5, 0.5)
+
+
+@pytest.mark.parametrize('settings', [{}, {'resize_mode': 'model'}, {'enable_preprocessing': False},
+                                      {'resize_mode': 'model', 'enable_preprocessing': False}])
+def test_inference_preprocess_matches_model_input(settings):
+    processor = make_processor()
+    image = synthetic_frame(2, (720, 1000))
+    expected = processor._prepare_frame(None, image, settings)['model_image']
+    np.testing.assert_array_equal(inference_preprocess(640, settings)(image), expected)
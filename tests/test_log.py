@@ -0,0 +1,124 @@
+"""
+Lọc tần suất log theo vị trí gọi và định dạng JSON Lines
+"""
+import json
+import logging
+import sys
+
+import pytest
+
+from core import log
+from core.log import JsonFormatter, RateLimitFilter, configure_logging, get_logger
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(log.time, 'monotonic', clock)
+    return clock
+
+
+def record(level=logging.DEBUG, line=10, msg="giá trị %s", args=(1,), **extra):
+    entry = logging.LogRecord('fruit.test', level, 'module.py', line, msg, args, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def allowed(rate_filter, count, **kwargs):
+    records = [record(**kwargs) for _ in range(count)]
+    return [rate_filter.filter(r) for r in records], records
+
+
+def test_sampling_keeps_every_nth_record_per_call_site(clock):
+    rate_filter = RateLimitFilter(rate=0, sample_every=3)
+    kept, records = allowed(rate_filter, 7)
+    assert kept == [True, False, False, True, False, False, True]
+    assert [r.suppressed for r, k in zip(records, kept) if k] == [0, 2, 2]
+
+
+def test_token_bucket_limits_bursts_and_refills(clock):
+    rate_filter = RateLimitFilter(rate=10, burst=3)
+    kept, _ = allowed(rate_filter, 5)
+    assert kept == [True, True, True, False, False]
+
+    clock.now += 0.15  # thêm 1,5 token
+    kept, records = allowed(rate_filter, 2)
+    assert kept == [True, False]
+    assert records[0].suppressed == 2
+
+
+def test_call_sites_and_errors_are_limited_separately(clock):
+    rate_filter = RateLimitFilter(rate=1, burst=1)
+    assert allowed(rate_filter, 2, line=10)[0] == [True, False]
+    assert allowed(rate_filter, 1, line=11)[0] == [True]
+    assert allowed(rate_filter, 3, line=10, level=logging.ERROR)[0] == [True, True, True]
+
+
+def test_record_is_decided_once_for_all_handlers(clock):
+    rate_filter = RateLimitFilter(rate=1, burst=1)
+    first = record()
+    assert rate_filter.filter(first) and rate_filter.filter(first)
+    second = record()
+    assert not rate_filter.filter(second) and not rate_filter.filter(second)
+    assert rate_filter._buckets[('fruit.test', 'module.py', 10)][3] == 1
+
+
+def test_json_formatter_merges_data_and_counts():
+    entry = json.loads(JsonFormatter().format(record(level=logging.INFO, data={'ratios': {'chin': 0.5}},
+                                                     suppressed=4)))
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'fruit.test'
+    assert entry['message'] == 'giá trị 1'
+    assert entry['line'] == 10
+    assert entry['ratios'] == {'chin': 0.5}
+    assert entry['suppressed'] == 4
+
+
+def test_json_formatter_includes_exception():
+    try:
+        raise ValueError('hỏng')
+    except ValueError:
+        entry = json.loads(JsonFormatter().format(record(level=logging.ERROR, exc_info=sys.exc_info())))
+    assert 'ValueError: hỏng' in entry['exception']
+    assert 'suppressed' not in entry
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger(log.ROOT_LOGGER)
+    state = (root.level, root.propagate, list(root.handlers))
+    yield
+    for handler in list(log._handlers):
+        root.removeHandler(handler)
+        handler.close()
+    log._handlers.clear()
+    root.setLevel(state[0])
+    root.propagate = state[1]
+    root.handlers[:] = state[2]
+    get_logger('core.test').setLevel(logging.NOTSET)
+
+
+def test_configure_logging_writes_json_lines(tmp_path, restore_logging):
+    path = tmp_path / 'log.jsonl'
+    settings = {'console': False, 'json_path': str(path), 'levels': {'core.test': 'DEBUG'}}
+    configure_logging(settings)
+    root = configure_logging(settings)  # gọi lại không nhân đôi handler
+    assert len(root.handlers) == 1
+
+    logger = get_logger('core.test')
+    logger.debug("tỷ lệ %.2f", 0.25, extra={'data': {'ratio': 0.25}})
+    get_logger('core.other').debug("không ghi")
+    for handler in root.handlers:
+        handler.flush()
+
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [(entry['logger'], entry['message'], entry['ratio']) for entry in lines] == [
+        ('fruit.core.test', 'tỷ lệ 0.25', 0.25)]
@@ -0,0 +1,136 @@
+"""
+Bộ đệm mô hình: manifest, checksum, tạo lại khi hỏng và xuất ONNX không ghi đè file sẵn có
+"""
+import hashlib
+import json
+import sys
+import types
+
+import pytest
+
+from core.backends import OnnxRuntimeBackend
+from core.model_cache import MANIFEST_NAME, ModelCache, file_sha256
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Thay bước gộp lớp (cần torch) bằng bản ghi nội dung trọng số, đếm số lần tạo"""
+    calls = []
+
+    def fake_build(weights_path, output_path):
+        calls.append(weights_path)
+        output_path.write_bytes(b'fused:' + weights_path.read_bytes())
+
+    monkeypatch.setattr(ModelCache, '_build_fused_checkpoint', staticmethod(fake_build))
+    return calls
+
+
+@pytest.fixture
+def weights(tmp_path):
+    path = tmp_path / 'models' / 'yolo.pt'
+    path.parent.mkdir()
+    path.write_bytes(b'weights-v1')
+    return path
+
+
+def test_file_sha256_matches_hashlib(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'abc' * 1000)
+    assert file_sha256(path) == hashlib.sha256(b'abc' * 1000).hexdigest()
+    path.write_bytes(b'')
+    assert file_sha256(path) == hashlib.sha256(b'').hexdigest()
+
+
+def test_resolve_builds_once_and_writes_manifest(tmp_path, weights, builds):
+    cache = ModelCache(tmp_path / 'cache')
+    artifact = cache.resolve(weights)
+
+    assert artifact.read_bytes() == b'fused:weights-v1'
+    manifest = json.loads((artifact.parent / MANIFEST_NAME).read_text(encoding='utf-8'))
+    assert manifest['backend'] == 'ultralytics'
+    assert manifest['artifact'] == artifact.name
+    assert manifest['source_sha256'] == file_sha256(weights)
+    assert manifest['artifact_sha256'] == file_sha256(artifact)
+    assert cache.entries() == [manifest]
+
+    assert cache.resolve(weights) == artifact
+    assert len(builds) == 1
+
+
+def test_checksum_mismatch_rebuilds_entry(tmp_path, weights, builds, caplog):
+    cache = ModelCache(tmp_path / 'cache')
+    artifact = cache.resolve(weights)
+    artifact.write_bytes(b'truncated')
+    assert not cache.verify(artifact.parent)
+
+    assert cache.resolve(weights) == artifact
+    assert artifact.read_bytes() == b'fused:weights-v1'
+    assert len(builds) == 2
+    assert 'bị hỏng' in caplog.text
+
+
+def test_unreadable_manifest_rebuilds_entry(tmp_path, weights, builds):
+    cache = ModelCache(tmp_path / 'cache')
+    artifact = cache.resolve(weights)
+    (artifact.parent / MANIFEST_NAME).write_text('{not json', encoding='utf-8')
+    assert not cache.verify(artifact.parent)
+    cache.resolve(weights)
+    assert len(builds) == 2
+
+
+def test_changed_weights_get_new_entry(tmp_path, weights, builds):
+    cache = ModelCache(tmp_path / 'cache')
+    first = cache.resolve(weights)
+    weights.write_bytes(b'weights-v2')
+    second = cache.resolve(weights)
+    assert second.parent != first.parent
+    assert second.read_bytes() == b'fused:weights-v2'
+    assert len(cache.entries()) == 2
+
+
+def test_failed_build_leaves_no_entry(tmp_path, weights, monkeypatch):
+    def broken_build(weights_path, output_path):
+        output_path.write_bytes(b'partial')
+        raise RuntimeError('hỏng')
+
+    monkeypatch.setattr(ModelCache, '_build_fused_checkpoint', staticmethod(broken_build))
+    cache = ModelCache(tmp_path / 'cache')
+    with pytest.raises(RuntimeError):
+        cache.resolve(weights)
+    assert list((tmp_path / 'cache').iterdir()) == []
+
+
+def test_missing_weights_and_unknown_backend(tmp_path, weights):
+    cache = ModelCache(tmp_path / 'cache')
+    with pytest.raises(FileNotFoundError):
+        cache.resolve(tmp_path / 'missing.pt')
+    assert cache.resolve(weights, 'other') == weights
+
+
+def test_export_does_not_touch_onnx_next_to_weights(tmp_path, weights, monkeypatch):
+    class FakeYOLO:
+        """ultralytics ghi <stem>.onnx cạnh file trọng số được truyền vào"""
+
+        def __init__(self, path):
+            self.path = path
+
+        def export(self, format, imgsz, dynamic):
+            exported = self.path[:-len('.pt')] + '.onnx'
+            with open(exported, 'wb') as f:
+                f.write(b'exported')
+            return exported
+
+    monkeypatch.setitem(sys.modules, 'ultralytics', types.SimpleNamespace(YOLO=FakeYOLO))
+    user_onnx = weights.with_suffix('.onnx')
+    user_onnx.write_bytes(b'user-model')
+    output_dir = tmp_path / 'exports'
+
+    onnx_path = OnnxRuntimeBackend.export(weights, output_dir=output_dir)
+
+    assert onnx_path == output_dir / 'yolo.onnx'
+    assert onnx_path.read_bytes() == b'exported'
+    assert user_onnx.read_bytes() == b'user-model'
+    assert sorted(p.name for p in output_dir.iterdir()) == ['yolo.onnx']
+    # Đã có file thì không xuất lại
+    onnx_path.write_bytes(b'cached')
+    assert OnnxRuntimeBackend.export(weights, output_dir=output_dir).read_bytes() == b'cached'
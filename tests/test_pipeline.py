@@ -0,0 +1,141 @@
+"""
+Pipeline tiền xử lý: gộp thao tác theo pixel, chạy theo dải và so với chuỗi tuần tự cũ
+"""
+import cv2
+import numpy as np
+import pytest
+
+from processing.pipeline import (
+    CONVERSIONS,
+    PIPELINE_PRESETS,
+    PipelineError,
+    PreprocessingPipeline,
+    build_pipeline
+)
+from processing.preprocessing import simple_white_balance
+from tests.conftest import synthetic_frame
+
+
+def legacy_enhanced(image, white_balance=True):
+    """Chuỗi tuần tự cũ của preprocess_image (gamma như skimage.exposure.adjust_gamma với uint8)"""
+    l, a, b = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2LAB))
+    l = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(l)
+    image = cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
+    image = cv2.medianBlur(image, 3)
+    image = cv2.LUT(image, (255 * (np.arange(256) / 255) ** 0.8).astype(np.uint8))
+    h, s, v = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))
+    s = cv2.multiply(s, 1.2)
+    v = cv2.multiply(v, 1.1)
+    image = cv2.cvtColor(cv2.merge([h, s, v]), cv2.COLOR_HSV2BGR)
+    gaussian = cv2.GaussianBlur(image, (0, 0), 2.0)
+    image = cv2.addWeighted(image, 1.5, gaussian, -0.5, 0)
+    if white_balance:
+        image = simple_white_balance(image)
+    return cv2.bilateralFilter(image, 9, 75, 75)
+
+
+def test_enhanced_matches_legacy_without_white_balance_round_trip():
+    for seed in range(3):
+        image = synthetic_frame(seed)
+        expected = legacy_enhanced(image, white_balance=False)
+        np.testing.assert_array_equal(build_pipeline('enhanced').run(image), expected)
+
+
+def test_enhanced_stays_within_documented_bound_of_legacy():
+    for seed in range(5):
+        image = synthetic_frame(seed)
+        diff = np.abs(build_pipeline('enhanced').run(image).astype(int)
+                      - legacy_enhanced(image).astype(int))
+        assert diff.max() <= 10
+        assert (diff > 3).mean() < 0.001
+
+
+def legacy_default(image, target_size):
+    """ImageProcessor.preprocess_image cũ: resize, CLAHE, NLM và chuẩn hóa float32"""
+    h, w = image.shape[:2]
+    scale = min(target_size[0] / w, target_size[1] / h)
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    image = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=interpolation)
+    l, a, b = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2LAB))
+    l = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(l)
+    image = cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
+    image = cv2.fastNlMeansDenoisingColored(image, None, h=10, hColor=10,
+                                            templateWindowSize=7, searchWindowSize=21)
+    image = image.astype(np.float32) / 255.0
+    image = (image - image.mean()) / (image.std() + 1e-8)
+    image = np.clip(image, -3, 3)
+    image = (image - image.min()) / (image.max() - image.min() + 1e-8)
+    return (image * 255).astype(np.uint8)
+
+
+def unfused_run(pipeline, image, target_size=None):
+    """Chạy kế hoạch từng thao tác một trên cả ảnh (không gộp bảng tra, không chia dải)"""
+    context = {'target_size': target_size, 'denoise_tier': pipeline.denoise_tier}
+    for step in pipeline.plan:
+        if step[0] != 'fused':
+            image = step[1].func(image, context)
+            continue
+        for kind, *rest in step[1]:
+            if kind == 'convert':
+                image = cv2.cvtColor(image, CONVERSIONS[rest[0]])
+                continue
+            stage, table = rest
+            table = table if table is not None else stage.func(image, context)
+            if table is not None:
+                image = cv2.LUT(image, table)
+    return image
+
+
+def test_default_matches_legacy_within_one_level():
+    image = synthetic_frame(0, (300, 400))
+    diff = np.abs(build_pipeline('default', denoise_tier='nlm').run(image, (200, 150)).astype(int)
+                  - legacy_default(image, (200, 150)).astype(int))
+    assert diff.max() <= 1
+    assert (diff > 0).mean() < 0.01
+
+
+@pytest.mark.parametrize('stages', [
+    PIPELINE_PRESETS['enhanced'],
+    ['gamma', 'color_boost', 'normalize', 'gamma'],
+    ['enhance_contrast', 'color_boost', 'white_balance', 'gamma', 'sharpen', 'normalize'],
+])
+def test_fused_groups_match_step_by_step(stages):
+    pipeline = build_pipeline(stages, denoise_tier='none')
+    image = synthetic_frame(3)
+    np.testing.assert_array_equal(pipeline.run(image), unfused_run(pipeline, image))
+
+
+@pytest.mark.parametrize('strip_rows', [1, 7, 64, 10000])
+def test_strip_size_does_not_change_output(strip_rows):
+    image = synthetic_frame(4, (123, 157))
+    stages = ['gamma', 'color_boost', 'normalize', 'enhance_contrast']
+    expected = build_pipeline(stages, strip_rows=10 ** 6, denoise_tier='none').run(image)
+    np.testing.assert_array_equal(build_pipeline(stages, strip_rows, 'none').run(image), expected)
+
+
+def test_plan_fuses_pointwise_steps_and_drops_identities():
+    plan = build_pipeline('enhanced').describe()
+    assert 'gamma+bgr→hsv+color_boost+hsv→bgr' in plan
+    assert not any('white_balance' in group for group in plan)
+    # Bảng tra thích nghi bắt đầu nhóm mới (bảng tính từ ảnh đầu vào của nhóm)
+    assert build_pipeline(['gamma', 'normalize', 'gamma']).describe() == ['gamma', 'normalize+gamma']
+
+
+def test_run_leaves_input_untouched_and_reports_timings():
+    image = synthetic_frame(5)
+    original = image.copy()
+    pipeline = build_pipeline('enhanced')
+    timings = {}
+    pipeline.run(image, timings=timings)
+    np.testing.assert_array_equal(image, original)
+    assert list(timings) == pipeline.describe()
+    assert set(pipeline.report()) == set(timings)
+
+    empty = PreprocessingPipeline([])
+    result = empty.run(image)
+    assert result is not image and np.array_equal(result, image)
+
+
+def test_unknown_stage_raises():
+    with pytest.raises(PipelineError):
+        build_pipeline(['resize', 'no_such_stage'])
@@ -0,0 +1,144 @@
+"""
+Kiểm tra quy tắc màu (vòng Hue qua màu đỏ, khoảng chồng lấn, lỗi cấu trúc) và nạp lại từ file
+"""
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from core.classification import FruitClassifier
+from core.config import CLASSIFICATION_RULES, DEFAULT_SETTINGS
+from core.rules import RuleError, RuleWatcher, compile_ruleset, export_rules, validate_rules
+
+
+def test_default_rules_are_valid():
+    normalized, _ = validate_rules(CLASSIFICATION_RULES)
+    assert set(normalized) == set(CLASSIFICATION_RULES)
+
+
+def test_hue_wrap_is_split_in_two_ranges():
+    rules = {'apple': {'color_ranges': {'chin': [[[170, 50, 50], [10, 255, 255]]]}}}
+    normalized, warnings = validate_rules(rules)
+    assert normalized['apple']['color_ranges']['chin'] == [
+        [[170, 50, 50], [179, 255, 255]],
+        [[0, 50, 50], [10, 255, 255]]
+    ]
+    assert any('vòng qua 0' in warning for warning in warnings)
+
+
+def test_overlap_between_qualities_warns():
+    rules = {'apple': {'color_ranges': {
+        'chin': [[[0, 100, 100], [20, 255, 255]]],
+        'xanh': [[[15, 50, 50], [40, 255, 255]]]
+    }}}
+    _, warnings = validate_rules(rules)
+    assert len(warnings) == 1
+    assert "'chin' và 'xanh' giao nhau" in warnings[0]
+    assert "(15, 100, 100) -> (20, 255, 255)" in warnings[0]
+
+
+def test_overlap_within_one_quality_is_allowed():
+    rules = {'apple': {'color_ranges': {'chin': [[[0, 0, 0], [20, 255, 255]],
+                                                 [[10, 0, 0], [30, 255, 255]]]}}}
+    assert validate_rules(rules)[1] == []
+
+
+@pytest.mark.parametrize('rules', [
+    {},
+    {'apple': {}},
+    {'apple': {'color_ranges': {'chin': [[[0, 0, 0]]]}}},
+    {'apple': {'color_ranges': {'chin': [[[0, 0, 0], [10, 255, 300]]]}}},
+    {'apple': {'color_ranges': {'chin': [[[0, 200, 0], [10, 100, 255]]]}}},
+    {'apple': {'color_ranges': {'chin': [[[float('nan'), 0, 0], [10, 255, 255]]]}}},
+    {'apple': {'color_ranges': {'chin': [[[float('inf'), 0, 0], [10, 255, 255]]]}}},
+    {'apple': {'color_ranges': {'chin': [[[0.5, 0, 0], [10, 255, 255]]]}}},
+])
+def test_invalid_rules_raise(rules):
+    with pytest.raises(RuleError):
+        validate_rules(rules)
+
+
+def test_compiled_ruleset_counts_wrapped_hue():
+    ruleset = compile_ruleset({'apple': {'color_ranges': {'chin': [[[170, 50, 50], [10, 255, 255]]]}}})
+    hsv = np.zeros((1, 4, 3), dtype=np.uint8)
+    hsv[0] = [[175, 200, 200], [5, 200, 200], [90, 200, 200], [5, 10, 200]]
+    assert ruleset.tables['apple'].quality_ratios(hsv)['chin'] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize('threshold', ['abc', float('nan'), float('inf'), -0.1, 1.5, True, [0.2]])
+def test_invalid_threshold_raises(threshold):
+    with pytest.raises(RuleError):
+        compile_ruleset(CLASSIFICATION_RULES, threshold)
+
+
+def test_ruleset_carries_threshold():
+    ruleset = compile_ruleset(CLASSIFICATION_RULES, 0.3)
+    assert ruleset.threshold == 0.3
+    assert compile_ruleset(CLASSIFICATION_RULES).threshold == DEFAULT_SETTINGS['color_classification_threshold']
+    changed = ruleset.with_threshold(0.4)
+    assert changed.threshold == 0.4 and changed.tables is ruleset.tables
+
+
+def test_classifier_threshold_follows_ruleset():
+    classifier = FruitClassifier()
+    classifier.apply_ruleset(compile_ruleset(CLASSIFICATION_RULES, 0.3))
+    assert classifier.color_threshold == 0.3
+    tables = classifier.rule_tables
+    classifier.color_threshold = 0.25
+    assert classifier.ruleset.threshold == 0.25
+    assert classifier.rule_tables is tables
+
+
+def write_rules(path, data, stamp):
+    """Ghi file quy tắc với thời điểm sửa riêng để watcher luôn thấy thay đổi"""
+    path.write_text(json.dumps(data), encoding='utf-8')
+    os.utime(path, ns=(stamp, stamp))
+
+
+def test_watcher_reloads_and_keeps_rules_on_bad_file(tmp_path):
+    path = export_rules(tmp_path / 'rules.json', threshold=0.3)
+    classifier = FruitClassifier()
+    watcher = RuleWatcher(classifier, path)
+
+    assert watcher.check()
+    assert classifier.color_threshold == 0.3
+    assert not watcher.check()  # file không đổi
+
+    data = json.loads(path.read_text(encoding='utf-8'))
+    good = classifier.ruleset
+    for stamp, bad in enumerate(['abc', float('nan'), 2.0], start=1):
+        write_rules(path, dict(data, color_classification_threshold=bad), stamp * 10 ** 9)
+        assert not watcher.check()
+        assert watcher.last_error
+        assert classifier.ruleset is good
+
+    path.write_text('{not json', encoding='utf-8')
+    os.utime(path, ns=(5 * 10 ** 9, 5 * 10 ** 9))
+    assert not watcher.check() and classifier.ruleset is good
+
+    del data['color_classification_threshold']
+    write_rules(path, data, 6 * 10 ** 9)
+    assert watcher.check()
+    assert watcher.last_error is None
+    assert classifier.color_threshold == DEFAULT_SETTINGS['color_classification_threshold']
+
+
+def test_watcher_thread_survives_unexpected_errors(tmp_path, monkeypatch):
+    path = export_rules(tmp_path / 'rules.json')
+    watcher = RuleWatcher(FruitClassifier(), path, interval=0.1)
+    watcher.start()
+    try:
+        def broken_check():
+            raise OverflowError('lỗi bất ngờ')
+
+        monkeypatch.setattr(watcher, 'check', broken_check)
+        deadline = time.monotonic() + 5
+        while watcher.last_error is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert watcher.last_error == 'lỗi bất ngờ'
+        assert watcher._thread.is_alive()
+    finally:
+        watcher.stop()
+    assert watcher._thread is None
@@ -0,0 +1,140 @@
+"""
+Bộ đệm kết quả phát hiện (bỏ ảnh của mục cũ, bỏ mục dùng lâu nhất) và phân loại lại không chạy YOLO
+"""
+import cv2
+import numpy as np
+import pytest
+
+from core.classification import FruitClassifier
+from core.config import CLASSIFICATION_RULES
+from core.rules import compile_ruleset
+from processing.image_processor import ImageProcessor
+from processing.run_cache import RunCache
+from tests.conftest import fake_detection_model, synthetic_frame
+
+
+def fake_result(index):
+    image = np.full((4, 6, 3), index, dtype=np.uint8)
+    return {
+        'original_image': image,
+        'boxes': np.array([[0, 0, 2, 2]], dtype=np.float32),
+        'scores': np.array([0.9], dtype=np.float32),
+        'class_ids': np.array([0]),
+        'names': {0: 'apple'},
+        'crop_image': image,
+        'crop_scale': (1.0, 1.0)
+    }
+
+
+def fill(cache, count):
+    for i in range(count):
+        cache.store(f"{i}.jpg", fake_result(i), {'confidence': 0.5})
+
+
+def test_old_entries_drop_frames_but_keep_boxes():
+    cache = RunCache(max_entries=3, max_box_entries=10)
+    fill(cache, 6)
+
+    assert len(cache) == 6
+    for i in range(6):
+        entry = cache.get(f"{i}.jpg")
+        assert entry['boxes'].tolist() == [[0, 0, 2, 2]]
+        assert entry['shape'] == (4, 6, 3)
+        assert (entry['image'] is None) == (i < 3)
+        assert (entry['crop_image'] is None) == (i < 3)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RunCache(max_entries=2, max_box_entries=3)
+    fill(cache, 3)
+    cache.get("0.jpg")  # dùng lại: không còn là mục cũ nhất
+    cache.store("3.jpg", fake_result(3), {})
+
+    assert cache.keys() == ["2.jpg", "0.jpg", "3.jpg"]
+    assert "1.jpg" not in cache
+    assert cache.get("1.jpg") is None
+
+
+def test_restoring_entry_keeps_frames_again():
+    cache = RunCache(max_entries=1, max_box_entries=5)
+    fill(cache, 2)
+    assert cache.get("0.jpg")['image'] is None
+    cache.store("0.jpg", fake_result(0), {})
+    assert cache.get("0.jpg")['image'] is not None
+    assert cache.get("1.jpg")['image'] is None
+
+
+def test_settings_are_copied_and_clear():
+    cache = RunCache()
+    settings = {'confidence': 0.5}
+    cache.store("a.jpg", fake_result(0), settings)
+    settings['confidence'] = 0.9
+    assert cache.get("a.jpg")['settings'] == {'confidence': 0.5}
+    cache.clear()
+    assert len(cache) == 0
+
+
+ROWS = [(0.05, 0.05, 0.45, 0.50, 0.9, 47), (0.50, 0.40, 0.95, 0.95, 0.8, 52)]
+SETTINGS = {'enable_preprocessing': False}
+
+
+@pytest.fixture
+def analyzed(tmp_path):
+    """ImageProcessor đã phân tích 5 ảnh, bộ đệm chỉ giữ khung hình của 2 ảnh gần nhất"""
+    processor = ImageProcessor(fake_detection_model(ROWS), FruitClassifier())
+    processor.run_cache = RunCache(max_entries=2, max_box_entries=10)
+    paths = []
+    for seed in range(5):
+        path = str(tmp_path / f"{seed}.png")
+        cv2.imwrite(path, synthetic_frame(seed))
+        paths.append(path)
+    results = processor.analyze_batch(paths, SETTINGS)
+    return processor, paths, results
+
+
+def test_reclassify_uses_cached_boxes_without_model(analyzed):
+    processor, paths, results = analyzed
+    calls = len(processor.model.backend.calls)
+
+    batch = processor.reclassify_batch()
+    assert len(processor.model.backend.calls) == calls
+    assert [entry['image_path'] for entry in batch['results']] == paths
+    for entry, result in zip(batch['results'], results):
+        assert entry['result']['detections'] == result['detections']
+        assert entry['result']['boxes'].tolist() == result['boxes'].tolist()
+    assert 'statistics' in batch
+
+
+def test_old_entries_are_decoded_again(analyzed):
+    processor, paths, results = analyzed
+    assert processor.run_cache.get(paths[0])['image'] is None
+    result = processor.reclassify(paths[0])
+    assert result['detections'] == results[0]['detections']
+    np.testing.assert_array_equal(result['original_image'], results[0]['original_image'])
+
+
+def test_reclassify_follows_new_rules(analyzed):
+    processor, paths, results = analyzed
+    processor.classifier.apply_ruleset(compile_ruleset(CLASSIFICATION_RULES, 1.0))
+    changed = False
+    for path, result in zip(paths, results):
+        expected = [processor.classifier.analyze_object(
+            result['original_image'][int(y1):int(y2), int(x1):int(x2)], detection['class'],
+            detection['bbox'])['quality']
+            for (x1, y1, x2, y2), detection in zip(result['boxes'].tolist(), result['detections'])]
+        assert [d['quality'] for d in processor.reclassify(path)['detections']] == expected
+        changed |= expected != [d['quality'] for d in result['detections']]
+    assert changed
+
+
+def test_reclassify_settings_override_and_errors(analyzed, tmp_path):
+    processor, paths, _ = analyzed
+    result = processor.reclassify(paths[-1], {'enable_quality': False})
+    assert {d['quality'] for d in result['detections']} == {'unknown'}
+
+    # Ảnh cũ đã bị thay bằng ảnh khác kích thước: phải phân tích lại
+    cv2.imwrite(paths[0], synthetic_frame(0, (100, 100)))
+    batch = processor.reclassify_batch([paths[0], str(tmp_path / 'missing.png')])
+    assert all('error' in entry for entry in batch['results'])
+    with pytest.raises(ValueError):
+        processor.reclassify(str(tmp_path / 'missing.png'))
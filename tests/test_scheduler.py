@@ -0,0 +1,103 @@
+"""
+Gom lô dự đoán: nhóm theo tham số, kích thước lô tối đa và hạn chờ max_wait_ms
+"""
+import threading
+import time
+
+import pytest
+
+from core.scheduler import BatchScheduler, InferenceRequest
+
+
+class FakeModel:
+    """Mô hình giả ghi lại từng lượt predict_batch"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def predict_batch(self, images, confidence, batch_size, classes, imgsz):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls.append((list(images), confidence, classes, imgsz))
+        return [(image, confidence) for image in images]
+
+    def get_class_names(self):
+        return {0: 'apple'}
+
+
+def test_execute_groups_requests_by_parameters():
+    model = FakeModel()
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=10)
+    requests = [InferenceRequest(i, 0.5 if i % 2 else 0.25, [46] if i < 2 else None, None)
+                for i in range(6)]
+    scheduler._execute(requests)
+
+    assert model.calls == [
+        ([0], 0.25, [46], None),
+        ([1], 0.5, [46], None),
+        ([2, 4], 0.25, None, None),
+        ([3, 5], 0.5, None, None)
+    ]
+    assert [request.future.result() for request in requests] == \
+        [(i, 0.5 if i % 2 else 0.25) for i in range(6)]
+    assert scheduler.stats()['batch_size_histogram'] == {6: 1}
+
+
+def test_idle_request_runs_without_waiting():
+    scheduler = BatchScheduler(FakeModel(), max_batch_size=8, max_wait_ms=2000)
+    start = time.perf_counter()
+    batch = scheduler._collect(InferenceRequest('a', 0.5, None, None))
+    assert len(batch) == 1
+    assert time.perf_counter() - start < 0.5
+
+
+def test_busy_batch_waits_until_deadline():
+    scheduler = BatchScheduler(FakeModel(), max_batch_size=8, max_wait_ms=100)
+    first = InferenceRequest(0, 0.5, None, None)
+    scheduler._queue.put(InferenceRequest(1, 0.5, None, None))
+
+    start = time.perf_counter()
+    batch = scheduler._collect(first)
+    elapsed = time.perf_counter() - start
+    assert [request.image for request in batch] == [0, 1]
+    assert 0.08 <= elapsed < 1.0
+
+
+def test_full_batch_does_not_wait():
+    scheduler = BatchScheduler(FakeModel(), max_batch_size=3, max_wait_ms=2000)
+    for i in range(1, 6):
+        scheduler._queue.put(InferenceRequest(i, 0.5, None, None))
+
+    start = time.perf_counter()
+    batch = scheduler._collect(InferenceRequest(0, 0.5, None, None))
+    assert [request.image for request in batch] == [0, 1, 2]
+    assert scheduler._queue.qsize() == 3
+    assert time.perf_counter() - start < 0.5
+
+
+def test_concurrent_requests_share_batches():
+    model = FakeModel(delay=0.02)
+    with BatchScheduler(model, max_batch_size=4, max_wait_ms=200) as scheduler:
+        results = scheduler.predict_batch(list(range(10)), confidence=0.5)
+        stats = scheduler.stats()
+
+    assert results == [(i, 0.5) for i in range(10)]
+    assert stats['requests'] == 10
+    assert max(stats['batch_size_histogram']) <= 4
+    assert stats['batches'] < 10
+
+
+def test_model_error_is_set_on_futures():
+    class Broken(FakeModel):
+        def predict_batch(self, *args):
+            raise RuntimeError("hỏng")
+
+    with BatchScheduler(Broken(), max_batch_size=2, max_wait_ms=10) as scheduler:
+        with pytest.raises(RuntimeError):
+            scheduler.predict('a')
+
+
+def test_attributes_forward_to_model():
+    assert BatchScheduler(FakeModel()).get_class_names() == {0: 'apple'}
@@ -0,0 +1,96 @@
+"""
+Chia ô (tiled inference): vị trí ô, gộp box ở đường nối và analyze_tiled
+"""
+import numpy as np
+import pytest
+
+from core.classification import FruitClassifier
+from processing.image_processor import ImageProcessor
+from processing.tiling import compute_tiles, merge_tile_detections
+from tests.conftest import fake_detection_model
+
+MARKER = (0, 0, 255)
+
+
+def covered(tiles, shape):
+    mask = np.zeros(shape[:2], dtype=bool)
+    for x1, y1, x2, y2 in tiles:
+        mask[y1:y2, x1:x2] = True
+    return mask.all()
+
+
+def test_small_image_is_one_tile():
+    assert compute_tiles((480, 600), tile_size=640) == [(0, 0, 600, 480)]
+
+
+def test_tiles_cover_image_with_overlap():
+    shape = (1500, 2600)
+    tiles = compute_tiles(shape, tile_size=640, overlap=0.2, max_tiles=100)
+    assert covered(tiles, shape)
+    assert all(x2 - x1 == 640 and y2 - y1 == 640 for x1, y1, x2, y2 in tiles)
+    # Hai ô liền nhau trên một hàng chồng lấn ít nhất 20% cạnh ô
+    row = sorted(t for t in tiles if t[1] == 0)
+    assert all(a[2] - b[0] >= 0.2 * 640 for a, b in zip(row, row[1:]))
+
+
+def test_max_tiles_grows_tile_size():
+    shape = (3000, 4000)
+    tiles = compute_tiles(shape, tile_size=640, overlap=0.2, max_tiles=6)
+    assert len(tiles) <= 6
+    assert covered(tiles, shape)
+    assert tiles[0][2] - tiles[0][0] > 640
+
+
+@pytest.mark.parametrize('max_tiles', [0, -3])
+def test_non_positive_max_tiles_gives_one_tile(max_tiles):
+    assert compute_tiles((3000, 4000), tile_size=640, max_tiles=max_tiles) == [(0, 0, 4000, 3000)]
+
+
+def test_merge_keeps_best_of_seam_duplicates():
+    xyxy = np.array([
+        [100, 100, 200, 200],   # box đầy đủ
+        [102, 101, 201, 199],   # trùng (IoU cao), độ tin cậy thấp hơn
+        [150, 100, 200, 200],   # bị cắt ở mép ô, nằm gọn trong box đầy đủ (IoS cao)
+        [100, 100, 200, 200],   # cùng vị trí nhưng khác lớp
+        [400, 400, 450, 450]    # box riêng
+    ], dtype=np.float32)
+    conf = np.array([0.9, 0.8, 0.7, 0.6, 0.5], dtype=np.float32)
+    cls = np.array([0, 0, 0, 1, 0])
+    keep = merge_tile_detections(xyxy, conf, cls)
+    assert sorted(keep.tolist()) == [0, 3, 4]
+
+
+def test_merge_empty():
+    keep = merge_tile_detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64))
+    assert keep.shape == (0,)
+
+
+
+def marker_detector(full_size):
+    """Phát hiện hình vuông màu MARKER; phần bị cắt ở mép ô có độ tin cậy thấp hơn"""
+    def detect(image):
+        ys, xs = np.nonzero(np.all(image == MARKER, axis=2))
+        if not len(xs):
+            return []
+        x1, y1, x2, y2 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+        visible = (x2 - x1) * (y2 - y1) / full_size ** 2
+        return [(x1, y1, x2, y2, 0.5 + 0.4 * visible, 47)]
+    return detect
+
+
+@pytest.mark.parametrize('max_tiles', [16, 0])
+def test_analyze_tiled_maps_boxes_to_frame_and_merges_seams(max_tiles):
+    image = np.full((1500, 2000, 3), 128, dtype=np.uint8)
+    # Hình vuông nằm vắt qua đường nối giữa hai ô
+    image[500:560, 420:480] = MARKER
+    model = fake_detection_model(marker_detector(60))
+    processor = ImageProcessor(model, FruitClassifier())
+    settings = {'enable_preprocessing': False, 'tiled_inference': True,
+                'tile_size': 640, 'max_tiles': max_tiles}
+
+    result = processor.analyze(None, image, settings)
+
+    assert result['tiles'] == compute_tiles(image.shape, 640, 0.2, max_tiles)
+    assert len(model.backend.calls) == len(result['tiles'])
+    assert result['boxes'].tolist() == [[420, 500, 480, 560]]
+    assert result['scores'] == pytest.approx([0.9])